@@ -0,0 +1,261 @@
+"""
+Batch API mode for offline sweeps
+
+Writes every request of a sweep to /v1/batches JSONL input files, submits
+them, polls until they finish and joins the outputs back to
+transcript_index, producing the same per-cell results rows as
+ImprovementTester.stream_sweep so the normal accuracy and report path applies.
+
+Progress is kept in a state file in a subdirectory of the batch directory
+named after a fingerprint of the sweep's requests. Running the same sweep
+again with the same --batch-dir resumes: uploaded files and submitted batches
+are not re-submitted, and finished outputs are not re-downloaded. A sweep
+with different requests (e.g. the next pending shards) gets a subdirectory
+of its own.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+import openai
+
+from classification import REQUEST_PARAMS, extract_usage, parse_classification, vote
+from prompts import assemble_messages
+from response_cache import make_cache_key
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# Provider limit on requests per batch input file
+MAX_REQUESTS_PER_BATCH = 50_000
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def make_custom_id(method: str, model: str, index: int, sample: int) -> str:
+    return f"{method}|{model}|{index}|{sample}"
+
+
+def parse_custom_id(custom_id: str) -> Tuple[str, str, int, int]:
+    method, model, index, sample = custom_id.split("|")
+    return method, model, int(index), int(sample)
+
+
+def fingerprint_requests(requests: List[Dict]) -> str:
+    """Identifies a sweep, so a state file is never resumed against different inputs"""
+    digest = hashlib.sha256()
+    for request in requests:
+        digest.update(json.dumps(request, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class BatchRunner:
+    def __init__(self, tester, batch_dir: str, poll_interval: float = 30.0):
+        # The tester supplies the client, request params, cache and result parsing
+        self.tester = tester
+        self.batch_dir = batch_dir
+        self.poll_interval = poll_interval
+        # Set by run() from the requests' fingerprint
+        self.sweep_dir = batch_dir
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.sweep_dir, "batch_state.json")
+
+    def _load_state(self) -> Dict:
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _save_state(self, state: Dict) -> None:
+        # Write-then-rename so a crash never leaves a truncated state file
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def build_requests(self, rows_by_cell: Dict[Tuple[str, str], List[Tuple[int, str]]]) -> List[Dict]:
+        """One batch input line per API call for each cell's own rows; ensemble cells get one line per vote"""
+        requests = []
+        for (method, model), rows in rows_by_cell.items():
+            prompt_method = "few_shot" if method == "ensemble" else method
+            samples = self.tester.ensemble_votes if method == "ensemble" else 1
+            for index, transcript in rows:
+                messages = assemble_messages(prompt_method, transcript, suffix=self.tester._cache_buster_comment())
+                for sample in range(samples):
+                    requests.append({
+                        "custom_id": make_custom_id(method, model, index, sample),
+                        "method": "POST",
+                        "url": BATCH_ENDPOINT,
+                        "body": {"model": model, "messages": messages, **REQUEST_PARAMS},
+                    })
+        return requests
+
+    def _write_inputs(self, requests: List[Dict]) -> Dict:
+        os.makedirs(self.sweep_dir, exist_ok=True)
+        parts = []
+        for part_number, start in enumerate(range(0, len(requests), MAX_REQUESTS_PER_BATCH)):
+            input_path = os.path.join(self.sweep_dir, f"batch_input_{part_number:03d}.jsonl")
+            with open(input_path, "w", encoding="utf-8") as f:
+                for request in requests[start:start + MAX_REQUESTS_PER_BATCH]:
+                    f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            parts.append({"input_path": input_path, "input_file_id": None, "batch_id": None,
+                          "status": None, "output_path": None, "error_path": None})
+        return {"fingerprint": fingerprint_requests(requests), "requests": len(requests), "parts": parts,
+                "created_at": datetime.now().isoformat()}
+
+    async def _submit(self, part: Dict) -> None:
+        client = self.tester.client
+        if part["input_file_id"] is None:
+            with open(part["input_path"], "rb") as f:
+                uploaded = await client.files.create(file=f, purpose="batch")
+            part["input_file_id"] = uploaded.id
+        if part["batch_id"] is None:
+            batch = await client.batches.create(
+                input_file_id=part["input_file_id"],
+                endpoint=BATCH_ENDPOINT,
+                completion_window="24h",
+            )
+            part["batch_id"] = batch.id
+            part["status"] = batch.status
+
+    async def _download(self, file_id: str, path: str) -> None:
+        content = await self.tester.client.files.content(file_id)
+        with open(path, "wb") as f:
+            f.write(content.read())
+
+    async def _poll(self, state: Dict) -> None:
+        client = self.tester.client
+        while True:
+            waiting = [p for p in state["parts"] if p["status"] not in TERMINAL_STATUSES]
+            for part in waiting:
+                batch = await client.batches.retrieve(part["batch_id"])
+                part["status"] = batch.status
+                if batch.status in TERMINAL_STATUSES:
+                    number = state["parts"].index(part)
+                    if batch.output_file_id:
+                        part["output_path"] = os.path.join(self.sweep_dir, f"batch_output_{number:03d}.jsonl")
+                        await self._download(batch.output_file_id, part["output_path"])
+                    if batch.error_file_id:
+                        part["error_path"] = os.path.join(self.sweep_dir, f"batch_errors_{number:03d}.jsonl")
+                        await self._download(batch.error_file_id, part["error_path"])
+                self._save_state(state)
+            pending = [p for p in state["parts"] if p["status"] not in TERMINAL_STATUSES]
+            if not pending:
+                return
+            counts = dict(Counter(p["status"] for p in state["parts"]))
+            print(f"Batch status: {counts} - polling again in {self.poll_interval:.0f}s")
+            await asyncio.sleep(self.poll_interval)
+
+    def _read_outputs(self, state: Dict) -> Dict[str, Dict]:
+        """custom_id -> output line, from both output and error files"""
+        outputs = {}
+        for part in state["parts"]:
+            for path in (part["error_path"], part["output_path"]):
+                if not path:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            record = json.loads(line)
+                            outputs[record["custom_id"]] = record
+        return outputs
+
+    def _parse_output(self, method: str, model: str, record: Dict, messages, sample: int) -> Dict:
+        """Classification result for one output line; failed requests become transport failures"""
+        response = record.get("response") or {}
+        if record.get("error") or response.get("status_code") != 200:
+            error = record.get("error") or response.get("body", {}).get("error") or {}
+            return {"intent": None, "transport_error": error.get("message", "Batch request failed"),
+                    "error_class": "BatchRequestError", "attempts": 1}
+        completion = openai.types.chat.ChatCompletion.model_validate(response["body"])
+        content = completion.choices[0].message.content
+        usage = extract_usage(completion)
+        cache = self.tester.cache
+        if cache is not None and content is not None:
+            prompt_method = "few_shot" if method == "ensemble" else method
+            key = make_cache_key(model, prompt_method, messages, dict(REQUEST_PARAMS, sample=sample))
+            cache.put(key, model, prompt_method, {"content": content, "usage": usage})
+        stats = {"usage": usage, "latency": 0.0, "retries": 0, "response_cache_hit": False}
+        try:
+            return parse_classification("few_shot" if method == "ensemble" else method, content, stats)
+        except Exception as e:
+            return {"intent": "voice_unknown", "method": method, "error": str(e), **stats}
+
+    def join_results(self, state: Dict, requests: List[Dict],
+                     rows_by_cell: Dict[Tuple[str, str], List[Tuple[int, str]]]) -> Dict[Tuple[str, str], List[Dict]]:
+        outputs = self._read_outputs(state)
+        missing = {"intent": None, "transport_error": "No output for request", "error_class": "BatchMissingOutput",
+                   "attempts": 1}
+        per_call: Dict[Tuple[str, str, int], List[Dict]] = {}
+        for request in requests:
+            method, model, index, sample = parse_custom_id(request["custom_id"])
+            record = outputs.get(request["custom_id"])
+            if record is None:
+                result = dict(missing)
+            else:
+                result = self._parse_output(method, model, record, request["body"]["messages"], sample)
+            per_call.setdefault((method, model, index), []).append(result)
+
+        classified_at = datetime.now().isoformat()
+        cell_results = {}
+        for (method, model), rows in rows_by_cell.items():
+            results = []
+            for index, transcript in rows:
+                calls = per_call[(method, model, index)]
+                failure = next((c for c in calls if "transport_error" in c), None)
+                if failure is not None:
+                    result = failure
+                elif method == "ensemble":
+                    result = vote(calls)
+                else:
+                    result = calls[0]
+                results.append({
+                    "transcript_index": index,
+                    "transcript": transcript,
+                    "classification_result": result,
+                    "classified_at": classified_at
+                })
+            cell_results[(method, model)] = results
+        return cell_results
+
+    async def run(self, rows_by_cell: Dict[Tuple[str, str], List[Tuple[int, str]]]
+                  ) -> Dict[Tuple[str, str], Tuple[List[Dict], float]]:
+        """Submit (or resume) the sweep as batches, each cell for its own (transcript_index, transcript) rows.
+
+        Returns {(method, model): (results, duration)}, each cell's results in
+        the order of its rows. Every cell gets the duration of the whole run,
+        since the cells share the same batches.
+        """
+        start = time.monotonic()
+        requests = self.build_requests(rows_by_cell)
+        self.sweep_dir = os.path.join(self.batch_dir, fingerprint_requests(requests)[:16])
+        state = self._load_state()
+        if state:
+            print(f"Resuming batch run from {self.state_path}")
+        else:
+            state = self._write_inputs(requests)
+            self._save_state(state)
+            print(f"Wrote {len(requests)} requests in {len(state['parts'])} batch input file(s) to {self.sweep_dir}")
+
+        for part in state["parts"]:
+            if part["batch_id"] is None:
+                await self._submit(part)
+                self._save_state(state)
+                print(f"Submitted {part['input_path']} as {part['batch_id']}")
+
+        await self._poll(state)
+        failed = [p for p in state["parts"] if p["status"] != "completed"]
+        if failed:
+            print(f"Warning: {len(failed)} batch(es) ended as {', '.join(p['status'] for p in failed)}; "
+                  f"their missing requests are reported as transport failures")
+
+        cell_results = self.join_results(state, requests, rows_by_cell)
+        duration = time.monotonic() - start
+        return {cell: (results, duration) for cell, results in cell_results.items()}
+
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Load-test benchmark for the classifier harness
+
+Runs the same path as test_improvements.py: each case writes its transcripts
+to a CSV, plans a SweepOrchestrator over it and runs the shard jobs, each a
+stream_sweep pipeline appending to the cell's ResultLog. This happens against
+a local mock_openai_server.py for every (method, concurrency, dataset size,
+packing, streaming) case. The benchmark reports items/sec, client observed
+request latency (p50/p99), our overhead on top of the mock's own latency,
+time-to-intent, prompt tokens per transcript, accuracy and peak memory. No
+network access or API spend is involved, so the numbers are a repeatable
+baseline: save them with --output and check later runs against them with
+--compare.
+
+--pack-tokens compares one transcript per call (0) with packed requests
+(see packing.py). The mock answers every transcript with its CSV label, so
+against it accuracy only drops when packed answers are lost or
+misattributed; --pack-drop-rate makes it leave items out of packed
+replies. To measure how packing affects real model accuracy, point the
+benchmark at the API with --base-url (this spends credit).
+
+--stream off on compares full replies with streamed ones that stop at the
+intent (see streaming.py). Set --token-latency so the mock spends time per
+generated token; chain_of_thought replies carry a reasoning after the
+intent, which is what streaming saves.
+
+The mock server and every case run in separate processes, so server work does
+not compete with the client for the GIL and each case's peak memory is its
+own.
+
+Usage:
+    python benchmark.py --methods baseline ensemble --concurrency 8 32 --sizes 100 1000
+    python benchmark.py --output bench.json
+    python benchmark.py --compare bench.json --tolerance 0.15
+    python benchmark.py --methods baseline few_shot --pack-tokens 0 4000 --pack-drop-rate 0.1
+    python benchmark.py --methods chain_of_thought --stream off on --token-latency 0.01
+"""
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from mock_openai_server import LatencyModel, MockOpenAIState, make_server
+from result_stream import iter_csv_rows, iter_result_log
+from sweep import DEFAULT_SHARD_SIZE
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+
+DEFAULT_CSV = "data/dataset.csv"
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process so far"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _serve(server_options: Dict, connection) -> None:
+    options = dict(server_options)
+    options["latency"] = LatencyModel(options["latency"])
+    server = make_server(MockOpenAIState(**options), "127.0.0.1", 0)
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+def start_mock_server(server_options: Dict):
+    """Run the mock server in its own process; returns (process, base_url)"""
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(target=_serve, args=(server_options, child), daemon=True)
+    process.start()
+    port = parent.recv()
+    return process, f"http://127.0.0.1:{port}/v1"
+
+
+def write_dataset(path: str, dataset: List[Tuple[str, str]]) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["transcript", "human_generated_intent"])
+        writer.writerows(dataset)
+
+
+def _run_case(base_url: str, api_key: str, case: Dict, dataset: List[Tuple[str, str]], connection) -> None:
+    # Imported here so the spawned process measures only what a case needs
+    from instrumentation import summarize_calls
+    from sweep import SweepOrchestrator
+    from test_improvements import ImprovementTester, summarize_usage
+
+    rss_before = peak_rss_mb()
+    tester = ImprovementTester(api_key, max_concurrency=case["concurrency"], base_url=base_url,
+                               pack_tokens=case["pack_tokens"] or None, stream=case["stream"])
+    cell = (case["method"], case["model"])
+    with tempfile.TemporaryDirectory() as work_dir:
+        csv_file = os.path.join(work_dir, "dataset.csv")
+        write_dataset(csv_file, dataset)
+        orchestrator = SweepOrchestrator(tester, os.path.join(work_dir, "run"), csv_file,
+                                         shard_size=case["shard_size"])
+        jobs, _ = orchestrator.plan([cell])
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            asyncio.run(orchestrator.run(jobs))
+        wall = time.perf_counter() - start
+        orchestrator.close()
+        rows = list(iter_result_log(orchestrator.logs[cell].path))
+        ground_truth = orchestrator.ground_truth
+
+    latencies = []
+    failures = 0
+    correct = 0
+    for row in rows:
+        result = row["classification_result"]
+        correct += result["intent"] == ground_truth[row["transcript_index"]]
+        if "transport_error" in result:
+            failures += 1
+            continue
+        for call in result.get("individual_results") or [result]:
+            if "latency" in call:
+                latencies.append(call["latency"])
+    p50, p99 = np.percentile(latencies, [50, 99]) if latencies else (0.0, 0.0)
+    calls = summarize_calls(rows)
+    usage = summarize_usage(rows)
+    rss_after = peak_rss_mb()
+    connection.send({
+        **case,
+        "wall": wall,
+        "items_per_sec": len(rows) / wall,
+        "calls_per_sec": tester.scheduler.stats["requests"] / wall,
+        "latency_p50": float(p50),
+        "latency_p99": float(p99),
+        "queue_wait_p50": calls["queue_wait"]["p50"],
+        "ttfb_p50": calls["ttfb"]["p50"],
+        "time_to_intent_p50": calls["time_to_intent"]["p50"] if case["stream"] else None,
+        "loop_lag_p99": tester.metrics.histogram("classifier_event_loop_lag_seconds").quantile(0.99),
+        "prompt_tokens_per_item": usage["prompt_tokens"] / len(rows),
+        "accuracy": correct / (len(rows) - failures) if len(rows) > failures else 0.0,
+        "transport_failures": failures,
+        "retries": tester.scheduler.stats["retries"],
+        "throttled": tester.scheduler.stats["throttled"],
+        "peak_rss_mb": rss_after,
+        "run_rss_mb": rss_after - rss_before if rss_after is not None else None,
+    })
+
+
+def run_case(base_url: str, api_key: str, case: Dict, dataset: List[Tuple[str, str]]) -> Dict:
+    """Run one case in a fresh process and return its measurements"""
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe()
+    process = context.Process(target=_run_case, args=(base_url, api_key, case, dataset, child))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def case_key(case: Dict) -> str:
+    return (f"{case['method']}|{case['concurrency']}|{case['size']}|{case.get('pack_tokens', 0)}"
+            f"{'|stream' if case.get('stream') else ''}")
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float) -> List[str]:
+    """Regressions against a saved run: lower throughput or higher p99 beyond the tolerance"""
+    previous = {case_key(case): case for case in baseline}
+    regressions = []
+    for case in results:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        if case["items_per_sec"] < old["items_per_sec"] * (1 - tolerance):
+            regressions.append(f"{case_key(case)}: {case['items_per_sec']:.1f} items/s "
+                               f"(was {old['items_per_sec']:.1f})")
+        if case["latency_p99"] > old["latency_p99"] * (1 + tolerance):
+            regressions.append(f"{case_key(case)}: p99 {case['latency_p99'] * 1000:.0f}ms "
+                               f"(was {old['latency_p99'] * 1000:.0f}ms)")
+    return regressions
+
+
+def format_results(results: List[Dict], latency_median: float) -> str:
+    lines = [
+        f"{'Method':<20} {'Conc':>5} {'Items':>6} {'Pack':>6} {'Items/s':>9} {'Calls/s':>9} {'p50':>8} {'p99':>8} "
+        f"{'Overhead':>9} {'Queue':>8} {'TTFB':>8} {'TTI':>8} {'Lag p99':>8} {'Tok/item':>9} {'Acc':>7} "
+        f"{'Retries':>8} {'Failed':>7} {'Peak MB':>8} {'Run MB':>7}",
+        "-" * 178,
+    ]
+    for case in results:
+        peak = f"{case['peak_rss_mb']:.0f}" if case["peak_rss_mb"] is not None else "-"
+        run = f"{case['run_rss_mb']:.0f}" if case["run_rss_mb"] is not None else "-"
+        tti = case.get("time_to_intent_p50")
+        tti = f"{tti * 1000:.0f}ms" if tti is not None else "-"
+        lines.append(
+            f"{case['method']:<20} {case['concurrency']:>5} {case['size']:>6} {case['pack_tokens'] or '-':>6} "
+            f"{case['items_per_sec']:>9.1f} "
+            f"{case['calls_per_sec']:>9.1f} {case['latency_p50'] * 1000:>6.0f}ms {case['latency_p99'] * 1000:>6.0f}ms "
+            f"{(case['latency_p50'] - latency_median) * 1000:>7.1f}ms {case['queue_wait_p50'] * 1000:>6.0f}ms "
+            f"{case['ttfb_p50'] * 1000:>6.0f}ms {tti:>8} {case['loop_lag_p99'] * 1000:>6.1f}ms "
+            f"{case['prompt_tokens_per_item']:>9.0f} {case['accuracy']:>7.1%} {case['retries']:>8} "
+            f"{case['transport_failures']:>7} {peak:>8} {run:>7}"
+        )
+    lines.append("Overhead: client p50 minus the mock's median latency (HTTP, SDK and scheduler cost per call); "
+                 "Queue/TTFB: p50 wait for a slot and time to first byte; TTI: p50 time to the parsed intent "
+                 "(streamed cases); Lag: event-loop delay; Pack: transcript tokens per packed request")
+    return "\n".join(lines)
+
+
+def main():
+    from test_improvements import METHODS
+
+    parser = argparse.ArgumentParser(description="Benchmark the classifier harness against a local mock API")
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=METHODS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500], help="Transcripts per case")
+    parser.add_argument("--csv", default=DEFAULT_CSV, help="Transcripts to cycle through")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE, help="Rows per sweep shard job")
+    parser.add_argument("--model", default="gpt-4.1-2025-04-14")
+    parser.add_argument("--latency", default="lognormal:0.05,0.5",
+                        help="Mock latency: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (seconds)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls answered 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Fraction of calls answered 500/503")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pack-tokens", type=int, nargs="+", default=[0],
+                        help="Transcript token budgets of packed requests to compare; 0 is one transcript per call")
+    parser.add_argument("--pack-drop-rate", type=float, default=0.0,
+                        help="Fraction of transcripts the mock leaves out of packed replies")
+    parser.add_argument("--stream", nargs="+", choices=["off", "on"], default=["off"],
+                        help="Compare full replies (off) with streamed replies stopped at the intent (on)")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="Mock seconds per generated token")
+    parser.add_argument("--base-url", help="Benchmark this API instead of the mock (spends credit)")
+    parser.add_argument("--api-key", default=os.getenv("OPENAI_API_KEY"), help="API key for --base-url")
+    parser.add_argument("--output", help="Save results as JSON")
+    parser.add_argument("--compare", help="Saved results to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    latency = LatencyModel(args.latency)
+    labelled = [(transcript, intent) for _, transcript, intent in iter_csv_rows(args.csv)]
+    server_options = {
+        "default_intent": "voice_interested",
+        # The mock answers each transcript with its label
+        "script": {transcript: intent for transcript, intent in labelled},
+        "latency": args.latency,
+        "rate_limit_rate": args.rate_limit_rate,
+        "server_error_rate": args.server_error_rate,
+        "seed": args.seed,
+        "pack_drop_rate": args.pack_drop_rate,
+        "token_latency": args.token_latency,
+    }
+    server = None
+    if args.base_url:
+        base_url, api_key = args.base_url, args.api_key
+        print(f"API at {base_url}")
+    else:
+        server, base_url = start_mock_server(server_options)
+        api_key = "mock"
+        print(f"Mock API at {base_url}, latency {args.latency}, 429 rate {args.rate_limit_rate}, "
+              f"5xx rate {args.server_error_rate}, packed drop rate {args.pack_drop_rate}, "
+              f"{args.token_latency * 1000:g}ms per token")
+
+    results = []
+    try:
+        for size in args.sizes:
+            dataset = [labelled[i % len(labelled)] for i in range(size)]
+            for concurrency in args.concurrency:
+                for method in args.methods:
+                    for pack_tokens in args.pack_tokens:
+                        for stream in args.stream:
+                            if pack_tokens and stream == "on":
+                                # Packed replies are only usable whole, so they are never streamed
+                                continue
+                            case = {"method": method, "model": args.model, "concurrency": concurrency,
+                                    "size": size, "pack_tokens": pack_tokens, "stream": stream == "on",
+                                    "shard_size": args.shard_size}
+                            result = run_case(base_url, api_key, case, dataset)
+                            results.append(result)
+                            packed = f", packed {pack_tokens}" if pack_tokens else ""
+                            streamed = ", streamed" if stream == "on" else ""
+                            print(f"  {method} x{concurrency} on {size}{packed}{streamed}: "
+                                  f"{result['items_per_sec']:.1f} items/s, accuracy {result['accuracy']:.1%}")
+    finally:
+        if server is not None:
+            server.terminate()
+
+    print()
+    print(format_results(results, latency.median if server is not None else 0.0))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            server_info = {key: value for key, value in server_options.items() if key != "script"}
+            json.dump({"server": server_info if server is not None else {"base_url": base_url}, "cases": results,
+                       "generated_at": datetime.now().isoformat()}, f, indent=2)
+        print(f"\nSaved: {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["cases"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\nREGRESSIONS vs {args.compare} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions vs {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
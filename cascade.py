@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Confidence-based model cascade
+
+The cheapest/fastest model classifies first; a transcript moves on to the
+next model only when the answer's confidence is below a threshold.
+Confidence comes from the token logprobs of the intent value where the model
+returns them, and from the share of agreeing votes otherwise (reasoning
+models do not expose logprobs).
+
+Every stage a transcript went through is recorded, so the accuracy versus
+latency/cost trade-off can be replayed offline for any threshold up to the
+one the run used. A run with a threshold above 1 sends every transcript
+through every stage and therefore covers the whole frontier.
+
+Usage:
+    python cascade.py data/dataset.csv runs/20250101_120000/test_few_shot_cascade.jsonl
+"""
+
+import argparse
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from result_stream import is_transport_failure, iter_csv_rows, iter_result_log
+
+
+# Pseudo-model naming cascade cells in a sweep
+CASCADE_MODEL = "cascade"
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_THRESHOLDS = [0.0, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1.0]
+
+# USD per 1M tokens: (input, cached input, output)
+MODEL_PRICES = {
+    "gpt-4.1-2025-04-14": (2.00, 0.50, 8.00),
+    "gpt-5-mini-2025-08-07": (0.25, 0.025, 2.00),
+    "gpt-5-2025-08-07": (1.25, 0.125, 10.00),
+}
+
+# Reasoning models reject the logprobs parameter
+REASONING_MODEL_PREFIXES = ("gpt-5", "o1", "o3", "o4")
+
+_INTENT_VALUE = re.compile(r'"intent"\s*:\s*"([^"]*)"')
+
+
+def supports_logprobs(model: str) -> bool:
+    return not model.startswith(REASONING_MODEL_PREFIXES)
+
+
+def intent_confidence(content: Optional[str], logprobs: Optional[List[Tuple[str, float]]]) -> Optional[float]:
+    """Joint probability of the tokens that spell out the intent value in a JSON reply"""
+    if not content or not logprobs:
+        return None
+    match = _INTENT_VALUE.search(content)
+    if match is None:
+        return None
+    start, end = match.span(1)
+    total = 0.0
+    position = 0
+    for token, logprob in logprobs:
+        token_end = position + len(token)
+        if token_end > start and position < end:
+            total += logprob
+        position = token_end
+    return math.exp(total)
+
+
+def vote_confidence(intents: List[str]) -> float:
+    """Share of votes that went to the winning intent"""
+    if not intents:
+        return 0.0
+    return Counter(intents).most_common(1)[0][1] / len(intents)
+
+
+def call_cost(model: str, usage: Dict[str, int]) -> float:
+    """USD spent on one call; unknown models and cache hits cost 0"""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return 0.0
+    uncached = usage.get("prompt_tokens", 0) - usage.get("cached_tokens", 0)
+    return (uncached * prices[0] + usage.get("cached_tokens", 0) * prices[1]
+            + usage.get("completion_tokens", 0) * prices[2]) / 1_000_000
+
+
+def cheapest_first(models: Iterable[str]) -> List[str]:
+    """Models ordered by input plus output price per token; models without a price go last, in their order"""
+    return sorted(models, key=lambda model: (sum(MODEL_PRICES[model][::2]) if model in MODEL_PRICES
+                                             else float("inf")))
+
+
+def stage_cost(model: str, calls: List[Dict]) -> float:
+    """USD for one stage's calls. A response cache hit is charged what the call cost when it was made,
+    so the frontier does not depend on what happened to be cached"""
+    return sum(call_cost(model, call.get("cached_usage") or call.get("usage", {})) for call in calls)
+
+
+def stage_latency(calls: List[Dict]) -> float:
+    """Seconds one stage took: the slowest of its parallel calls' own API latency, without the time they
+    queued in the harness; a cache hit counts the latency of the call when it was made"""
+    latencies = [call["cached_latency"] if call.get("response_cache_hit") else call.get("latency")
+                 for call in calls]
+    return max([latency for latency in latencies if latency is not None], default=0.0)
+
+
+def stop_stage(stages: List[Dict], threshold: float) -> int:
+    """Index of the stage a cascade with this threshold ends on"""
+    for i, stage in enumerate(stages):
+        if stage["confidence"] >= threshold:
+            return i
+    return len(stages) - 1
+
+
+def _point(label: str, threshold: Optional[float], picks: List[Tuple[Optional[str], List[Dict], int, bool]],
+           models: List[str]) -> Dict:
+    """Metrics when each transcript ends on the chosen stage.
+
+    picks holds (ground truth, stages, chosen stage, whether earlier stages ran).
+    """
+    correct = 0
+    latency = 0.0
+    cost = 0.0
+    stopped_at: Counter = Counter()
+    for truth, stages, chosen, cascaded in picks:
+        ran = stages[:chosen + 1] if cascaded else [stages[chosen]]
+        correct += stages[chosen]["intent"] == truth
+        latency += sum(stage["latency"] for stage in ran)
+        cost += sum(stage["cost"] for stage in ran)
+        stopped_at[stages[chosen]["model"]] += 1
+    n = len(picks)
+    return {
+        "label": label,
+        "threshold": threshold,
+        "accuracy": correct / n * 100,
+        "mean_latency": latency / n,
+        "mean_cost": cost / n,
+        "stopped_at": {model: stopped_at[model] / n for model in models if stopped_at[model]},
+    }
+
+
+def cascade_frontier(rows: Iterable[Dict], ground_truth: Dict[int, str],
+                     thresholds: Optional[List[float]] = None) -> List[Dict]:
+    """Replay recorded cascade stages at each threshold, plus each model on its own.
+
+    Thresholds above the run's own threshold are skipped: transcripts that
+    stopped early never ran the later stages they would need. Points on the
+    accuracy/cost Pareto frontier are flagged with "pareto".
+    """
+    cascades = [
+        (ground_truth.get(row["transcript_index"]), row["classification_result"]["stages"],
+         row["classification_result"]["threshold"])
+        for row in rows
+        if not is_transport_failure(row) and "stages" in row["classification_result"]
+    ]
+    if not cascades:
+        return []
+    run_threshold = min(threshold for _, _, threshold in cascades)
+    models = [stage["model"] for stage in max((stages for _, stages, _ in cascades), key=len)]
+
+    points = []
+    candidates = sorted({t for t in (thresholds or DEFAULT_THRESHOLDS) if t <= run_threshold} | {run_threshold})
+    for threshold in candidates:
+        picks = [(truth, stages, stop_stage(stages, threshold), True) for truth, stages, _ in cascades]
+        points.append(_point(f"cascade@{threshold:g}", threshold, picks, models))
+
+    # A model alone is only known where every transcript reached its stage
+    depth = min(len(stages) for _, stages, _ in cascades)
+    for i in range(depth):
+        picks = [(truth, stages, i, False) for truth, stages, _ in cascades]
+        points.append(_point(f"{models[i]} only", None, picks, models))
+
+    best = -1.0
+    for point in sorted(points, key=lambda p: (p["mean_cost"], p["mean_latency"], -p["accuracy"])):
+        point["pareto"] = point["accuracy"] > best
+        best = max(best, point["accuracy"])
+    return points
+
+
+def format_frontier(points: List[Dict]) -> str:
+    lines = [f"{'Setting':<30} {'Accuracy':>9} {'Latency':>9} {'Cost/1k':>9}  {'Stopped at'}", "-" * 100]
+    for point in points:
+        stopped = ", ".join(f"{model} {share:.0%}" for model, share in point["stopped_at"].items())
+        marker = "*" if point["pareto"] else " "
+        lines.append(f"{marker}{point['label']:<29} {point['accuracy']:>8.1f}% {point['mean_latency']:>8.2f}s "
+                     f"${point['mean_cost'] * 1000:>8.4f}  {stopped}")
+    lines.append("* on the accuracy/cost frontier; latency is per transcript, cost per 1,000 transcripts")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy vs latency/cost frontier of a recorded cascade run")
+    parser.add_argument("csv_file", help="CSV with human_generated_intent ground truth")
+    parser.add_argument("log", help="JSONL result log of a cascade cell")
+    parser.add_argument("--thresholds", type=float, nargs="+", help="Thresholds to replay")
+    args = parser.parse_args()
+
+    ground_truth = {index: intent for index, _, intent in iter_csv_rows(args.csv_file)}
+    points = cascade_frontier(iter_result_log(args.log), ground_truth, args.thresholds)
+    if not points:
+        print(f"No cascade results in {args.log}")
+        return 1
+    print(format_frontier(points))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,73 @@
+"""
+Classification requests and replies shared by live (test_improvements.py) and
+batch (batch_runner.py) runs: the request parameters, token usage, parsing a
+reply into a result, and voting over ensemble samples.
+"""
+
+import json
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+# Sampling parameters sent with every classification request
+REQUEST_PARAMS = {"response_format": {"type": "json_object"}}
+
+
+def empty_usage() -> Dict[str, int]:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+
+def extract_usage(response) -> Dict[str, int]:
+    """Token usage of one completion, including provider-side cached prompt tokens"""
+    usage = empty_usage()
+    if response.usage is None:
+        return usage
+    usage["prompt_tokens"] = response.usage.prompt_tokens or 0
+    usage["completion_tokens"] = response.usage.completion_tokens or 0
+    details = getattr(response.usage, "prompt_tokens_details", None)
+    if details is not None:
+        usage["cached_tokens"] = getattr(details, "cached_tokens", None) or 0
+    return usage
+
+
+def parse_classification(method: str, content: Optional[str], stats: Dict) -> Dict:
+    """Turn a completion's content into a classification result"""
+    if content is None:
+        return {"intent": "voice_unknown", "method": method, "error": "Empty response", **stats}
+    result = json.loads(content)
+    return {"intent": result.get("intent", "voice_unknown"), "method": method, **stats}
+
+
+def leading_counts(results: List[Dict]) -> Tuple[int, int]:
+    """Vote counts of the leading and runner-up intents (0 when absent)"""
+    counts = [count for _, count in Counter(r["intent"] for r in results).most_common(2)] + [0, 0]
+    return counts[0], counts[1]
+
+
+def is_settled(results: List[Dict], budget: int) -> bool:
+    """True once the leading intent can no longer be overturned by the votes still to come"""
+    leader, runner_up = leading_counts(results)
+    return leader > runner_up + (budget - len(results))
+
+
+def vote(results: List[Dict]) -> Dict:
+    """Majority vote over few-shot instances"""
+    for i, result in enumerate(results):
+        result["instance"] = f"few_shot_{i+1}"
+
+    intents = [r["intent"] for r in results]
+    intent_counts = Counter(intents)
+    most_common = intent_counts.most_common(1)[0][0]
+
+    usage = empty_usage()
+    for r in results:
+        for key, value in r.get("usage", {}).items():
+            usage[key] += value
+
+    return {
+        "intent": most_common,
+        "method": "ensemble_few_shot",
+        "votes": dict(intent_counts),
+        "usage": usage,
+        "individual_results": results
+    }
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Vectorized evaluation of classification runs
+
+Loads any number of saved runs into one NumPy label matrix (runs x
+transcripts) in a single pass per run, then computes accuracy, confusion
+matrices, per-intent precision/recall/F1, pairwise McNemar tests and
+bootstrap confidence intervals on whole arrays at once.
+
+Usage:
+    python evaluation.py data/dataset.csv --store results_store
+    python evaluation.py data/dataset.csv runs/20250101_120000/*.jsonl --per-class
+"""
+
+import argparse
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from prompts import INTENTS
+
+
+LABELS = INTENTS + ["<other>"]
+LABEL_INDEX = {intent: i for i, intent in enumerate(INTENTS)}
+# An answer outside the category set
+OTHER = len(INTENTS)
+# No answer at all: transport failure or a transcript missing from the run
+MISSING = -1
+
+
+def encode_label(intent: Optional[str]) -> int:
+    if intent is None:
+        return MISSING
+    return LABEL_INDEX.get(intent, OTHER)
+
+
+class RunMatrix:
+    """Predicted labels of several runs over the same ground-truth transcripts"""
+
+    def __init__(self, names: List[str], transcript_index: np.ndarray, truth: np.ndarray, pred: np.ndarray):
+        self.names = names
+        self.transcript_index = transcript_index  # (N,)
+        self.truth = truth  # (N,)
+        self.pred = pred  # (R, N), MISSING where a run has no answer
+
+    @property
+    def valid(self) -> np.ndarray:
+        return self.pred != MISSING
+
+    @property
+    def correct(self) -> np.ndarray:
+        return (self.pred == self.truth[None, :]) & self.valid
+
+
+def _empty_matrix(names: List[str], ground_truth: Dict[int, str]) -> Tuple[RunMatrix, np.ndarray]:
+    transcript_index = np.array(sorted(ground_truth), dtype=np.int64)
+    truth = np.array([encode_label(ground_truth[i]) for i in transcript_index], dtype=np.int8)
+    pred = np.full((len(names), len(transcript_index)), MISSING, dtype=np.int8)
+    return RunMatrix(names, transcript_index, truth, pred), transcript_index
+
+
+def load_run_matrix(runs: Dict[str, Iterable[Dict]], ground_truth: Dict[int, str]) -> RunMatrix:
+    """Build the label matrix from result rows; each run's rows are read once"""
+    matrix, transcript_index = _empty_matrix(list(runs), ground_truth)
+    position = {int(index): i for i, index in enumerate(transcript_index)}
+    for r, rows in enumerate(runs.values()):
+        for row in rows:
+            i = position.get(row["transcript_index"])
+            if i is not None:
+                matrix.pred[r, i] = encode_label(row["classification_result"].get("intent"))
+    return matrix
+
+
+def load_run_matrix_from_store(store, run_ids: List[str], ground_truth: Dict[int, str]) -> RunMatrix:
+    """Build the label matrix from memory-mapped columnar runs without per-row Python work"""
+    matrix, transcript_index = _empty_matrix(run_ids, ground_truth)
+    for r, run_id in enumerate(run_ids):
+        table = store.load_run(run_id)
+        indices = table.column("transcript_index").to_numpy()
+        intents = table.column("intent").combine_chunks().dictionary_encode()
+        codes = np.array([encode_label(v) for v in intents.dictionary.to_pylist()] + [MISSING], dtype=np.int8)
+        # Null intents (transport failures) map to the trailing MISSING code
+        dictionary_index = intents.indices.fill_null(len(codes) - 1).to_numpy()
+        positions = np.searchsorted(transcript_index, indices)
+        clipped = np.minimum(positions, len(transcript_index) - 1)
+        known = (positions < len(transcript_index)) & (transcript_index[clipped] == indices)
+        matrix.pred[r, positions[known]] = codes[dictionary_index[known]]
+    return matrix
+
+
+def accuracy(matrix: RunMatrix) -> np.ndarray:
+    """(R,) accuracy over answered transcripts"""
+    answered = matrix.valid.sum(axis=1)
+    return np.divide(matrix.correct.sum(axis=1), answered, out=np.zeros(len(answered)), where=answered > 0)
+
+
+def confusion_matrices(matrix: RunMatrix) -> np.ndarray:
+    """(R, K, K) counts of [truth, predicted] over answered transcripts"""
+    k = len(LABELS)
+    runs, _ = np.nonzero(matrix.valid)
+    truth = np.broadcast_to(matrix.truth, matrix.pred.shape)[matrix.valid].astype(np.int64)
+    pred = matrix.pred[matrix.valid].astype(np.int64)
+    flat = np.bincount(runs * k * k + truth * k + pred, minlength=len(matrix.names) * k * k)
+    return flat.reshape(len(matrix.names), k, k)
+
+
+def per_class_metrics(confusion: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-intent precision, recall, F1 and support, each (R, K)"""
+    true_positive = np.diagonal(confusion, axis1=1, axis2=2).astype(np.float64)
+    predicted = confusion.sum(axis=1)
+    support = confusion.sum(axis=2)
+    precision = np.divide(true_positive, predicted, out=np.zeros_like(true_positive), where=predicted > 0)
+    recall = np.divide(true_positive, support, out=np.zeros_like(true_positive), where=support > 0)
+    denominator = precision + recall
+    f1 = np.divide(2 * precision * recall, denominator, out=np.zeros_like(true_positive), where=denominator > 0)
+    return {"precision": precision, "recall": recall, "f1": f1, "support": support}
+
+
+def macro_f1(metrics: Dict[str, np.ndarray]) -> np.ndarray:
+    """(R,) F1 averaged over intents that occur in the ground truth"""
+    present = metrics["support"] > 0
+    return (metrics["f1"] * present).sum(axis=1) / np.maximum(present.sum(axis=1), 1)
+
+
+def _mcnemar_p_value(b: int, c: int) -> float:
+    n = b + c
+    if n == 0:
+        return 1.0
+    if n <= 50:
+        # Exact two-sided binomial test
+        tail = sum(math.comb(n, i) for i in range(min(b, c) + 1)) / 2 ** n
+        return min(1.0, 2 * tail)
+    # Chi-square with continuity correction, 1 degree of freedom
+    statistic = (abs(b - c) - 1) ** 2 / n
+    return math.erfc(math.sqrt(statistic / 2))
+
+
+def mcnemar(matrix: RunMatrix) -> Dict[str, np.ndarray]:
+    """Pairwise McNemar tests over transcripts answered by both runs.
+
+    b[i, j] counts transcripts run i got right and run j got wrong; all
+    pairs come from a single matrix product.
+    """
+    right = matrix.correct.astype(np.int64)
+    wrong = (matrix.valid & ~matrix.correct).astype(np.int64)
+    b = right @ wrong.T
+    p = np.ones(b.shape)
+    for i in range(len(matrix.names)):
+        for j in range(i + 1, len(matrix.names)):
+            p[i, j] = p[j, i] = _mcnemar_p_value(int(b[i, j]), int(b[j, i]))
+    return {"b": b, "c": b.T, "p": p}
+
+
+def bootstrap_accuracy(matrix: RunMatrix, n_resamples: int = 10_000, seed: int = 0,
+                       max_chunk_elements: int = 4_000_000) -> np.ndarray:
+    """(n_resamples, R) paired bootstrap accuracies; every run sees the same resamples.
+
+    Transcripts with an identical (correct, answered) pattern across runs are
+    interchangeable, so when such patterns are few the resample counts are
+    drawn from a multinomial over patterns. Otherwise per-transcript weights
+    are drawn in chunks. Either way accuracies come from one matrix product.
+    """
+    rng = np.random.default_rng(seed)
+    n = matrix.pred.shape[1]
+    features = np.concatenate([matrix.correct, matrix.valid]).T.astype(np.float32)  # (N, 2R)
+    patterns, counts = np.unique(features, axis=0, return_counts=True)
+    runs = len(matrix.names)
+
+    if len(patterns) * 8 < n:
+        weights = rng.multinomial(n, counts / n, size=n_resamples).astype(np.float32)
+        totals = weights @ patterns
+    else:
+        totals = np.empty((n_resamples, 2 * runs), dtype=np.float32)
+        chunk = max(1, max_chunk_elements // n)
+        for start in range(0, n_resamples, chunk):
+            size = min(chunk, n_resamples - start)
+            draws = rng.integers(0, n, (size, n), dtype=np.int32)
+            draws += (np.arange(size, dtype=np.int32) * n)[:, None]
+            weights = np.bincount(draws.ravel(), minlength=size * n).reshape(size, n).astype(np.float32)
+            totals[start:start + size] = weights @ features
+
+    correct, answered = totals[:, :runs], totals[:, runs:]
+    return np.divide(correct, answered, out=np.zeros_like(correct), where=answered > 0)
+
+
+def confidence_interval(samples: np.ndarray, confidence: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+    """Percentile interval along the resample axis"""
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(samples, [alpha, 1 - alpha], axis=0)
+    return low, high
+
+
+def evaluate(matrix: RunMatrix, n_resamples: int = 10_000, seed: int = 0) -> Dict:
+    """All metrics for a run matrix"""
+    samples = bootstrap_accuracy(matrix, n_resamples=n_resamples, seed=seed)
+    low, high = confidence_interval(samples)
+    confusion = confusion_matrices(matrix)
+    metrics = per_class_metrics(confusion)
+    return {
+        "names": matrix.names,
+        "answered": matrix.valid.sum(axis=1),
+        "accuracy": accuracy(matrix),
+        "ci_low": low,
+        "ci_high": high,
+        "macro_f1": macro_f1(metrics),
+        "confusion": confusion,
+        "per_class": metrics,
+        "mcnemar": mcnemar(matrix),
+        "bootstrap": samples,
+    }
+
+
+def format_report(report: Dict, per_class: bool = False) -> str:
+    width = max(len(name) for name in report["names"] + ["Run"])
+    lines = [f"{'Run':<{width}} {'N':>5} {'Accuracy':>9} {'95% CI':>16} {'Macro F1':>9}", "-" * (width + 43)]
+    for r, name in enumerate(report["names"]):
+        lines.append(
+            f"{name:<{width}} {report['answered'][r]:>5} {report['accuracy'][r]:>8.1%} "
+            f"  [{report['ci_low'][r]:>5.1%}, {report['ci_high'][r]:>5.1%}] {report['macro_f1'][r]:>9.3f}"
+        )
+
+    if len(report["names"]) > 1:
+        lines += ["", "Pairwise McNemar p-values (row vs column)"]
+        width = 8
+        lines.append(" " * 6 + "".join(f"{j:>{width}}" for j in range(len(report["names"]))))
+        for i in range(len(report["names"])):
+            cells = "".join(
+                f"{'-':>{width}}" if i == j else f"{report['mcnemar']['p'][i, j]:>{width}.3f}"
+                for j in range(len(report["names"]))
+            )
+            lines.append(f"{i:>4}  {cells}")
+        lines += [f"  {i}: {name}" for i, name in enumerate(report["names"])]
+
+    if per_class:
+        metrics = report["per_class"]
+        for r, name in enumerate(report["names"]):
+            lines += ["", name, f"  {'Intent':<38} {'Precision':>9} {'Recall':>7} {'F1':>6} {'Support':>8}"]
+            for k, label in enumerate(LABELS):
+                if metrics["support"][r, k] == 0 and report["confusion"][r, :, k].sum() == 0:
+                    continue
+                lines.append(
+                    f"  {label:<38} {metrics['precision'][r, k]:>9.3f} {metrics['recall'][r, k]:>7.3f} "
+                    f"{metrics['f1'][r, k]:>6.3f} {metrics['support'][r, k]:>8}"
+                )
+    return "\n".join(lines)
+
+
+def main():
+    from result_stream import iter_csv_rows
+
+    parser = argparse.ArgumentParser(description="Evaluate and compare saved classification runs")
+    parser.add_argument("csv_file", help="CSV with human_generated_intent ground truth")
+    parser.add_argument("files", nargs="*", help="JSONL result logs or legacy test_*.json files")
+    parser.add_argument("--store", help="Columnar results store to read runs from")
+    parser.add_argument("--runs", nargs="+", help="Run ids from the store (default: all)")
+    parser.add_argument("--resamples", type=int, default=10_000, help="Bootstrap resamples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--per-class", action="store_true", help="Show per-intent precision/recall/F1")
+    args = parser.parse_args()
+
+    ground_truth = {index: intent for index, _, intent in iter_csv_rows(args.csv_file)}
+    if args.store:
+        from results_store import ResultsStore
+        store = ResultsStore(args.store)
+        matrix = load_run_matrix_from_store(store, args.runs or store.run_ids(), ground_truth)
+    elif args.files:
+        from results_store import iter_results_file
+        matrix = load_run_matrix({path: iter_results_file(path)[1] for path in args.files}, ground_truth)
+    else:
+        parser.error("give result files or --store")
+
+    print(format_report(evaluate(matrix, n_resamples=args.resamples, seed=args.seed), per_class=args.per_class))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Embedding-indexed few-shot example selection
+
+The few_shot prompt carries the same two hardcoded examples for every
+transcript. Here the labelled rows of a CSV are embedded once into an
+on-disk index: L2-normalised float32 vectors in a .npy file that is
+memory-mapped at load time, next to a JSONL file of the examples. For each
+transcript the k most similar examples are found with one vectorized cosine
+search and placed in the prompt instead.
+
+Embeddings are cached in SQLite, keyed by embedder and content hash, so no
+text is ever embedded twice. The embedder is pluggable. "hashing" is a local,
+deterministic bag of hashed user n-grams that needs no network. "openai"
+calls the embeddings API. Any object with a `name` and an async
+`embed(texts)` returning an (n, dim) array works too.
+
+A transcript never retrieves itself, so classifying the labelled CSV with
+its own index does not leak its labels.
+
+Usage:
+    python few_shot_index.py build data/dataset.csv few_shot_index
+    python few_shot_index.py build data/dataset.csv few_shot_index --embedder openai:text-embedding-3-small
+    python few_shot_index.py evaluate few_shot_index --k 3
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from prefilter import featurize, parse_turns
+from result_stream import iter_csv_rows
+
+
+DEFAULT_EMBEDDER = "hashing:1024"
+DEFAULT_K = 3
+DEFAULT_EMBEDDING_CACHE = ".embedding_cache.sqlite3"
+
+# Index rows scored per block, so a large memory-mapped index is never read into memory at once
+SEARCH_BLOCK = 65536
+
+
+def content_hash(text: str) -> str:
+    normalized = "\n".join(line.rstrip() for line in text.replace("\r\n", "\n").split("\n")).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+class HashingEmbedder:
+    """Local embedder: signed hashed counts of user n-grams and turn shape (see prefilter.featurize)"""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hashing:{dim}"
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            indices, values = featurize(parse_turns(text), self.dim)
+            # Distinct tokens can share a bucket; add rather than overwrite
+            np.add.at(vectors[row], indices, values)
+        return vectors
+
+
+class OpenAIEmbedder:
+    """Embeddings API, through the tester's scheduler when one is given"""
+
+    def __init__(self, client=None, scheduler=None, model: str = "text-embedding-3-small", batch_size: int = 256):
+        if client is None:
+            import openai
+            client = openai.AsyncOpenAI()
+        self.client = client
+        self.scheduler = scheduler
+        self.model = model
+        self.batch_size = batch_size
+        self.name = f"openai:{model}"
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        request = lambda: self.client.embeddings.with_raw_response.create(model=self.model, input=texts)
+        if self.scheduler is not None:
+            raw, _ = await self.scheduler.call(request)
+        else:
+            raw = await request()
+        return [item.embedding for item in sorted(raw.parse().data, key=lambda item: item.index)]
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        batches = await asyncio.gather(*(
+            self._embed_batch(texts[i:i + self.batch_size]) for i in range(0, len(texts), self.batch_size)
+        ))
+        return np.array([vector for batch in batches for vector in batch], dtype=np.float32)
+
+
+EMBEDDERS = {"hashing": HashingEmbedder, "openai": OpenAIEmbedder}
+
+
+def make_embedder(spec: str, client=None, scheduler=None):
+    """Embedder from a spec such as "hashing:1024" or "openai:text-embedding-3-small" """
+    kind, _, argument = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(int(argument) if argument else 1024)
+    if kind == "openai":
+        return OpenAIEmbedder(client, scheduler, model=argument or "text-embedding-3-small")
+    raise ValueError(f"Unknown embedder {spec!r}; expected one of {', '.join(EMBEDDERS)}")
+
+
+class EmbeddingCache:
+    """SQLite store of embeddings keyed by embedder name and content hash"""
+
+    def __init__(self, path: str = DEFAULT_EMBEDDING_CACHE):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL
+            )
+        """)
+        self.conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        self.hits += len(found)
+        self.misses += len(set(keys) - set(found))
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items.items()],
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+async def embed_cached(embedder, texts: Sequence[str], cache: Optional[EmbeddingCache] = None) -> np.ndarray:
+    """L2-normalised embeddings of texts; only texts missing from the cache are embedded, once each"""
+    keys = [f"{embedder.name}:{content_hash(text)}" for text in texts]
+    found = cache.get_many(list(set(keys))) if cache is not None else {}
+    missing = {key: text for key, text in zip(keys, texts) if key not in found}
+    if missing:
+        vectors = normalize_rows(await embedder.embed(list(missing.values())))
+        fresh = dict(zip(missing, vectors))
+        if cache is not None:
+            cache.put_many(fresh)
+        found.update(fresh)
+    return np.stack([found[key] for key in keys])
+
+
+class FewShotIndex:
+    """Labelled examples with their embeddings: vectors.npy (memory-mapped), examples.jsonl, meta.json"""
+
+    def __init__(self, path: str, vectors: np.ndarray, examples: List[Dict], meta: Dict):
+        self.path = path
+        self.vectors = vectors
+        self.examples = examples
+        self.meta = meta
+        self.embedder = meta["embedder"]
+        self._rows_by_hash: Dict[str, List[int]] = {}
+        for row, example in enumerate(examples):
+            self._rows_by_hash.setdefault(example["content_hash"], []).append(row)
+
+    @classmethod
+    async def build(cls, path: str, rows: Iterable[Tuple[int, str, str]], embedder,
+                    cache: Optional[EmbeddingCache] = None) -> "FewShotIndex":
+        """Embed (transcript_index, transcript, intent) rows and write the index to path"""
+        examples = [
+            {"transcript_index": index, "intent": intent, "transcript": transcript,
+             "content_hash": content_hash(transcript)}
+            for index, transcript, intent in rows
+        ]
+        vectors = await embed_cached(embedder, [example["transcript"] for example in examples], cache)
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), vectors)
+        with open(os.path.join(path, "examples.jsonl"), "w") as f:
+            for example in examples:
+                f.write(json.dumps(example, ensure_ascii=False) + "\n")
+        meta = {"embedder": embedder.name, "dim": int(vectors.shape[1]), "count": len(examples),
+                "created_at": datetime.now().isoformat()}
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+        return cls.load(path)
+
+    @classmethod
+    def load(cls, path: str) -> "FewShotIndex":
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "examples.jsonl")) as f:
+            examples = [json.loads(line) for line in f if line.strip()]
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        return cls(path, vectors, examples, meta)
+
+    def digest(self) -> str:
+        """Identifies the embedder and labelled examples, not when the index was built"""
+        digest = hashlib.sha256(self.embedder.encode("utf-8"))
+        for example in self.examples:
+            digest.update(f"\0{example['content_hash']}\0{example['intent']}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def search(self, queries: np.ndarray, k: int,
+               exclude: Optional[Sequence[str]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k example rows by cosine similarity for each normalised query, best first.
+
+        exclude[i] is a content hash whose examples query i may not retrieve
+        (the query itself). Returns (rows, scores), both (len(queries), k);
+        rows are -1 where fewer than k examples were eligible.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for start in range(0, len(self.vectors), SEARCH_BLOCK):
+            scores = queries @ np.asarray(self.vectors[start:start + SEARCH_BLOCK]).T
+            for query, content in enumerate(exclude or []):
+                for row in self._rows_by_hash.get(content, []):
+                    if start <= row < start + scores.shape[1]:
+                        scores[query, row - start] = -np.inf
+            rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            # Merge this block's candidates with the best so far, then keep the top k
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+            best_rows = np.take_along_axis(rows, keep, axis=1)
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.where(np.isneginf(best_scores), -1, np.take_along_axis(best_rows, order, axis=1))
+        return best_rows, best_scores
+
+
+class FewShotSelector:
+    """Top-k examples for a transcript; each distinct transcript is embedded at most once per run"""
+
+    def __init__(self, index: FewShotIndex, embedder, cache: Optional[EmbeddingCache] = None, k: int = DEFAULT_K,
+                 memo_size: int = 1024):
+        if embedder.name != index.embedder:
+            raise ValueError(f"Index {index.path} was built with {index.embedder}, not {embedder.name}")
+        self.index = index
+        self.embedder = embedder
+        self.cache = cache
+        self.k = k
+        # Ensemble votes, cascade stages and sweep cells ask for the same
+        # transcript back to back; they share one embedding request
+        self._memo: "OrderedDict[str, asyncio.Future]" = OrderedDict()
+        self.memo_size = memo_size
+
+    async def _embedding(self, transcript: str) -> np.ndarray:
+        key = content_hash(transcript)
+        future = self._memo.get(key)
+        if future is None:
+            future = asyncio.ensure_future(embed_cached(self.embedder, [transcript], self.cache))
+            self._memo[key] = future
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        else:
+            self._memo.move_to_end(key)
+        try:
+            return (await future)[0]
+        except Exception:
+            # Let a re-queued item try again
+            if self._memo.get(key) is future:
+                del self._memo[key]
+            raise
+
+    async def select(self, transcript: str) -> List[Dict]:
+        """[{"transcript_index", "intent", "transcript", "score"}], most similar first"""
+        vector = await self._embedding(transcript)
+        rows, scores = self.index.search(vector[None, :], self.k, exclude=[content_hash(transcript)])
+        return [
+            {"transcript_index": self.index.examples[row]["transcript_index"],
+             "intent": self.index.examples[row]["intent"],
+             "transcript": self.index.examples[row]["transcript"],
+             "score": float(score)}
+            for row, score in zip(rows[0], scores[0]) if row >= 0
+        ]
+
+
+def leave_one_out(index: FewShotIndex, k: int) -> Dict:
+    """How often an example's neighbours (itself excluded) share its label"""
+    vectors = np.asarray(index.vectors)
+    labels = np.array([example["intent"] for example in index.examples])
+    rows, _ = index.search(vectors, k, exclude=[example["content_hash"] for example in index.examples])
+    valid = rows >= 0
+    neighbour_labels = np.where(valid, labels[np.maximum(rows, 0)], "")
+    top1 = neighbour_labels[:, 0] == labels
+    in_top_k = (neighbour_labels == labels[:, None]).any(axis=1)
+    by_intent = {
+        intent: float(top1[labels == intent].mean())
+        for intent in sorted(Counter(labels.tolist()))
+    }
+    return {"examples": len(labels), "k": k, "top1_agreement": float(top1.mean()),
+            "label_in_top_k": float(in_top_k.mean()), "top1_by_intent": by_intent}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or evaluate a few-shot example index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Embed a labelled CSV into an index directory")
+    build.add_argument("csv_file", help="CSV with human_generated_intent labels")
+    build.add_argument("index_dir")
+    build.add_argument("--embedder", default=DEFAULT_EMBEDDER,
+                       help="hashing:DIM (local) or openai:MODEL (embeddings API)")
+    build.add_argument("--embedding-cache", default=DEFAULT_EMBEDDING_CACHE)
+    evaluate = subparsers.add_parser("evaluate", help="Leave-one-out neighbour agreement of an index")
+    evaluate.add_argument("index_dir")
+    evaluate.add_argument("--k", type=int, default=DEFAULT_K)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        cache = EmbeddingCache(args.embedding_cache)
+        index = asyncio.run(FewShotIndex.build(args.index_dir, iter_csv_rows(args.csv_file),
+                                               make_embedder(args.embedder), cache))
+        print(f"Indexed {len(index.examples)} examples with {index.embedder} ({index.meta['dim']} dims) "
+              f"in {args.index_dir}; embedding cache {cache.hits} hits, {cache.misses} misses")
+        cache.close()
+        return 0
+
+    index = FewShotIndex.load(args.index_dir)
+    report = leave_one_out(index, args.k)
+    print(f"{report['examples']} examples, {index.embedder}: nearest neighbour shares the label "
+          f"{report['top1_agreement']:.1%}, label among top {args.k} {report['label_in_top_k']:.1%}")
+    for intent, share in report["top1_by_intent"].items():
+        print(f"  {intent:<36} {share:.1%}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
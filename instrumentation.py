@@ -0,0 +1,285 @@
+"""
+Per-request instrumentation
+
+Every API call made by ImprovementTester is timed in phases: queue wait (for a
+scheduler slot), time to first byte (headers received), total latency and
+the server's own processing time where the API reports it. The metrics
+registry aggregates these with token counts, retries and error classes into
+Prometheus-style counters and histograms. They are served on /metrics by a
+local exporter and written as a text file at the end of a run.
+
+Event-loop lag is sampled alongside. High queue wait means the concurrency
+limit was the bottleneck. High loop lag means the client itself was starved.
+TTFB well above processing time points at the network or the HTTP stack,
+and processing time near latency points at the API.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds, shared by every timing histogram
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Per-call timing fields kept in result rows and summarized per run
+CALL_TIMINGS = ("queue_wait", "ttfb", "latency", "time_to_intent")
+# Timings only streamed calls have (see streaming.py)
+STREAM_TIMINGS = ("time_to_intent",)
+
+METRIC_HELP = {
+    "classifier_api_calls_total": ("counter", "API calls by outcome (ok, cache_hit, transport_error)"),
+    "classifier_api_errors_total": ("counter", "Failed API attempts by error class, including retried ones"),
+    "classifier_api_retries_total": ("counter", "Retried API attempts"),
+    "classifier_tokens_total": ("counter", "Tokens by kind (prompt, completion, cached)"),
+    "classifier_queue_wait_seconds": ("histogram", "Time waiting for a scheduler slot"),
+    "classifier_ttfb_seconds": ("histogram", "Time from sending a request to its response headers"),
+    "classifier_latency_seconds": ("histogram", "Time from sending a request to its full (or cut-short) response"),
+    "classifier_time_to_intent_seconds": ("histogram", "Time from sending a streamed request to its parsed intent"),
+    "classifier_processing_seconds": ("histogram", "Server-reported processing time (openai-processing-ms)"),
+    "classifier_event_loop_lag_seconds": ("histogram", "Delay of the event loop beyond a scheduled wake-up"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_first_byte: contextvars.ContextVar = contextvars.ContextVar("first_byte", default=None)
+
+
+@contextlib.contextmanager
+def first_byte_timer() -> Iterator[Dict[str, float]]:
+    """Collect the first-byte time of the HTTP request made inside the block"""
+    marks: Dict[str, float] = {}
+    token = _first_byte.set(marks)
+    try:
+        yield marks
+    finally:
+        _first_byte.reset(token)
+
+
+async def record_first_byte(response) -> None:
+    """httpx response hook: runs once the headers arrive, before the body is read"""
+    marks = _first_byte.get()
+    if marks is not None and "first_byte" not in marks:
+        marks["first_byte"] = time.perf_counter()
+
+
+def processing_seconds(headers) -> Optional[float]:
+    try:
+        return float(headers["openai-processing-ms"]) / 1000
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class Histogram:
+    """Per-bucket (not cumulative) counts; counts[i] holds values in (buckets[i-1], buckets[i]]"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Estimate by linear interpolation inside the bucket, as Prometheus' histogram_quantile does"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[i - 1] if i > 0 else 0.0
+                high = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(self.max, low + (high - low) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+    def summary(self) -> Dict:
+        bounds = [f"{b:g}" for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": {bound: count for bound, count in zip(bounds, self.counts) if count},
+        }
+
+
+class Metrics:
+    """Labelled counters and histograms, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        # The exporter thread renders while the event loop records
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self._loop_watchers = 0
+        self._loop_task: Optional[asyncio.Future] = None
+
+    def inc(self, name: str, labels: Dict[str, str], amount: float = 1) -> None:
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def observe(self, name: str, labels: Dict[str, str], value: float) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def observe_call(self, model: str, method: str, timing: Optional[Dict] = None,
+                     usage: Optional[Dict[str, int]] = None, outcome: str = "ok",
+                     retry_errors: Iterable[str] = ()) -> None:
+        """Record one API call (all of its attempts)"""
+        labels = {"model": model, "method": method}
+        self.inc("classifier_api_calls_total", dict(labels, outcome=outcome))
+        for error_class in retry_errors:
+            self.inc("classifier_api_errors_total", dict(labels, error_class=error_class))
+        if timing is not None:
+            self.inc("classifier_api_retries_total", labels, timing.get("retries", 0))
+            for field in CALL_TIMINGS:
+                if timing.get(field) is not None:
+                    self.observe(f"classifier_{field}_seconds", labels, timing[field])
+            if timing.get("processing") is not None:
+                self.observe("classifier_processing_seconds", labels, timing["processing"])
+        for kind, count in (usage or {}).items():
+            self.inc("classifier_tokens_total", dict(labels, kind=kind.replace("_tokens", "")), count)
+
+    def histogram(self, name: str) -> Histogram:
+        """All label sets of one histogram merged"""
+        merged = Histogram()
+        with self.lock:
+            for (metric, _), histogram in self.histograms.items():
+                if metric == name:
+                    merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                    merged.sum += histogram.sum
+                    merged.count += histogram.count
+                    merged.max = max(merged.max, histogram.max)
+        return merged
+
+    def render(self) -> str:
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items(), key=lambda item: item[0])
+            lines = []
+            described = set()
+
+            def describe(name: str) -> None:
+                if name not in described:
+                    kind, text = METRIC_HELP.get(name, ("untyped", name))
+                    lines.extend([f"# HELP {name} {text}", f"# TYPE {name} {kind}"])
+                    described.add(name)
+
+            for (name, labels), value in counters:
+                describe(name)
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for (name, labels), histogram in histograms:
+                describe(name)
+                cumulative = 0
+                for bound, count in zip([f"{b:g}" for b in histogram.buckets] + ["+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Text-file export, e.g. for node_exporter's textfile collector"""
+        with open(path, "w") as f:
+            f.write(self.render())
+
+    async def _sample_loop_lag(self, interval: float) -> None:
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.observe("classifier_event_loop_lag_seconds", {}, max(0.0, time.perf_counter() - start - interval))
+
+    @contextlib.contextmanager
+    def watch_event_loop(self, interval: float = 0.01) -> Iterator[None]:
+        """Sample event-loop lag while the block runs; nested uses share one sampler"""
+        self._loop_watchers += 1
+        if self._loop_watchers == 1:
+            self._loop_task = asyncio.ensure_future(self._sample_loop_lag(interval))
+        try:
+            yield
+        finally:
+            self._loop_watchers -= 1
+            if self._loop_watchers == 0 and self._loop_task is not None:
+                self._loop_task.cancel()
+                self._loop_task = None
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def start_exporter(metrics: Metrics, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve metrics.render() on http://host:port/metrics from a background thread"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def summarize_calls(results: Iterable[Dict]) -> Dict:
+    """Timing histograms and error classes over every API call of one run, in one pass"""
+    histograms = {field: Histogram() for field in CALL_TIMINGS}
+    errors: Counter = Counter()
+    for result in results:
+        classification = result["classification_result"]
+        if "transport_error" in classification:
+            errors[classification.get("error_class", "unknown")] += 1
+            continue
+        for call in classification.get("individual_results") or [classification]:
+            if call.get("response_cache_hit") or "latency" not in call:
+                continue
+            for field in CALL_TIMINGS:
+                if call.get(field) is not None:
+                    histograms[field].observe(call[field])
+            errors.update(call.get("retry_errors", []))
+    summary: Dict = {field: histogram.summary() for field, histogram in histograms.items()}
+    summary["error_classes"] = dict(errors)
+    return summary
+
+
+def format_call_summary(summary: Dict) -> List[str]:
+    lines = [
+        f"{field:<14} p50 {summary[field]['p50'] * 1000:>7.1f}ms  p90 {summary[field]['p90'] * 1000:>7.1f}ms  "
+        f"p99 {summary[field]['p99'] * 1000:>7.1f}ms  max {summary[field]['max'] * 1000:>7.1f}ms"
+        for field in CALL_TIMINGS
+        if summary[field]["count"] or field not in STREAM_TIMINGS
+    ]
+    if summary["error_classes"]:
+        lines.append("errors         " + ", ".join(f"{name} x{count}" for name, count in summary["error_classes"].items()))
+    return lines
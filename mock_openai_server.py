@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI API
+
+Implements just enough of the Chat Completions, Files and Batches endpoints
+for `test_improvements.py` (live or --batch) to run end to end without
+network access or spend. Point the harness at it with
+--base-url http://127.0.0.1:<port>/v1.
+
+Intents are scripted: a JSON file maps transcript substrings to an intent, or
+to a list of intents one of which is drawn per request to simulate a model
+that disagrees with itself (first match wins); everything else gets
+--default-intent. Packed requests (several id-marked transcripts, see
+packing.py) get one {id, intent} entry per transcript, some of which
+--pack-drop-rate leaves out. Prompts that ask for "reasoning" get
+--reasoning-words of it after the intent. Chat completions wait for a delay
+drawn from --latency, plus --token-latency per completion token, and can fail
+with injected 429s and 5xx errors, for load tests (see benchmark.py). With
+stream=True the reply is sent as server-sent events, about one token apart;
+clients may hang up once they have the intent (see streaming.py).
+"""
+
+import argparse
+import email.parser
+import email.policy
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple, Union
+
+
+# One transcript of a packed request (prompts.PACKED_TRANSCRIPT_TEMPLATE)
+PACKED_TRANSCRIPT = re.compile(r"--- BEGIN TRANSCRIPT (\S+) ---\n(.*?)\n--- END TRANSCRIPT \1 ---", re.DOTALL)
+
+# Characters per simulated completion token, for usage and streamed chunks
+CHARS_PER_TOKEN = 4
+REASONING_FILLER = "the caller's words and tone point to this category rather than the others".split()
+
+class LatencyModel:
+    """Response delay distribution, from specs such as 'fixed:0.05', 'uniform:0.02,0.2' or 'lognormal:0.1,0.5'.
+
+    Values are seconds; lognormal takes the median and the sigma of the
+    underlying normal, which gives the long tail real APIs show.
+    """
+
+    PARAMETERS = {"fixed": 1, "uniform": 2, "lognormal": 2}
+
+    def __init__(self, spec: str = "fixed:0"):
+        kind, _, params = spec.partition(":")
+        if kind not in self.PARAMETERS:
+            raise ValueError(f"Unknown latency distribution {kind!r}; use one of {', '.join(self.PARAMETERS)}")
+        self.values = [float(v) for v in params.split(",") if v]
+        if len(self.values) != self.PARAMETERS[kind]:
+            raise ValueError(f"{kind} latency takes {self.PARAMETERS[kind]} value(s), got {spec!r}")
+        self.kind = kind
+        self.spec = spec
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.values[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.values)
+        return rng.lognormvariate(math.log(self.values[0]), self.values[1])
+
+    @property
+    def median(self) -> float:
+        if self.kind == "uniform":
+            return sum(self.values) / 2
+        return self.values[0]
+
+
+class MockOpenAIState:
+    """In-memory files and batches, plus chat-completion behaviour, shared by all request handler threads"""
+
+    def __init__(self, script: Optional[Dict[str, Union[str, List[str]]]] = None,
+                 default_intent: str = "voice_unknown", batch_delay: float = 1.0,
+                 latency: Optional[LatencyModel] = None, rate_limit_rate: float = 0.0,
+                 server_error_rate: float = 0.0, retry_after: float = 0.05, confidence: float = 0.9,
+                 seed: Optional[int] = None, pack_drop_rate: float = 0.0, token_latency: float = 0.0,
+                 reasoning_words: int = 40):
+        self.script = script or {}
+        self.default_intent = default_intent
+        # Seconds a batch stays in_progress before it completes
+        self.batch_delay = batch_delay
+        # Chat completions: response delay, injected failure rates and the
+        # Retry-After sent with 429s
+        self.latency = latency or LatencyModel()
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        # Probability reported through logprobs for an unambiguous intent
+        self.confidence = confidence
+        # Share of a packed request's transcripts missing from the reply
+        self.pack_drop_rate = pack_drop_rate
+        # Seconds per completion token, and the length of a requested "reasoning"
+        self.token_latency = token_latency
+        self.reasoning_words = reasoning_words
+        self.rng = random.Random(seed)
+        self.files: Dict[str, Dict] = {}
+        self.file_contents: Dict[str, bytes] = {}
+        self.batches: Dict[str, Dict] = {}
+        self.stats = {"chat_completions": 0, "rate_limited": 0, "server_errors": 0, "streams_cancelled": 0}
+        self.lock = threading.Lock()
+
+    def scripted_choices(self, messages: List[Dict[str, str]]) -> List[str]:
+        text = messages[-1]["content"] if messages else ""
+        # Match the transcript being classified, not few-shot examples placed before it
+        return self.choices_for(text.rsplit("Transcript:", 1)[-1])
+
+    def choices_for(self, text: str) -> List[str]:
+        for needle, intent in self.script.items():
+            if needle in text:
+                return intent if isinstance(intent, list) else [intent]
+        return [self.default_intent]
+
+    def completion_body(self, request: Dict) -> Dict:
+        messages = request.get("messages", [])
+        prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        packed = PACKED_TRANSCRIPT.findall(messages[-1]["content"]) if messages else []
+        logprobs = None
+        if packed:
+            content = json.dumps({"classifications": [
+                {"id": item_id, "intent": self.rng.choice(self.choices_for(transcript))}
+                for item_id, transcript in packed if self.rng.random() >= self.pack_drop_rate
+            ]})
+        else:
+            choices = self.scripted_choices(messages)
+            intent = self.rng.choice(choices)
+            reply = {"intent": intent}
+            if '"reasoning"' in messages[0]["content"]:
+                words = (REASONING_FILLER * (self.reasoning_words // len(REASONING_FILLER) + 1))[:self.reasoning_words]
+                reply["reasoning"] = " ".join(words)
+            content = json.dumps(reply)
+        completion_tokens = len(content) // CHARS_PER_TOKEN
+        if request.get("logprobs") and not packed:
+            # Three tokens: the JSON around the intent value and the value itself,
+            # whose probability reflects how contested the scripted intent is
+            prefix, _, suffix = content.partition(intent)
+            probability = self.confidence * choices.count(intent) / len(choices)
+            logprobs = {"content": [
+                {"token": token, "logprob": logprob, "bytes": list(token.encode("utf-8")), "top_logprobs": []}
+                for token, logprob in ((prefix, 0.0), (intent, math.log(probability)), (suffix, 0.0))
+            ]}
+        return {
+            "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+                "logprobs": logprobs,
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": 0},
+            },
+        }
+
+    def chat_completion(self, request: Dict) -> Tuple[int, Dict, Dict[str, str]]:
+        """(status, body, headers) for one /v1/chat/completions call, after the simulated delay"""
+        delay = self.latency.sample(self.rng)
+        time.sleep(delay)
+        roll = self.rng.random()
+        with self.lock:
+            self.stats["chat_completions"] += 1
+            if roll < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+            elif roll < self.rate_limit_rate + self.server_error_rate:
+                self.stats["server_errors"] += 1
+        if roll < self.rate_limit_rate:
+            error = {"message": "Rate limit reached (injected by mock)", "type": "requests",
+                     "code": "rate_limit_exceeded"}
+            return 429, {"error": error}, {"retry-after-ms": str(int(self.retry_after * 1000))}
+        if roll < self.rate_limit_rate + self.server_error_rate:
+            error = {"message": "Server error (injected by mock)", "type": "server_error"}
+            return self.rng.choice([500, 503]), {"error": error}, {}
+        headers = {
+            "openai-processing-ms": str(int(delay * 1000)),
+            "x-ratelimit-limit-requests": "10000",
+            "x-ratelimit-remaining-requests": "9999",
+            "x-ratelimit-reset-requests": "6ms",
+            "x-ratelimit-limit-tokens": "10000000",
+            "x-ratelimit-remaining-tokens": "9999000",
+            "x-ratelimit-reset-tokens": "6ms",
+        }
+        body = self.completion_body(request)
+        if not request.get("stream"):
+            # Streamed replies spend this between their chunks instead
+            time.sleep(self.token_latency * body["usage"]["completion_tokens"])
+        return 200, body, headers
+
+    def stream_events(self, body: Dict, include_usage: bool) -> List[Dict]:
+        """The chat.completion.chunk events of a streamed reply: role, one per token, finish, usage"""
+        base = {"id": body["id"], "object": "chat.completion.chunk", "created": body["created"],
+                "model": body["model"]}
+        content = body["choices"][0]["message"]["content"]
+        deltas = [{"role": "assistant", "content": ""}] + [
+            {"content": content[i:i + CHARS_PER_TOKEN]} for i in range(0, len(content), CHARS_PER_TOKEN)
+        ]
+        events = [dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]) for delta in deltas]
+        events.append(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+        if include_usage:
+            events.append(dict(base, choices=[], usage=body["usage"]))
+        return events
+
+    def add_file(self, filename: str, purpose: str, content: bytes) -> Dict:
+        file_id = f"file-mock-{uuid.uuid4().hex[:12]}"
+        record = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self.lock:
+            self.files[file_id] = record
+            self.file_contents[file_id] = content
+        return record
+
+    def create_batch(self, input_file_id: str, endpoint: str, completion_window: str) -> Dict:
+        batch_id = f"batch_mock_{uuid.uuid4().hex[:12]}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": endpoint,
+            "input_file_id": input_file_id,
+            "completion_window": completion_window,
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        return batch
+
+    def get_batch(self, batch_id: str) -> Optional[Dict]:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+        if batch is None:
+            return None
+        if batch["status"] == "in_progress" and time.time() - batch["created_at"] >= self.batch_delay:
+            self._complete_batch(batch)
+        return batch
+
+    def _complete_batch(self, batch: Dict) -> None:
+        lines = self.file_contents[batch["input_file_id"]].decode("utf-8").splitlines()
+        output = []
+        for line in lines:
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": request["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "request_id": uuid.uuid4().hex,
+                    "body": self.completion_body(request["body"]),
+                },
+                "error": None,
+            }))
+        output_file = self.add_file(f"{batch['id']}_output.jsonl", "batch_output",
+                                    ("\n".join(output) + "\n").encode("utf-8"))
+        with self.lock:
+            batch["output_file_id"] = output_file["id"]
+            batch["request_counts"] = {"total": len(output), "completed": len(output), "failed": 0}
+            batch["status"] = "completed"
+            batch["completed_at"] = int(time.time())
+
+
+def parse_multipart(content_type: str, body: bytes) -> Dict[str, Tuple[Optional[str], bytes]]:
+    """Return {field name: (filename, payload)} for a multipart/form-data body"""
+    parser = email.parser.BytesParser(policy=email.policy.HTTP)
+    message = parser.parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True) or b"")
+    return fields
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    state: MockOpenAIState
+    # Keep-alive, like the real API, so load tests do not measure TCP setup;
+    # without TCP_NODELAY, headers and body sent separately stall on delayed ACKs
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, events: List[Dict], headers: Dict[str, str]) -> None:
+        """Server-sent events over chunked encoding, token_latency apart after the first token"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            for i, event in enumerate(events):
+                if i > 1 and event["choices"] and event["choices"][0]["delta"]:
+                    time.sleep(self.state.token_latency)
+                self._write_chunk(f"data: {json.dumps(event)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early
+            with self.state.lock:
+                self.state.stats["streams_cancelled"] += 1
+            self.close_connection = True
+
+    def _write_chunk(self, data: str) -> None:
+        payload = data.encode("utf-8")
+        self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _send_error(self, status: int, message: str) -> None:
+        self._send_json(status, {"error": {"message": message, "type": "invalid_request_error"}})
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path == "/v1/chat/completions":
+            request = json.loads(self._read_body())
+            status, payload, headers = self.state.chat_completion(request)
+            if request.get("stream") and status == 200:
+                include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+                self._send_stream(self.state.stream_events(payload, include_usage), headers)
+            else:
+                self._send_json(status, payload, headers)
+        elif path == "/v1/files":
+            fields = parse_multipart(self.headers["Content-Type"], self._read_body())
+            filename, content = fields["file"]
+            purpose = fields["purpose"][1].decode("utf-8")
+            self._send_json(200, self.state.add_file(filename or "upload.jsonl", purpose, content))
+        elif path == "/v1/batches":
+            request = json.loads(self._read_body())
+            if request.get("input_file_id") not in self.state.files:
+                self._send_error(404, "No such file")
+                return
+            self._send_json(200, self.state.create_batch(
+                request["input_file_id"], request["endpoint"], request["completion_window"]
+            ))
+        else:
+            self._send_error(404, f"Unknown endpoint {path}")
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        batch_match = re.fullmatch(r"/v1/batches/([\w-]+)", path)
+        content_match = re.fullmatch(r"/v1/files/([\w-]+)/content", path)
+        if batch_match:
+            batch = self.state.get_batch(batch_match.group(1))
+            if batch is None:
+                self._send_error(404, "No such batch")
+            else:
+                self._send_json(200, batch)
+        elif content_match:
+            content = self.state.file_contents.get(content_match.group(1))
+            if content is None:
+                self._send_error(404, "No such file")
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self._send_error(404, f"Unknown endpoint {path}")
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    # The default listen backlog of 5 resets connections under load tests
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def make_server(state: MockOpenAIState, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Build a server bound to (host, port); port 0 picks a free one"""
+    handler = type("BoundMockOpenAIHandler", (MockOpenAIHandler,), {"state": state})
+    return MockOpenAIServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--script", help="JSON file mapping transcript substrings to an intent or a list of intents")
+    parser.add_argument("--default-intent", default="voice_unknown")
+    parser.add_argument("--batch-delay", type=float, default=1.0,
+                        help="Seconds before a submitted batch completes")
+    parser.add_argument("--latency", default="fixed:0",
+                        help="Chat completion delay: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA (seconds)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of chat completions answered 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0,
+                        help="Fraction of chat completions answered 500/503")
+    parser.add_argument("--retry-after", type=float, default=0.05, help="Seconds suggested by injected 429s")
+    parser.add_argument("--confidence", type=float, default=0.9,
+                        help="Intent probability reported through logprobs")
+    parser.add_argument("--seed", type=int, help="Seed for latencies, failures and intent draws")
+    parser.add_argument("--pack-drop-rate", type=float, default=0.0,
+                        help="Fraction of a packed request's transcripts left out of the reply")
+    parser.add_argument("--token-latency", type=float, default=0.0,
+                        help="Seconds per completion token, spent between streamed chunks or before a full reply")
+    parser.add_argument("--reasoning-words", type=int, default=40,
+                        help="Length of the reasoning given to prompts that ask for one")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    state = MockOpenAIState(script=script, default_intent=args.default_intent, batch_delay=args.batch_delay,
+                            latency=LatencyModel(args.latency), rate_limit_rate=args.rate_limit_rate,
+                            server_error_rate=args.server_error_rate, retry_after=args.retry_after,
+                            confidence=args.confidence, seed=args.seed, pack_drop_rate=args.pack_drop_rate,
+                            token_latency=args.token_latency, reasoning_words=args.reasoning_words)
+    server = make_server(state, args.host, args.port)
+    print(f"Mock OpenAI API listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
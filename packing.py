@@ -0,0 +1,160 @@
+"""
+Multi-transcript packing
+
+Every single-transcript request re-sends the method's whole system prompt
+(instructions and category definitions) for what is often a three-line
+hang-up. In packed mode, transcripts headed for the same (method, model,
+sample) are collected into one request. Each carries an id, and the model
+answers with a JSON list of {id, intent}.
+
+A pack is sent once the next transcript would push it over its token budget
+or its item limit, or after a short linger if no more transcripts arrive.
+Each reply is checked against the ids sent. Items that are missing,
+duplicated or given an unknown intent are retried in smaller packs (the
+missing items split in two), and finally one per request. Items the
+reply answered are never asked again.
+
+Token usage of a packed call is split evenly over its items, and each item
+records its share of the call ("call_share"), so per-cell totals still add
+up to the real number of calls and tokens.
+"""
+
+import asyncio
+import json
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+from prompts import INTENTS
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - falls back to a character estimate
+    tiktoken = None
+
+
+# Transcript tokens per packed request
+DEFAULT_PACK_TOKENS = 4000
+DEFAULT_PACK_ITEMS = 20
+# Seconds a partial pack waits for more transcripts before it is sent anyway
+DEFAULT_PACK_LINGER = 0.05
+# Times missing items are re-split before falling back to one request each
+PACK_RETRY_DEPTH = 2
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count with tiktoken's o200k_base when installed, else about four characters per token"""
+    global _encoding
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def item_id(position: int) -> str:
+    return f"t{position + 1}"
+
+
+def parse_pack_reply(content: Optional[str], ids: Sequence[str]) -> Dict[str, str]:
+    """{id: intent} for the well-formed answers in a packed reply.
+
+    Accepts {"classifications": [...]} or a bare list. Entries with an id
+    that was not sent, an id answered more than once, or an intent outside
+    INTENTS are dropped, so those items count as missing.
+    """
+    try:
+        reply = json.loads(content or "")
+    except ValueError:
+        return {}
+    entries = reply.get("classifications") if isinstance(reply, dict) else reply
+    if not isinstance(entries, list):
+        return {}
+    answers: Dict[str, str] = {}
+    seen: Set[str] = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        entry_id = str(entry.get("id"))
+        if entry_id in seen:
+            answers.pop(entry_id, None)
+            continue
+        seen.add(entry_id)
+        if entry_id in ids and entry.get("intent") in INTENTS:
+            answers[entry_id] = entry["intent"]
+    return answers
+
+
+def split_usage(usage: Dict[str, int], parts: int) -> List[Dict[str, int]]:
+    """Split token counts into `parts` integer shares that add up exactly"""
+    shares: List[Dict[str, int]] = [{} for _ in range(parts)]
+    for key, value in usage.items():
+        base, extra = divmod(value, parts)
+        for i, share in enumerate(shares):
+            share[key] = base + (1 if i < extra else 0)
+    return shares
+
+
+def add_usage(total: Dict[str, int], usage: Dict[str, int]) -> Dict[str, int]:
+    return {key: total.get(key, 0) + usage.get(key, 0) for key in set(total) | set(usage)}
+
+
+class PackItem:
+    """One transcript waiting in, or sent with, a pack"""
+
+    def __init__(self, transcript: str, tokens: int, future: asyncio.Future):
+        self.transcript = transcript
+        self.tokens = tokens
+        self.future = future
+        # Usage and call shares of earlier packs that did not answer this item
+        self.usage: Dict[str, int] = {}
+        self.call_share = 0.0
+        self.attempts = 0
+
+
+class PackQueue:
+    """Collects transcripts into packs and hands each full (or lingering) pack to `send`"""
+
+    def __init__(self, send: Callable[[List[PackItem]], Awaitable[None]], token_budget: int = DEFAULT_PACK_TOKENS,
+                 max_items: int = DEFAULT_PACK_ITEMS, linger: float = DEFAULT_PACK_LINGER):
+        self.send = send
+        self.token_budget = token_budget
+        self.max_items = max_items
+        self.linger = linger
+        self.items: List[PackItem] = []
+        self.tokens = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Sent packs, referenced until done so they are not garbage collected
+        self._sending: Set[asyncio.Future] = set()
+
+    def add(self, transcript: str) -> asyncio.Future:
+        """Queue a transcript; the future resolves to its classification result"""
+        tokens = estimate_tokens(transcript)
+        if self.items and (self.tokens + tokens > self.token_budget or len(self.items) >= self.max_items):
+            self.flush()
+        loop = asyncio.get_running_loop()
+        item = PackItem(transcript, tokens, loop.create_future())
+        self.items.append(item)
+        self.tokens += tokens
+        if len(self.items) == 1:
+            self._timer = loop.call_later(self.linger, self.flush)
+        return item.future
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.items:
+            return
+        items, self.items, self.tokens = self.items, [], 0
+        task = asyncio.ensure_future(self.send(items))
+        self._sending.add(task)
+        task.add_done_callback(lambda done: self._sent(items, done))
+
+    def _sent(self, items: List[PackItem], task: asyncio.Future) -> None:
+        self._sending.discard(task)
+        # send() resolves every item; this only catches it failing outright
+        error = task.exception() if not task.cancelled() else asyncio.CancelledError()
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(error or RuntimeError("Pack finished without answering this item"))
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Local prefilter for trivially classifiable transcripts
+
+Voicemail greetings and calls where the user only ever said "Hello?" make up
+a good share of the dataset, yet each one costs an API round trip per
+method (three for the ensemble). The prefilter parses a transcript's
+User:/Agent: turns once and answers those cases locally:
+
+- compiled rules: a voicemail greeting in the user's first turns, or a call
+  in which every user turn is a greeting or a non-lexical sound ("Hello?",
+  "Um"). Short answers such as "Yes", "Okay" or "Thanks" can be replies to
+  the agent's question, so they always go to the API;
+- optionally, a small linear model over hashed word n-grams, trained on the
+  labelled CSV, that may answer only for the intents in PREFILTER_INTENTS and
+  only above a high probability threshold.
+
+Anything else returns None and goes to the API as before. Hit rate (share of
+transcripts answered locally) and precision (share of those answers that match
+the ground truth) are reported separately, overall and per rule. The rules
+were written against data/dataset.csv, so their precision there is not a
+held-out estimate; tests/data/prefilter_holdout.csv holds labelled
+transcripts the rules were not written from.
+
+Usage:
+    python prefilter.py data/dataset.csv
+    python prefilter.py tests/data/prefilter_holdout.csv
+    python prefilter.py data/dataset.csv --train prefilter_model.npz
+    python prefilter.py data/dataset.csv --model prefilter_model.npz --threshold 0.97
+"""
+
+import argparse
+import functools
+import hashlib
+import re
+import zlib
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from result_stream import is_transport_failure, iter_csv_rows
+
+
+# Intents the prefilter may answer; everything else always goes to the API
+PREFILTER_INTENTS = ("voice_voice_mail", "voice_immediate_hangup")
+DEFAULT_MODEL_THRESHOLD = 0.95
+# Hashed feature space of the linear model
+HASH_DIM = 2 ** 16
+
+# Carrier and answering-machine greetings (English and Spanish)
+VOICEMAIL_PATTERN = re.compile(
+    r"record your message|at the tone|after the (?:tone|beep)|leave (?:a|your) message|"
+    r"(?:is|are) not available|voice ?mail|mailbox|"
+    r"dej[ea] (?:tu|su) mensaje|despu[eé]s del (?:tono|pitido)|buz[oó]n de voz",
+    re.IGNORECASE,
+)
+# Only the opening user turns are searched: a greeting plays before anyone speaks
+VOICEMAIL_TURNS = 2
+
+# A user turn made of these words alone carries no intent: greetings, non-lexical
+# sounds and the transcriber's "(inaudible speech)". Affirmatives and thanks are
+# left out on purpose, since they may answer the agent's question.
+FILLER_WORDS = frozenset(
+    "hello hi hey hola aló alo oh ah uh um umm hmm mm mhmm inaudible speech".split()
+)
+# Longer all-filler exchanges are left to the model
+MAX_HANGUP_TURNS = 5
+
+_WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?", re.UNICODE)
+
+
+class Turn(NamedTuple):
+    speaker: str
+    text: str
+
+
+class ParsedTranscript(NamedTuple):
+    """The compact form every rule and the model work from"""
+    turns: Tuple[Turn, ...]
+    user_turns: Tuple[str, ...]
+    user_words: Tuple[Tuple[str, ...], ...]
+
+
+def parse_turns(transcript: str) -> ParsedTranscript:
+    """Split a transcript into speaker turns; lines without a prefix continue the previous turn"""
+    turns: List[Turn] = []
+    for line in transcript.splitlines():
+        speaker, sep, text = line.partition(":")
+        if sep and speaker.strip() in ("User", "Agent"):
+            turns.append(Turn(speaker.strip(), text.strip()))
+        elif turns and line.strip():
+            turns[-1] = Turn(turns[-1].speaker, f"{turns[-1].text} {line.strip()}".strip())
+    user_turns = tuple(turn.text for turn in turns if turn.speaker == "User" and turn.text)
+    user_words = tuple(tuple(_WORD.findall(text.lower())) for text in user_turns)
+    return ParsedTranscript(tuple(turns), user_turns, user_words)
+
+
+def voicemail_rule(parsed: ParsedTranscript) -> bool:
+    return any(VOICEMAIL_PATTERN.search(text) for text in parsed.user_turns[:VOICEMAIL_TURNS])
+
+
+def hangup_rule(parsed: ParsedTranscript) -> bool:
+    """Every user turn is a greeting or a non-lexical sound, and there are only a few of them"""
+    if not parsed.user_turns or len(parsed.user_turns) > MAX_HANGUP_TURNS:
+        return False
+    return all(set(words) <= FILLER_WORDS for words in parsed.user_words)
+
+
+# Checked in order; the first match answers
+RULES = [
+    ("voicemail_greeting", "voice_voice_mail", voicemail_rule),
+    ("filler_only", "voice_immediate_hangup", hangup_rule),
+]
+
+
+def _hash(token: str) -> int:
+    # crc32 rather than hash(): string hashing is salted per process
+    return zlib.crc32(token.encode("utf-8"))
+
+
+def featurize(parsed: ParsedTranscript, dim: int = HASH_DIM) -> Tuple[np.ndarray, np.ndarray]:
+    """Signed hashed counts of user word unigrams/bigrams plus turn-shape tokens; (indices, values)"""
+    tokens = [f"user_turns={min(len(parsed.user_turns), 10)}",
+              f"agent_turns={min(len(parsed.turns) - len(parsed.user_turns), 10)}"]
+    for words in parsed.user_words:
+        tokens.extend(f"w={word}" for word in words)
+        tokens.extend(f"b={a}_{b}" for a, b in zip(words, words[1:]))
+    counts: Dict[int, float] = defaultdict(float)
+    for token in tokens:
+        h = _hash(token)
+        counts[h % dim] += 1.0 if (h // dim) % 2 == 0 else -1.0
+    indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+    values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+    # Log-scaled and L2-normalised, so long transcripts do not dominate
+    values = np.sign(values) * np.log1p(np.abs(values))
+    norm = np.linalg.norm(values)
+    return indices, values / norm if norm else values
+
+
+class HashingModel:
+    """Multinomial logistic regression over hashed features, trained with full-batch gradient descent"""
+
+    def __init__(self, labels: List[str], dim: int = HASH_DIM):
+        self.labels = list(labels)
+        self.dim = dim
+        self.weights = np.zeros((dim, len(labels)), dtype=np.float32)
+        self.bias = np.zeros(len(labels), dtype=np.float32)
+
+    def _scores(self, batch: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        scores = np.tile(self.bias, (len(batch), 1))
+        for row, (indices, values) in enumerate(batch):
+            scores[row] += values @ self.weights[indices]
+        return scores
+
+    def predict_proba(self, batch: List[Tuple[np.ndarray, np.ndarray]]) -> np.ndarray:
+        scores = self._scores(batch)
+        scores -= scores.max(axis=1, keepdims=True)
+        probs = np.exp(scores)
+        return probs / probs.sum(axis=1, keepdims=True)
+
+    def fit(self, batch: List[Tuple[np.ndarray, np.ndarray]], labels: List[str], epochs: int = 200,
+            learning_rate: float = 1.0, l2: float = 1e-3) -> "HashingModel":
+        targets = np.zeros((len(batch), len(self.labels)), dtype=np.float32)
+        targets[np.arange(len(batch)), [self.labels.index(label) for label in labels]] = 1.0
+        for _ in range(epochs):
+            error = (self.predict_proba(batch) - targets) / len(batch)
+            gradient = l2 * self.weights
+            for row, (indices, values) in enumerate(batch):
+                np.add.at(gradient, indices, np.outer(values, error[row]))
+            self.weights -= learning_rate * gradient
+            self.bias -= learning_rate * error.sum(axis=0)
+        return self
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=np.array(self.labels))
+
+    @classmethod
+    def load(cls, path: str) -> "HashingModel":
+        with np.load(path) as data:
+            model = cls([str(label) for label in data["labels"]], dim=data["weights"].shape[0])
+            model.weights = data["weights"]
+            model.bias = data["bias"]
+        return model
+
+    def digest(self) -> str:
+        parts = (np.ascontiguousarray(self.weights).tobytes(), np.ascontiguousarray(self.bias).tobytes(),
+                 "\0".join(self.labels).encode("utf-8"))
+        return hashlib.sha256(b"\0".join(parts)).hexdigest()
+
+
+def train_model(rows: Iterable[Tuple[str, str]], **fit_options) -> HashingModel:
+    """Fit on (transcript, intent) pairs over every intent, so the allowed ones are learned against the rest"""
+    transcripts, intents = zip(*rows)
+    batch = [featurize(parse_turns(transcript)) for transcript in transcripts]
+    return HashingModel(sorted(set(intents))).fit(batch, list(intents), **fit_options)
+
+
+class Prefilter:
+    """Answers a transcript locally when a rule or a confident model prediction allows it"""
+
+    def __init__(self, rules: bool = True, model: Optional[HashingModel] = None,
+                 threshold: float = DEFAULT_MODEL_THRESHOLD, cache_size: int = 1024):
+        self.rules = RULES if rules else []
+        self.model = model
+        self.threshold = threshold
+        # Sweeps classify each transcript once per cell, back to back
+        self.decide = functools.lru_cache(maxsize=cache_size)(self._decide)
+
+    def _decide(self, transcript: str) -> Optional[Dict]:
+        """{"intent", "source", "confidence"} for a local answer, None to call the API"""
+        parsed = parse_turns(transcript)
+        for name, intent, rule in self.rules:
+            if rule(parsed):
+                return {"intent": intent, "source": f"rule:{name}", "confidence": 1.0}
+        if self.model is not None:
+            probs = self.model.predict_proba([featurize(parsed, self.model.dim)])[0]
+            best = int(probs.argmax())
+            intent = self.model.labels[best]
+            if intent in PREFILTER_INTENTS and probs[best] >= self.threshold:
+                return {"intent": intent, "source": "model", "confidence": float(probs[best])}
+        return None
+
+    def settings(self) -> Dict:
+        """Everything that decides which transcripts are answered locally, and how"""
+        return {
+            "rules": [name for name, _, _ in self.rules],
+            "voicemail_pattern": VOICEMAIL_PATTERN.pattern,
+            "voicemail_turns": VOICEMAIL_TURNS,
+            "filler_words": sorted(FILLER_WORDS),
+            "max_hangup_turns": MAX_HANGUP_TURNS,
+            "model": self.model.digest() if self.model is not None else None,
+            "threshold": self.threshold,
+        }
+
+
+def prefilter_report(decisions: Iterable[Tuple[Optional[str], Optional[Dict]]]) -> Dict:
+    """Hit rate and precision, overall and per source, from (ground truth, decision) pairs"""
+    total = 0
+    hits: Counter = Counter()
+    correct: Counter = Counter()
+    for truth, decision in decisions:
+        total += 1
+        if decision is None:
+            continue
+        hits[decision["source"]] += 1
+        correct[decision["source"]] += decision["intent"] == truth
+
+    def rates(hit_count: int, correct_count: int) -> Dict:
+        return {"hits": hit_count, "correct": correct_count, "hit_rate": hit_count / total if total else 0.0,
+                "precision": correct_count / hit_count if hit_count else None}
+
+    report = {"transcripts": total, **rates(sum(hits.values()), sum(correct.values()))}
+    report["by_source"] = {source: rates(hits[source], correct[source]) for source in sorted(hits)}
+    return report
+
+
+def report_from_results(results: Iterable[Dict], ground_truth: Dict[int, str]) -> Dict:
+    """Prefilter report of one run's result rows, using the decisions recorded in them"""
+    decisions = []
+    for row in results:
+        if is_transport_failure(row):
+            continue
+        classification = row["classification_result"]
+        decision = None
+        if "prefilter" in classification:
+            decision = {"intent": classification["intent"], "source": classification["prefilter"]}
+        decisions.append((ground_truth.get(row["transcript_index"]), decision))
+    return prefilter_report(decisions)
+
+
+def format_report(report: Dict) -> List[str]:
+    def describe(stats: Dict) -> str:
+        precision = f"{stats['precision']:.1%}" if stats["precision"] is not None else "n/a"
+        return f"hit rate {stats['hit_rate']:.1%} ({stats['hits']}/{report['transcripts']}), precision {precision}"
+
+    lines = [f"Prefilter: {describe(report)}"]
+    lines.extend(f"  {source:<26} {describe(stats)}" for source, stats in report["by_source"].items())
+    return lines
+
+
+def cross_validate(rows: List[Tuple[str, str]], folds: int, threshold: float, rules: bool) -> Dict:
+    """Report for a model trained on the other folds of every transcript, so precision is not on training data"""
+    decisions = []
+    for fold in range(folds):
+        train = [row for i, row in enumerate(rows) if i % folds != fold]
+        prefilter = Prefilter(rules=rules, model=train_model(train), threshold=threshold)
+        decisions.extend((intent, prefilter.decide(transcript))
+                         for i, (transcript, intent) in enumerate(rows) if i % folds == fold)
+    return prefilter_report(decisions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit rate and precision of the local prefilter on a labelled CSV")
+    parser.add_argument("csv_file", help="CSV with human_generated_intent ground truth")
+    parser.add_argument("--model", help="Hashing model to use alongside the rules")
+    parser.add_argument("--train", metavar="PATH", help="Train a hashing model on the CSV and save it here")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_MODEL_THRESHOLD,
+                        help="Probability the model needs before it may answer")
+    parser.add_argument("--folds", type=int, default=5, help="Cross-validation folds for --train")
+    parser.add_argument("--no-rules", action="store_true", help="Evaluate the model on its own")
+    args = parser.parse_args()
+
+    rows = [(transcript, intent) for _, transcript, intent in iter_csv_rows(args.csv_file)]
+
+    if args.train:
+        report = cross_validate(rows, args.folds, args.threshold, rules=not args.no_rules)
+        print(f"{args.folds}-fold cross-validation:")
+        print("\n".join(format_report(report)))
+        train_model(rows).save(args.train)
+        print(f"Saved: {args.train}")
+        return 0
+
+    model = HashingModel.load(args.model) if args.model else None
+    prefilter = Prefilter(rules=not args.no_rules, model=model, threshold=args.threshold)
+    report = prefilter_report((intent, prefilter.decide(transcript)) for transcript, intent in rows)
+    print("\n".join(format_report(report)))
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
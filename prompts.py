@@ -0,0 +1,196 @@
+"""
+Prompt assembly for the classifier methods
+
+Every method's request is split into a static system prompt (instructions,
+category definitions, few-shot exemplars, reply format) and a user message
+that carries only the transcript. The system prompts are built once at
+import time and are byte-identical across requests, so OpenAI's automatic
+prefix caching can reuse them; the per-request content always comes last.
+"""
+
+import json
+from typing import Dict, List, Sequence, Tuple
+
+
+INTENTS = [
+    "voice_interested",
+    "voice_not_interested",
+    "voice_immediate_hangup",
+    "voice_wrong_number",
+    "voice_no_action",
+    "voice_wants_call_back",
+    "voice_wants_email_follow_up",
+    "voice_wants_whatsapp_sms_follow_up",
+    "voice_voice_mail",
+    "voice_unknown",
+]
+
+CATEGORY_DEFINITIONS = """- 'voice_interested': The User EXPLICITLY indicated he/she is interested in the course or the university.
+- 'voice_not_interested': The user EXPLICITLY say that he/she is not interested in the course or the university.
+- 'voice_immediate_hangup': The user hangs up without expressing their full intent. This includes cutting off halfway through when the caller is talking, or no substantial discussion after exchanging greetings.
+- 'voice_wrong_number': The user who answered the phone indicated that we are calling the wrong number.
+- 'voice_no_action': The student has already signed up to the course or is in contact with the advisor. Only use this if the student does not need any additional help.
+- 'voice_wants_call_back': The user EXPLICITLY request that he/she wants a call back.
+- 'voice_wants_email_follow_up': The user wished to follow up through email.
+- 'voice_wants_whatsapp_sms_follow_up': The user wished to follow up through instant messaging, such as via Whatsapp or SMS.
+- 'voice_voice_mail': The call goes into an automated reply or a voice mail. Reply does not come from an actual user.
+- 'voice_unknown': Anything that does not fit into the above categories."""
+
+# 2 correctly classified examples from the original dataset
+FEW_SHOT_EXAMPLES = """Here are 2 examples of correct classifications:
+
+Example 1:
+Transcript: User: Hello?
+Agent: Hi
+User: Hello?
+Agent: Wai Kit, this is James from Kaplan. Do you have a minute to chat?
+User: No. Sorry. Can you call back another day?
+Agent: No problem at all! When would be a good day
+User: Thank you.
+Agent: for me to call
+User: Bye bye.
+User: Thank you. Bye bye.
+
+Correct classification: {"intent": "voice_wants_call_back"}
+
+Example 2:
+Transcript: User: Hello?
+Agent: Hi Siti! This is James from Kaplan. Do
+User: Say
+Agent: you have a quick minute to chat?
+User: again?
+Agent: Hi Siti, this is James from Kaplan Singapore. Do you have a moment to chat?
+User: Yes.
+Agent: Great! I wanted to check if you are still interested in pursuing the Bachelor of Marketing degree at Global University?
+User: It's Because I still need to check on my ABL that security, may I know when is the next Next, we'll go date to enter.
+Agent: Global University has three intakes each year—in January, May, and September. Would you like me to set up a call with your advisor to discuss this further? They can guide you on the next steps.
+User: Okay. But if were to join, most probably, I will be joining during September.
+Agent: That sounds like a good plan! September gives you plenty of time to prepare. Would you like me to schedule a call with your advisor to discuss your application and any other details?
+Agent: Just checking in—would you like me to arrange a call with your advisor to help you with the September intake and any other questions you might have?
+User: Yes, please.
+
+Correct classification: {"intent": "voice_interested"}"""
+
+
+SYSTEM_PROMPTS = {
+    # 1. BASELINE - Original simple prompt from classify_logs.py
+    "baseline": f"""
+You are an responsible for classifying incoming call transcripts into relevant intent types so that the humans that are assigned to follow up know what is the best course of action.
+You will be given a call transcript.
+Focus exclusively on the user's reply, i.e. sentences that starts with 'User: '.
+Read the transcripts carefully and classify the call transcript into the following categories:
+{CATEGORY_DEFINITIONS}
+
+Remember to focus on the User's replies to derive their intent, and not the Agent's!
+Reply in the following JSON format {{'intent': <category>}}
+""",
+    # 2. DIFFERENT PROMPT - More conversational
+    "different_prompt": f"""
+You're helping analyze phone calls between education advisors and prospective students.
+
+Your job: Figure out what the person who answered (the "User") actually wants.
+
+{CATEGORY_DEFINITIONS}
+
+What does the User want? Respond in JSON: {{"intent": "<category>"}}
+""",
+    # 3. FEW-SHOT LEARNING - exemplars live in the static prefix, not the user turn
+    "few_shot": f"""
+You are responsible for classifying incoming call transcripts into relevant intent types.
+Focus exclusively on the user's reply (sentences starting with 'User:').
+
+Categories:
+{CATEGORY_DEFINITIONS}
+
+{FEW_SHOT_EXAMPLES}
+
+Reply in JSON: {{"intent": "<category>"}}
+""",
+    # 3b. DYNAMIC FEW-SHOT - exemplars are retrieved per transcript (few_shot_index.py),
+    # so they go in the user turn and the system prompt stays cacheable
+    "dynamic_few_shot": f"""
+You are responsible for classifying incoming call transcripts into relevant intent types.
+Focus exclusively on the user's reply (sentences starting with 'User:').
+
+Categories:
+{CATEGORY_DEFINITIONS}
+
+Reply in JSON: {{"intent": "<category>"}}
+""",
+    # 4. CHAIN-OF-THOUGHT
+    "chain_of_thought": f"""
+You are responsible for classifying call transcripts. Focus only on User statements.
+
+Categories: {", ".join(INTENTS)}
+
+Think step by step:
+1. What did the User actually say?
+2. What is their clear intent?
+3. Which category fits best?
+
+Respond in JSON: {{"intent": "<category>", "reasoning": "<brief explanation>"}}
+""",
+}
+
+# Per-request user messages; the transcript is the last thing in the prompt
+TRANSCRIPT_TEMPLATES = {
+    "baseline": "Transcript:\n--- BEGIN TRANSCRIPT ---\n{transcript}\n--- END TRANSCRIPT ---",
+    "different_prompt": "Phone conversation:\n\n{transcript}",
+    "few_shot": "Now classify this transcript:\nTranscript: {transcript}",
+    "dynamic_few_shot": "Here are {count} examples of correct classifications:\n\n{examples}\n\n"
+                        "Now classify this transcript:\nTranscript: {transcript}",
+    "chain_of_thought": "Transcript: {transcript}",
+}
+
+
+# Appended to a method's system prompt when several transcripts share one request
+PACKED_INSTRUCTIONS = """
+This request contains several transcripts, each between BEGIN/END markers that carry its id.
+Classify every transcript on its own, with the categories and rules above.
+Instead of a single object, reply in JSON with one entry per transcript (any other fields asked for above go in the entry):
+{"classifications": [{"id": "<id>", "intent": "<category>"}, ...]}
+"""
+
+# Built once, like SYSTEM_PROMPTS, so packed requests share a cacheable prefix
+PACKED_SYSTEM_PROMPTS = {method: prompt + PACKED_INSTRUCTIONS for method, prompt in SYSTEM_PROMPTS.items()}
+
+PACKED_TRANSCRIPT_TEMPLATE = "--- BEGIN TRANSCRIPT {id} ---\n{transcript}\n--- END TRANSCRIPT {id} ---"
+
+
+def format_examples(examples: Sequence[Tuple[str, str]]) -> str:
+    """(transcript, intent) pairs in the same layout as FEW_SHOT_EXAMPLES"""
+    return "\n\n".join(
+        f"Example {i}:\nTranscript: {transcript}\n\nCorrect classification: {json.dumps({'intent': intent})}"
+        for i, (transcript, intent) in enumerate(examples, 1)
+    )
+
+
+def assemble_messages(method: str, transcript: str, suffix: str = "",
+                      examples: Sequence[Tuple[str, str]] = ()) -> List[Dict[str, str]]:
+    """Build the chat messages for one request: static prefix, then transcript.
+
+    `suffix` is appended after the transcript (e.g. the opt-in cache buster)
+    so it never disturbs the cacheable prefix. `examples` fills the
+    dynamic_few_shot template with (transcript, intent) pairs.
+    """
+    user_prompt = TRANSCRIPT_TEMPLATES[method].format(transcript=transcript, count=len(examples),
+                                                      examples=format_examples(examples))
+    if suffix:
+        user_prompt = f"{user_prompt}\n\n{suffix}"
+    return [
+        {"role": "system", "content": SYSTEM_PROMPTS[method]},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def assemble_packed_messages(method: str, items: Sequence[Tuple[str, str]], suffix: str = "") -> List[Dict[str, str]]:
+    """Chat messages classifying several (id, transcript) pairs in one request"""
+    user_prompt = "\n\n".join(
+        PACKED_TRANSCRIPT_TEMPLATE.format(id=item_id, transcript=transcript) for item_id, transcript in items
+    )
+    if suffix:
+        user_prompt = f"{user_prompt}\n\n{suffix}"
+    return [
+        {"role": "system", "content": PACKED_SYSTEM_PROMPTS[method]},
+        {"role": "user", "content": user_prompt},
+    ]
@@ -0,0 +1,111 @@
+"""
+On-disk response cache for chat completions
+
+Responses are stored in SQLite, keyed by a hash of
+(model, method, normalized prompt, sampling params), so re-running a sweep
+only pays for the calls whose inputs actually changed.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+
+DEFAULT_CACHE_PATH = ".response_cache.sqlite3"
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Normalize line endings and surrounding whitespace in each message"""
+    normalized = []
+    for message in messages:
+        content = message.get("content", "").replace("\r\n", "\n")
+        content = "\n".join(line.rstrip() for line in content.split("\n")).strip()
+        normalized.append({"role": message["role"], "content": content})
+    return normalized
+
+
+def make_cache_key(model: str, method: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+    """Content address for one request"""
+    payload = json.dumps({
+        "model": model,
+        "method": method,
+        "messages": normalize_messages(messages),
+        "params": params,
+    }, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed cache with TTL and LRU size eviction"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_seconds: Optional[float] = 30 * 24 * 3600,
+                 max_entries: Optional[int] = 100_000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                method TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used_at)")
+        self.conn.commit()
+        self.evict()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response for key, or None if missing or expired"""
+        row = self.conn.execute(
+            "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or (self.ttl_seconds is not None and now - row[1] > self.ttl_seconds):
+            self.misses += 1
+            return None
+        self.conn.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+        self.conn.commit()
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, method: str, response: Dict[str, Any]) -> None:
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses (key, model, method, response, created_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, method, json.dumps(response, ensure_ascii=False), now, now),
+        )
+        self.conn.commit()
+
+    def evict(self) -> int:
+        """Drop expired entries, then the least recently used ones beyond max_entries"""
+        removed = 0
+        if self.ttl_seconds is not None:
+            cursor = self.conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+            removed += cursor.rowcount
+        if self.max_entries is not None:
+            cursor = self.conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            removed += cursor.rowcount
+        self.conn.commit()
+        return removed
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,133 @@
+"""
+Streaming input and incremental, resumable result output
+
+Rows are read from the CSV lazily, and every classified row is appended to a
+per-cell JSONL log as soon as it completes. Re-opening a log resumes it:
+indices that already have an answer are skipped, and rows recorded as
+transport failures are dropped so they are retried.
+"""
+
+import csv
+import json
+import os
+import time
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+
+def iter_csv_records(file_path: str, offset: Optional[int] = None,
+                     first_index: int = 1) -> Iterator[Tuple[int, int, Dict[str, str]]]:
+    """Yield (byte offset, transcript_index, row) for every CSV row, including ones with an empty transcript.
+
+    The file is fed to the csv reader one line at a time, so each row's byte
+    offset is known. Passing a row's offset and index back in starts reading
+    at that row instead of the top of the file.
+    """
+    with open(file_path, 'rb') as f:
+        position = 0
+
+        def lines() -> Iterator[str]:
+            nonlocal position
+            for line in f:
+                position += len(line)
+                yield line.decode('utf-8')
+
+        reader = csv.reader(lines())
+        header = next(reader, None)
+        if header is None:
+            return
+        if offset is not None:
+            f.seek(offset)
+            position = offset
+        index = first_index - 1
+        while True:
+            start = position
+            record = next(reader, None)
+            if record is None:
+                return
+            if not record:
+                # Blank lines are not rows, as with csv.DictReader
+                continue
+            index += 1
+            yield start, index, dict(zip(header, record))
+
+
+def iter_csv_rows(file_path: str, offset: Optional[int] = None,
+                  first_index: int = 1) -> Iterator[Tuple[int, str, str]]:
+    """Yield (transcript_index, transcript, human_generated_intent) in one pass.
+
+    transcript_index is the 1-based CSV row number, so it stays aligned with
+    the ground truth even when rows with an empty transcript are skipped.
+    offset and first_index start from a row found by iter_csv_records.
+    """
+    for _, index, row in iter_csv_records(file_path, offset, first_index):
+        transcript = row.get('transcript', '')
+        if transcript:
+            yield index, transcript, row.get('human_generated_intent', '')
+
+
+def is_transport_failure(row: Dict) -> bool:
+    return "transport_error" in row["classification_result"]
+
+
+def iter_result_log(path: str) -> Iterator[Dict]:
+    """Yield the rows of a result log, in completion order"""
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+class ResultLog:
+    """Append-only JSONL result file for one (method, model) cell"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[int] = set()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._compact()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _compact(self) -> None:
+        """Drop failed and truncated rows left by an earlier run, remembering finished indices"""
+        if not os.path.exists(self.path):
+            return
+        tmp_path = self.path + ".tmp"
+        with open(self.path, encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    # A partial last line from a crash mid-write
+                    continue
+                if is_transport_failure(row) or row["transcript_index"] in self.done:
+                    continue
+                self.done.add(row["transcript_index"])
+                dst.write(json.dumps(row, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def mark_started(self) -> None:
+        if self.started_at is None:
+            self.started_at = time.monotonic()
+
+    def append(self, row: Dict) -> None:
+        self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if not is_transport_failure(row):
+            self.done.add(row["transcript_index"])
+        self.finished_at = time.monotonic()
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+    def close(self) -> None:
+        self._file.close()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Columnar results store
+
+Each (method, model) run is one Arrow IPC file under <store>/runs/, with one
+row per transcript and compact columns (intent, error, token usage,
+latency, ...). Transcripts are stored once in <store>/transcripts.arrow,
+keyed by a content hash, and runs refer to them by transcript_id. Loading
+memory-maps the files, so comparing dozens of runs does not parse megabytes
+of repeated JSON.
+
+Requires pyarrow (pip install 'log-classifier[results]').
+
+Usage:
+    python results_store.py import runs/20250101_120000/*.jsonl test_*.json
+    python results_store.py list
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from result_stream import iter_result_log
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+
+
+DEFAULT_STORE_PATH = "results_store"
+# Rows per record batch when writing; bounds memory for large runs
+BATCH_ROWS = 10_000
+
+
+def _require_pyarrow() -> None:
+    if pa is None:
+        raise ImportError("The results store requires pyarrow: pip install 'log-classifier[results]'")
+
+
+def transcript_id(transcript: str) -> str:
+    return hashlib.sha256(transcript.encode("utf-8")).hexdigest()[:16]
+
+
+def _run_schema():
+    return pa.schema([
+        ("transcript_index", pa.int32()),
+        ("transcript_id", pa.string()),
+        ("intent", pa.string()),
+        ("error", pa.string()),
+        ("transport_error", pa.string()),
+        ("api_calls", pa.int16()),
+        ("response_cache_hits", pa.int16()),
+        ("prompt_tokens", pa.int32()),
+        ("completion_tokens", pa.int32()),
+        ("cached_tokens", pa.int32()),
+        ("queue_wait", pa.float32()),
+        ("ttfb", pa.float32()),
+        ("latency", pa.float32()),
+        ("time_to_intent", pa.float32()),
+        ("retries", pa.int16()),
+        ("sample_intents", pa.list_(pa.string())),
+        ("classified_at", pa.string()),
+    ])
+
+
+def _flatten(row: Dict) -> Dict:
+    """One results row (as written by ResultLog) to column values"""
+    result = row["classification_result"]
+    calls = result.get("individual_results") or [result]
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    # Only streamed calls have one
+    times_to_intent = [c["time_to_intent"] for c in calls if c.get("time_to_intent") is not None]
+    for call in calls:
+        for key in usage:
+            usage[key] += call.get("usage", {}).get(key, 0)
+    return {
+        "transcript_index": row["transcript_index"],
+        "transcript_id": transcript_id(row["transcript"]),
+        "intent": result.get("intent"),
+        "error": result.get("error"),
+        "transport_error": result.get("transport_error"),
+        "api_calls": sum(1 for c in calls if "usage" in c and not c.get("response_cache_hit")),
+        "response_cache_hits": sum(1 for c in calls if c.get("response_cache_hit")),
+        **usage,
+        "queue_wait": sum(c.get("queue_wait", 0.0) for c in calls),
+        "ttfb": sum(c.get("ttfb", 0.0) for c in calls),
+        "latency": sum(c.get("latency", 0.0) for c in calls),
+        "time_to_intent": sum(times_to_intent) if times_to_intent else None,
+        "retries": sum(c.get("retries", 0) for c in calls),
+        "sample_intents": [c.get("intent") for c in calls] if "individual_results" in result else None,
+        "classified_at": row.get("classified_at"),
+    }
+
+
+class ResultsStore:
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        _require_pyarrow()
+        self.path = path
+        self.runs_dir = os.path.join(path, "runs")
+        self.transcripts_path = os.path.join(path, "transcripts.arrow")
+        os.makedirs(self.runs_dir, exist_ok=True)
+
+    def run_path(self, run_id: str) -> str:
+        return os.path.join(self.runs_dir, f"{run_id}.arrow")
+
+    def write_run(self, run_id: str, method: str, model: str, rows: Iterable[Dict],
+                  metadata: Optional[Dict[str, str]] = None) -> str:
+        """Write one run's rows (an iterable, consumed once) and register its transcripts"""
+        schema = _run_schema().with_metadata({
+            "run_id": run_id,
+            "method": method,
+            "model": model,
+            "created_at": datetime.now().isoformat(),
+            **(metadata or {}),
+        })
+        known = self._transcript_ids()
+        new_transcripts: Dict[str, str] = {}
+        path = self.run_path(run_id)
+        tmp_path = path + ".tmp"
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+            batch: List[Dict] = []
+            for row in rows:
+                flat = _flatten(row)
+                if flat["transcript_id"] not in known:
+                    new_transcripts[flat["transcript_id"]] = row["transcript"]
+                batch.append(flat)
+                if len(batch) >= BATCH_ROWS:
+                    writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+                    batch = []
+            if batch:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+        self._add_transcripts(new_transcripts)
+        os.replace(tmp_path, path)
+        return path
+
+    def _transcript_ids(self) -> set:
+        if not os.path.exists(self.transcripts_path):
+            return set()
+        return set(self.transcripts().column("transcript_id").to_pylist())
+
+    def _add_transcripts(self, new_transcripts: Dict[str, str]) -> None:
+        if not new_transcripts:
+            return
+        added = pa.table({
+            "transcript_id": list(new_transcripts.keys()),
+            "transcript": list(new_transcripts.values()),
+        })
+        table = added
+        if os.path.exists(self.transcripts_path):
+            table = pa.concat_tables([self.transcripts(), added])
+        tmp_path = self.transcripts_path + ".tmp"
+        with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        os.replace(tmp_path, self.transcripts_path)
+
+    def transcripts(self) -> "pa.Table":
+        """transcript_id -> transcript table, memory-mapped"""
+        return load_arrow(self.transcripts_path)
+
+    def run_ids(self) -> List[str]:
+        return sorted(os.path.basename(p)[:-len(".arrow")] for p in glob.glob(os.path.join(self.runs_dir, "*.arrow")))
+
+    def load_run(self, run_id: str) -> "pa.Table":
+        return load_arrow(self.run_path(run_id))
+
+    def load_runs(self, run_ids: Optional[List[str]] = None) -> Dict[str, "pa.Table"]:
+        return {run_id: self.load_run(run_id) for run_id in (run_ids or self.run_ids())}
+
+    def run_metadata(self, run_id: str) -> Dict[str, str]:
+        """Schema metadata (method, model, ...) without reading any rows"""
+        reader = pa.ipc.open_file(pa.memory_map(self.run_path(run_id), "r"))
+        return {k.decode(): v.decode() for k, v in (reader.schema.metadata or {}).items()}
+
+
+def load_arrow(path: str) -> "pa.Table":
+    """Zero-copy load of an Arrow IPC file; the table's buffers live in the memory map"""
+    _require_pyarrow()
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+def iter_results_file(path: str) -> Tuple[Dict, Iterator[Dict]]:
+    """Header fields and rows of a results file: a JSONL result log or a legacy test_*.json"""
+    if path.endswith(".jsonl"):
+        # JSONL logs carry method/model in their run directory's summary.json
+        header: Dict = {}
+        summary_path = os.path.join(os.path.dirname(path), "summary.json")
+        if os.path.exists(summary_path):
+            with open(summary_path) as f:
+                cells = json.load(f)["cells"]
+            stem = os.path.splitext(os.path.basename(path))[0]
+            header = next((c for c in cells.values()
+                           if f"test_{c['method']}_{c['model'].replace('-', '_')}" == stem), {})
+        return header, iter_result_log(path)
+    with open(path) as f:
+        data = json.load(f)
+    header = {k: v for k, v in data.items() if k != "results"}
+    return header, iter(data["results"])
+
+
+def run_id_for(path: str) -> str:
+    """Stable id from the file name, so re-importing a file replaces its run"""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return f"{parent}__{stem}" if path.endswith(".jsonl") else stem
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar results store")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="Store directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import JSONL result logs or legacy test_*.json files")
+    import_parser.add_argument("files", nargs="+")
+    import_parser.add_argument("--method", help="Method, for files that do not record it")
+    import_parser.add_argument("--model", default="unknown", help="Model, for files that do not record it")
+    subparsers.add_parser("list", help="List stored runs")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if args.command == "import":
+        for path in args.files:
+            header, rows = iter_results_file(path)
+            method = header.get("method") or args.method or "unknown"
+            model = header.get("model") or args.model
+            run_id = run_id_for(path)
+            store.write_run(run_id, method, model, rows, metadata={"source": path})
+            print(f"Imported {path} as {run_id}")
+    else:
+        for run_id in store.run_ids():
+            meta = store.run_metadata(run_id)
+            print(f"{run_id:<70} {meta.get('method', ''):<20} {meta.get('model', '')}")
+    return 0
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,238 @@
+"""
+Rate-limit aware request scheduler
+
+Bounds in-flight API calls with an AIMD (additive increase, multiplicative
+decrease) concurrency limit, pauses when the provider's rate-limit headers
+say the window is exhausted, and retries transient failures with jittered
+exponential backoff. Failures that survive every retry, and requests the API
+refuses outright, surface as TransportError so callers can tell them apart
+from real model answers.
+"""
+
+import asyncio
+import random
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+import openai
+
+from instrumentation import first_byte_timer, processing_seconds
+
+
+class StreamInterruptedError(Exception):
+    """A streamed response that failed after its headers arrived: a dropped
+    connection or an error event in place of the next chunk"""
+
+
+# Transient errors worth retrying; other API errors (bad request, auth, ...) fail on the first attempt
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+    StreamInterruptedError,
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class TransportError(Exception):
+    """A request that could not be completed after all retries"""
+
+    def __init__(self, message: str, error_class: str, attempts: int, retry_errors: Optional[List[str]] = None,
+                 retryable: bool = True):
+        super().__init__(message)
+        self.error_class = error_class
+        self.attempts = attempts
+        # Error class of every failed attempt, the last one included
+        self.retry_errors = retry_errors or [error_class]
+        # False when the API refused the request itself; sending it again gets the same answer
+        self.retryable = retryable
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse rate-limit reset values such as '20ms', '1s' or '6m0s' into seconds"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def parse_rate_limit_headers(headers: Mapping[str, str]) -> Dict[str, Optional[float]]:
+    """Extract the x-ratelimit-* headers OpenAI sends with every response"""
+    def number(name: str) -> Optional[float]:
+        try:
+            return float(headers[name])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    return {
+        "remaining_requests": number("x-ratelimit-remaining-requests"),
+        "remaining_tokens": number("x-ratelimit-remaining-tokens"),
+        "reset_requests": parse_reset_duration(headers.get("x-ratelimit-reset-requests")),
+        "reset_tokens": parse_reset_duration(headers.get("x-ratelimit-reset-tokens")),
+    }
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Server-suggested wait from a failed response, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        return parse_reset_duration(headers["retry-after-ms"] + "ms")
+    return parse_reset_duration(headers.get("retry-after"))
+
+
+class AdaptiveScheduler:
+    """AIMD concurrency limiter with header-driven pauses and retry/backoff"""
+
+    def __init__(self, max_concurrency: int = 10, min_concurrency: int = 1, max_retries: int = 5,
+                 base_delay: float = 1.0, max_delay: float = 60.0, min_remaining_tokens: int = 2000):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        # Pause when fewer tokens than this remain in the provider's window
+        self.min_remaining_tokens = min_remaining_tokens
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        # When the limit was last halved; 429s of requests sent before then are part of the same congestion
+        self.decreased_at = float("-inf")
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "transport_failures": 0}
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        # Created lazily so it binds to the running event loop; a new loop
+        # (another asyncio.run) starts with a fresh condition and no slots taken
+        loop = asyncio.get_event_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+            self.in_flight = 0
+        return self._condition
+
+    @property
+    def concurrency(self) -> int:
+        return max(self.min_concurrency, int(self.limit))
+
+    async def acquire(self) -> float:
+        """Wait for a free slot; returns the time spent waiting"""
+        start = time.monotonic()
+        async with self.condition:
+            while True:
+                delay = self.paused_until - time.monotonic()
+                if delay > 0:
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if self.in_flight < self.concurrency:
+                    self.in_flight += 1
+                    return time.monotonic() - start
+                await self.condition.wait()
+
+    async def release(self) -> None:
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def on_success(self, headers: Mapping[str, str]) -> None:
+        # Additive increase: roughly +1 slot per window of successful calls
+        self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+        limits = parse_rate_limit_headers(headers)
+        if limits["remaining_requests"] is not None and limits["remaining_requests"] < 1:
+            self.pause(limits["reset_requests"] or self.base_delay)
+        if limits["remaining_tokens"] is not None and limits["remaining_tokens"] < self.min_remaining_tokens:
+            self.pause(limits["reset_tokens"] or self.base_delay)
+
+    def on_throttle(self, retry_after: Optional[float], sent_at: Optional[float] = None) -> None:
+        # Multiplicative decrease, once per congestion window: a burst of 429s
+        # from requests already in flight at the last decrease halves the
+        # limit once, not once per request. Hold everyone back until the
+        # window resets either way.
+        self.stats["throttled"] += 1
+        if sent_at is None or sent_at >= self.decreased_at:
+            self.limit = max(float(self.min_concurrency), self.limit / 2)
+            self.decreased_at = time.monotonic()
+        if retry_after is not None:
+            self.pause(retry_after)
+
+    def backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with equal jitter"""
+        ceiling = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+    async def call(self, request: Callable[[], Awaitable[Any]]) -> Tuple[Any, Dict[str, float]]:
+        """Run request() under the limit, retrying transient failures.
+
+        request must return a raw response (with `.headers`). Returns it along
+        with {"queue_wait", "ttfb", "latency", "processing", "retries",
+        "retry_errors"} for the successful attempt: ttfb is the time to the
+        response headers (when the HTTP client reports it, see
+        instrumentation.record_first_byte) and processing the server-reported
+        time, if any. Raises TransportError once retries are exhausted, or
+        straight away, with retryable False, for an API error that retrying
+        cannot fix (auth, bad request, unknown model).
+        """
+        attempt = 0
+        queue_wait = 0.0
+        retry_errors: List[str] = []
+        while True:
+            queue_wait += await self.acquire()
+            sent_at = time.monotonic()
+            start = time.perf_counter()
+            try:
+                self.stats["requests"] += 1
+                with first_byte_timer() as marks:
+                    raw = await request()
+            except RETRYABLE_ERRORS as e:
+                await self.release()
+                retry_errors.append(type(e).__name__)
+                retry_after = retry_after_seconds(e)
+                if isinstance(e, openai.RateLimitError):
+                    self.on_throttle(retry_after, sent_at)
+                if attempt >= self.max_retries:
+                    self.stats["transport_failures"] += 1
+                    raise TransportError(str(e), type(e).__name__, attempt + 1, retry_errors) from e
+                delay = max(retry_after or 0.0, self.backoff_delay(attempt))
+                attempt += 1
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+                continue
+            except openai.APIStatusError as e:
+                await self.release()
+                retry_errors.append(type(e).__name__)
+                self.stats["transport_failures"] += 1
+                raise TransportError(str(e), type(e).__name__, attempt + 1, retry_errors, retryable=False) from e
+            except BaseException:
+                await self.release()
+                raise
+            end = time.perf_counter()
+            self.on_success(raw.headers)
+            await self.release()
+            return raw, {
+                "queue_wait": queue_wait,
+                "ttfb": marks.get("first_byte", end) - start,
+                "latency": end - start,
+                "processing": processing_seconds(raw.headers),
+                "retries": attempt,
+                "retry_errors": retry_errors,
+            }
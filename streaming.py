@@ -0,0 +1,170 @@
+"""
+Streamed completions with early-terminating intent parsing
+
+With --stream, each single-call classification is requested as a stream,
+and the reply's JSON is scanned as its tokens arrive. Once a top-level
+"intent" string has been emitted in full and is one of the known intents,
+the stream is read on only while nothing but the closing brace and the
+usage chunk follow. As soon as more content arrives (e.g. the "reasoning"
+the chain-of-thought prompt asks for), the stream is closed, which cancels
+the rest of the generation.
+
+Each call records time_to_intent: seconds from sending the request to the
+moment its intent was known. For streams that ran to the end without an
+intent, this is the time to the end of the stream. A cancelled stream
+never receives its usage chunk, so its usage is estimated: prompt tokens
+from the messages, completion tokens as one per content chunk received.
+"""
+
+import json
+import time
+from typing import Any, Awaitable, Dict, Iterable, List, Optional
+
+import httpx
+import openai
+
+from packing import estimate_tokens
+from scheduler import StreamInterruptedError
+
+
+# What may follow the intent without being worth waiting for: the end of the
+# JSON object and of a code fence around it
+CLOSING_CHARS = " \t\r\n}`"
+
+
+class IntentScanner:
+    """Incremental scanner for the "intent" string of a top-level JSON object.
+
+    Tracks just enough JSON structure (nesting depth, strings and escapes,
+    and whether the next top-level string is a key) to tell the intent
+    value apart from the same words inside other fields.
+    """
+
+    def __init__(self, intents: Iterable[str]):
+        self.intents = set(intents)
+        self.intent: Optional[str] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._buffer: List[str] = []
+        self._expect_key = False
+        self._key: Optional[str] = None
+        # The part of the text fed last that came after the intent
+        self.rest = ""
+
+    def feed(self, text: str) -> Optional[str]:
+        """Scan the next piece of the reply; returns the intent once it is complete"""
+        if self.intent is not None:
+            return self.intent
+        for i, char in enumerate(text):
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._string_done("".join(self._buffer))
+                    if self.intent is not None:
+                        self.rest = text[i + 1:]
+                        break
+                    continue
+                self._buffer.append(char)
+            elif char == '"':
+                self._in_string = True
+                self._buffer = []
+            elif char in "{[":
+                self._depth += 1
+                self._expect_key = self._depth == 1 and char == "{"
+            elif char in "}]":
+                self._depth -= 1
+            elif self._depth == 1 and char in ",:":
+                self._expect_key = char == ","
+        return self.intent
+
+    def _string_done(self, raw: str) -> None:
+        if self._depth != 1:
+            return
+        if self._expect_key:
+            self._key = raw
+        elif self._key == "intent":
+            try:
+                value = json.loads(f'"{raw}"')
+            except ValueError:
+                return
+            if value in self.intents:
+                self.intent = value
+
+
+class StreamedReply:
+    """A streamed completion as read by read_until_intent.
+
+    `headers` are the response headers, for the scheduler's rate-limit
+    tracking. `content` is the full reply, or {"intent": ...} alone when
+    the stream was cut short. `final` is the chunk that carried usage, if
+    it arrived.
+    """
+
+    def __init__(self, headers, content: Optional[str], time_to_intent: float, cancelled: bool,
+                 chunks: int, final: Any = None):
+        self.headers = headers
+        self.content = content
+        self.time_to_intent = time_to_intent
+        self.cancelled = cancelled
+        self.chunks = chunks
+        self.final = final
+
+
+async def read_until_intent(response: Awaitable, intents: Iterable[str]) -> StreamedReply:
+    """Read a raw streamed chat completion until content beyond its intent arrives, then close it.
+
+    `response` is the pending with_raw_response.create(..., stream=True)
+    call. The clock starts when this coroutine does, so it can run inside
+    the scheduler's slot like any other request. A reply that ends right
+    after its intent is read to the end, usage chunk included, and is not
+    counted as cancelled. A stream that breaks off with a transport error
+    or an error event raises StreamInterruptedError, which the scheduler
+    retries like a failed request.
+    """
+    started = time.perf_counter()
+    raw = await response
+    stream = raw.parse()
+    scanner = IntentScanner(intents)
+    parts: List[str] = []
+    final = None
+    chunks = 0
+    intent_at: Optional[float] = None
+    cancelled = False
+    try:
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                final = chunk
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            chunks += 1
+            text = chunk.choices[0].delta.content
+            parts.append(text)
+            if intent_at is None:
+                if scanner.feed(text) is None:
+                    continue
+                intent_at = time.perf_counter() - started
+                text = scanner.rest
+            if text.strip(CLOSING_CHARS):
+                cancelled = True
+                break
+    except (httpx.TransportError, openai.APIError) as e:
+        raise StreamInterruptedError(f"{type(e).__name__}: {e}") from e
+    finally:
+        # Closing the connection is what stops the generation
+        await stream.close()
+    if cancelled:
+        return StreamedReply(raw.headers, json.dumps({"intent": scanner.intent}), intent_at, True, chunks)
+    elapsed = time.perf_counter() - started
+    return StreamedReply(raw.headers, "".join(parts) or None, elapsed if intent_at is None else intent_at,
+                         False, chunks, final)
+
+
+def estimate_usage(messages: List[Dict[str, str]], chunks: int) -> Dict[str, int]:
+    """Usage of a stream cancelled before its usage chunk"""
+    prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": chunks, "cached_tokens": 0}
@@ -0,0 +1,408 @@
+"""
+Sweep orchestration: the (method, model) matrix as a DAG of shard jobs
+
+A sweep is split into jobs of (method, model, shard), a shard being a fixed
+range of CSV rows (--shard-size). Jobs run concurrently. At most
+--provider-jobs of them run per API provider at once, while the shared
+scheduler keeps the request-level limit. Ensemble jobs wait for the
+few_shot job of the same model and shard, since they reuse its answers
+through the response cache as their first vote. Cascade jobs do not wait
+for their stage models: they measure each stage's cost and latency, which
+a cache hit can only replay.
+
+run_dir/manifest.json records every finished shard with the fingerprint of
+what produced it: prompts, model, sampling and method settings, and the
+shard's transcripts. A re-run executes only shards that are missing,
+partial (rows that ended as transport failures) or whose fingerprint no
+longer matches. The comparison table covers every cell in the manifest,
+including ones the current run did not select.
+
+Every result row also carries the fingerprint of its own transcript and
+cell settings. Within an invalidated shard, rows whose fingerprint still
+matches are kept and only the rest are classified again. A row whose
+transcript moved to another index (rows inserted into the CSV) is carried
+to its new index. With --since, rows of an earlier run directory are
+carried forward the same way, so editing one prompt or adding rows costs
+only the calls whose inputs changed.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from cascade import CASCADE_MODEL
+from result_stream import ResultLog, is_transport_failure, iter_csv_records, iter_csv_rows, iter_result_log
+
+
+DEFAULT_SHARD_SIZE = 100
+DEFAULT_PROVIDER_JOBS = 8
+MANIFEST_NAME = "manifest.json"
+
+# Model name prefixes per API provider; a provider's jobs share its job limit
+PROVIDER_PREFIXES = {
+    "openai": ("gpt-", "o1", "o3", "o4", "text-embedding-"),
+}
+
+Cell = Tuple[str, str]
+
+
+class Job(NamedTuple):
+    method: str
+    model: str
+    shard: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.method}|{self.model}|{self.shard}"
+
+    @property
+    def cell(self) -> Cell:
+        return self.method, self.model
+
+
+def provider_for(model: str) -> str:
+    for provider, prefixes in PROVIDER_PREFIXES.items():
+        if model.startswith(prefixes):
+            return provider
+    return "other"
+
+
+def log_path(run_dir: str, method: str, model: str) -> str:
+    return os.path.join(run_dir, f"test_{method}_{model.replace('-', '_')}.jsonl")
+
+
+def parse_shards(specs: Iterable[str]) -> Set[int]:
+    """Shard numbers from specs such as "3" or "0-4" (inclusive)"""
+    shards: Set[int] = set()
+    for spec in specs:
+        first, _, last = spec.partition("-")
+        shards.update(range(int(first), int(last or first) + 1))
+    return shards
+
+
+def transcript_hash(transcript: str) -> str:
+    return hashlib.sha256(transcript.encode("utf-8")).hexdigest()
+
+
+def settings_digest(settings: Dict) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def fingerprint(digest: str, content_hash: str) -> str:
+    """Fingerprint of a cell's settings digest and a shard's or a transcript's content hash"""
+    return hashlib.sha256(f"{digest}\0{content_hash}".encode("utf-8")).hexdigest()
+
+
+def scan_shards(csv_file: str, shard_size: int) -> Tuple[Dict[int, str], Dict[int, str], Dict[int, Dict]]:
+    """One pass over the CSV: ground truth, per-row transcript hashes, and per shard its row count, a
+    hash of its rows and the byte offset of its first row"""
+    ground_truth: Dict[int, str] = {}
+    transcript_hashes: Dict[int, str] = {}
+    hashes: Dict[int, "hashlib._Hash"] = {}
+    offsets: Dict[int, int] = {}
+    shards: Dict[int, Dict] = {}
+    for offset, transcript_index, row in iter_csv_records(csv_file):
+        shard = (transcript_index - 1) // shard_size
+        offsets.setdefault(shard, offset)
+        transcript = row.get("transcript", "")
+        if not transcript:
+            continue
+        ground_truth[transcript_index] = row.get("human_generated_intent", "")
+        transcript_hashes[transcript_index] = transcript_hash(transcript)
+        if shard not in shards:
+            shards[shard] = {"rows": 0, "offset": offsets[shard]}
+            hashes[shard] = hashlib.sha256()
+        shards[shard]["rows"] += 1
+        hashes[shard].update(f"{transcript_index}\0{transcript_hashes[transcript_index]}\0".encode("utf-8"))
+    for shard, digest in hashes.items():
+        shards[shard]["content_hash"] = digest.hexdigest()
+    return ground_truth, transcript_hashes, shards
+
+
+def shard_rows(csv_file: str, shard: int, shard_size: int, offset: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """The shard's (transcript_index, transcript) rows, read lazily from its first row's byte offset"""
+    first, last = shard * shard_size + 1, (shard + 1) * shard_size
+    rows = iter_csv_rows(csv_file) if offset is None else iter_csv_rows(csv_file, offset, first)
+    for transcript_index, transcript, _ in rows:
+        if transcript_index > last:
+            return
+        if transcript_index >= first:
+            yield transcript_index, transcript
+
+
+def collect_carry(rows: Iterable[Dict], source: str, wanted: Set[str], carry: Dict[str, Dict]) -> None:
+    """Add answered rows whose fingerprint is wanted to carry (fingerprint -> row), first one wins"""
+    for row in rows:
+        row_fingerprint = row.get("fingerprint")
+        if row_fingerprint in wanted and row_fingerprint not in carry and not is_transport_failure(row):
+            carry[row_fingerprint] = dict(row, carried_from=row.get("carried_from", source))
+
+
+class Manifest:
+    """Completed and partial shard jobs of a run directory, saved after every change"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data: Dict = {"shard_size": None, "jobs": {}}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.data = json.load(f)
+
+    @property
+    def shard_size(self) -> Optional[int]:
+        return self.data.get("shard_size")
+
+    def entry(self, job: Job) -> Optional[Dict]:
+        return self.data["jobs"].get(job.key)
+
+    def record(self, job: Job, **fields) -> None:
+        self.data["jobs"][job.key] = {"method": job.method, "model": job.model, "shard": job.shard, **fields}
+        self.save()
+
+    def save(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def cells(self) -> List[Cell]:
+        """Every (method, model) with at least one recorded shard, in first-recorded order"""
+        return list(dict.fromkeys((entry["method"], entry["model"]) for entry in self.data["jobs"].values()))
+
+    def table(self) -> Dict[Cell, Dict]:
+        """Per-cell totals over the recorded shards"""
+        totals: Dict[Cell, Dict] = {}
+        for entry in self.data["jobs"].values():
+            cell = (entry["method"], entry["model"])
+            total = totals.setdefault(cell, {"shards": 0, "complete_shards": 0, "rows": 0, "answered": 0,
+                                             "correct": 0, "transport_failures": 0, "duration": 0.0})
+            total["shards"] += 1
+            total["complete_shards"] += entry["status"] == "complete"
+            for key in ("rows", "answered", "correct", "transport_failures", "duration"):
+                total[key] += entry[key]
+        for total in totals.values():
+            total["accuracy"] = total["correct"] / total["answered"] * 100 if total["answered"] else 0.0
+        return totals
+
+
+class _JobLog:
+    """A cell's ResultLog as one shard job sees it: appends are fingerprinted and scored into the shard's answers"""
+
+    def __init__(self, log: ResultLog, answers: Dict[int, bool], ground_truth: Dict[int, str], stamp):
+        self.log = log
+        self.answers = answers
+        self.ground_truth = ground_truth
+        self.stamp = stamp
+
+    @property
+    def done(self) -> Set[int]:
+        return self.log.done
+
+    def mark_started(self) -> None:
+        self.log.mark_started()
+
+    def append(self, row: Dict) -> None:
+        self.log.append(self.stamp(row))
+        if not is_transport_failure(row):
+            index = row["transcript_index"]
+            self.answers[index] = row["classification_result"]["intent"] == self.ground_truth.get(index)
+
+
+class SweepOrchestrator:
+    """Plans, runs and records the shard jobs of one run directory"""
+
+    def __init__(self, tester, run_dir: str, csv_file: str, shard_size: Optional[int] = None,
+                 provider_jobs: int = DEFAULT_PROVIDER_JOBS):
+        self.tester = tester
+        self.run_dir = run_dir
+        self.csv_file = csv_file
+        self.manifest = Manifest(os.path.join(run_dir, MANIFEST_NAME))
+        if shard_size is not None and self.manifest.shard_size not in (None, shard_size):
+            raise ValueError(f"{run_dir} is sharded by {self.manifest.shard_size} rows, not {shard_size}")
+        self.shard_size = shard_size or self.manifest.shard_size or DEFAULT_SHARD_SIZE
+        self.manifest.data["shard_size"] = self.shard_size
+        self.provider_jobs = provider_jobs
+        self.ground_truth, self.transcript_hashes, self.shards = scan_shards(csv_file, self.shard_size)
+        self.logs: Dict[Cell, ResultLog] = {}
+        self.digests: Dict[Cell, str] = {}
+        self.fingerprints: Dict[Job, str] = {}
+        # (cell, shard) -> {transcript_index: answered correctly}
+        self.answers: Dict[Tuple[Cell, int], Dict[int, bool]] = {}
+
+    def shard_of(self, transcript_index: int) -> int:
+        return (transcript_index - 1) // self.shard_size
+
+    def stamp(self, cell: Cell, row: Dict) -> Dict:
+        """Set a result row's fingerprint, from its transcript and the cell's settings"""
+        row["fingerprint"] = fingerprint(self.digests[cell], transcript_hash(row["transcript"]))
+        return row
+
+    def plan(self, cells: List[Cell], shards: Optional[Set[int]] = None,
+             since: Optional[str] = None) -> Tuple[List[Job], Dict[str, int]]:
+        """Jobs still to run for the selected cells and shards, plus counts by status.
+
+        Opens the cells' logs. Rows whose fingerprint no longer matches their
+        index are dropped first; rows from the logs (and from the run
+        directory `since`) that match an unanswered index of a pending shard
+        are carried to it, counted under "carried".
+        """
+        selected = sorted(self.shards if shards is None else shards & set(self.shards))
+        pending: List[Job] = []
+        counts = {"done": 0, "invalidated": 0, "partial": 0, "new": 0, "carried": 0}
+        for cell in cells:
+            digest = self.digests[cell] = settings_digest(self.tester.cell_settings(*cell))
+            stale: Set[int] = set()
+            pending_shards: Set[int] = set()
+            for shard in selected:
+                job = Job(cell[0], cell[1], shard)
+                self.fingerprints[job] = fingerprint(digest, self.shards[shard]["content_hash"])
+                entry = self.manifest.entry(job)
+                if entry is None:
+                    counts["new"] += 1
+                elif entry["fingerprint"] != self.fingerprints[job]:
+                    counts["invalidated"] += 1
+                    stale.add(shard)
+                elif entry["status"] == "complete":
+                    counts["done"] += 1
+                    continue
+                else:
+                    counts["partial"] += 1
+                pending.append(job)
+                pending_shards.add(shard)
+            expected = {index: fingerprint(digest, content) for index, content in self.transcript_hashes.items()}
+            path = log_path(self.run_dir, *cell)
+            carry = self._reconcile_log(path, expected, stale)
+            if since is not None and os.path.abspath(since) != os.path.abspath(self.run_dir):
+                previous = log_path(since, *cell)
+                collect_carry(iter_result_log(previous), previous, set(expected.values()), carry)
+            log = self.logs[cell] = ResultLog(path)
+            for index, row_fingerprint in expected.items():
+                if self.shard_of(index) in pending_shards and index not in log.done and row_fingerprint in carry:
+                    log.append(dict(carry[row_fingerprint], transcript_index=index))
+                    counts["carried"] += 1
+        self._score_logs(cells)
+        return pending, counts
+
+    def _reconcile_log(self, path: str, expected: Dict[int, str], stale: Set[int]) -> Dict[str, Dict]:
+        """Drop rows that no longer match their index from a cell log; returns the dropped ones still
+        wanted elsewhere, by fingerprint"""
+        carry: Dict[str, Dict] = {}
+        if not os.path.exists(path):
+            return carry
+        wanted = set(expected.values())
+        tmp_path = path + ".tmp"
+        with open(path, encoding="utf-8") as src, open(tmp_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                index = row["transcript_index"]
+                if "fingerprint" in row:
+                    keep = expected.get(index) == row["fingerprint"]
+                else:
+                    # Written before rows were fingerprinted: valid as long as its shard is
+                    keep = index in expected and self.shard_of(index) not in stale
+                if keep:
+                    dst.write(line)
+                else:
+                    collect_carry([row], path, wanted, carry)
+        os.replace(tmp_path, path)
+        return carry
+
+    def _score_logs(self, cells: Iterable[Cell]) -> None:
+        for cell in cells:
+            for shard in self.shards:
+                self.answers[(cell, shard)] = {}
+            for row in iter_result_log(self.logs[cell].path):
+                if is_transport_failure(row):
+                    continue
+                index = row["transcript_index"]
+                answers = self.answers.get((cell, self.shard_of(index)))
+                if answers is not None:
+                    answers[index] = row["classification_result"]["intent"] == self.ground_truth.get(index)
+
+    def dependencies(self, jobs: List[Job]) -> Dict[Job, List[Job]]:
+        """Edges to jobs whose responses the job reuses through the response cache"""
+        pending = set(jobs)
+        edges: Dict[Job, List[Job]] = {}
+        for job in jobs:
+            if job.method == "ensemble" and job.model != CASCADE_MODEL:
+                upstream = [Job("few_shot", job.model, job.shard)]
+            else:
+                upstream = []
+            edges[job] = [dep for dep in upstream if dep in pending]
+        return edges
+
+    def provider(self, model: str) -> str:
+        return provider_for(self.tester.cascade_models[0] if model == CASCADE_MODEL else model)
+
+    def record(self, job: Job, duration: float) -> None:
+        answers = self.answers[(job.cell, job.shard)]
+        rows = self.shards[job.shard]["rows"]
+        previous = self.manifest.entry(job)
+        if previous is not None and previous["fingerprint"] == self.fingerprints[job]:
+            # A partial shard resumed: its earlier time counts too
+            duration += previous["duration"]
+        self.manifest.record(
+            job,
+            fingerprint=self.fingerprints[job],
+            status="complete" if len(answers) == rows else "partial",
+            rows=rows,
+            answered=len(answers),
+            correct=sum(answers.values()),
+            transport_failures=rows - len(answers),
+            duration=duration,
+            log=self.logs[job.cell].path,
+            finished_at=datetime.now().isoformat(),
+        )
+
+    def record_all(self, jobs: List[Job], durations: Dict[Cell, float]) -> None:
+        """Rescore the logs and record every job after they were filled outside run() (e.g. --batch).
+
+        A cell's duration is split evenly over its jobs.
+        """
+        self._score_logs({job.cell for job in jobs})
+        shares = Counter(job.cell for job in jobs)
+        for job in jobs:
+            self.record(job, durations.get(job.cell, 0.0) / shares[job.cell])
+
+    async def run(self, jobs: List[Job], max_in_flight: Optional[int] = None) -> None:
+        """Run jobs concurrently in dependency order, recording each one in the manifest as it finishes.
+
+        max_in_flight bounds each job's own pipeline (see stream_sweep).
+        """
+        edges = self.dependencies(jobs)
+        finished = {job: asyncio.Event() for job in jobs}
+        limits: Dict[str, asyncio.Semaphore] = {}
+
+        async def run_job(job: Job) -> None:
+            try:
+                for dep in edges[job]:
+                    await finished[dep].wait()
+                provider = self.provider(job.model)
+                limit = limits.setdefault(provider, asyncio.Semaphore(self.provider_jobs))
+                async with limit:
+                    start = time.monotonic()
+                    log = _JobLog(self.logs[job.cell], self.answers[(job.cell, job.shard)], self.ground_truth,
+                                  lambda row: self.stamp(job.cell, row))
+                    rows = shard_rows(self.csv_file, job.shard, self.shard_size, self.shards[job.shard]["offset"])
+                    await self.tester.stream_sweep([job.cell], rows, {job.cell: log}, max_in_flight=max_in_flight)
+                    self.record(job, time.monotonic() - start)
+            finally:
+                # Dependents only lose cache reuse if this job failed, so they still go ahead
+                finished[job].set()
+
+        await asyncio.gather(*(run_job(job) for job in jobs))
+
+    def close(self) -> None:
+        for log in self.logs.values():
+            log.close()
@@ -10,272 +10,464 @@ Tests:
 5. Ensemble voting
 """
 
+import asyncio
 import json
 import os
 import argparse
-import csv
 import uuid
 from datetime import datetime
-from collections import Counter
-from typing import Dict, List
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import openai
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from classification import (REQUEST_PARAMS, empty_usage, extract_usage, is_settled, leading_counts,
+                            parse_classification, vote)
+from few_shot_index import DEFAULT_EMBEDDING_CACHE, EmbeddingCache, FewShotIndex, FewShotSelector, make_embedder
+from prompts import (INTENTS, PACKED_SYSTEM_PROMPTS, PACKED_TRANSCRIPT_TEMPLATE, SYSTEM_PROMPTS,
+                     TRANSCRIPT_TEMPLATES, assemble_messages, assemble_packed_messages)
+from response_cache import DEFAULT_CACHE_PATH, ResponseCache, make_cache_key
+from result_stream import ResultLog, is_transport_failure, iter_csv_rows, iter_result_log
+import cascade
+import evaluation
+import instrumentation
+import packing
+import prefilter
+import results_store
+import streaming
+import sweep
+from scheduler import AdaptiveScheduler, TransportError
 
-class ImprovementTester:
-    def __init__(self, api_key: str):
-        self.client = openai.OpenAI(api_key=api_key)
-        self.models = ["gpt-4.1-2025-04-14", "gpt-5-mini-2025-08-07", "gpt-5-2025-08-07"]
-    
-    # 1. BASELINE - Original simple prompt
-    def baseline_classify(self, transcript: str, model: str) -> Dict:
-        """Original simple prompt from classify_logs.py"""
-        system_prompt = f"""
-You are an responsible for classifying incoming call transcripts into relevant intent types so that the humans that are assigned to follow up know what is the best course of action.
-You will be given a call transcript.
-Focus exclusively on the user's reply, i.e. sentences that starts with 'User: '.
-Read the transcripts carefully and classify the call transcript into the following categories:
-- 'voice_interested': The User EXPLICITLY indicated he/she is interested in the course or the university.
-- 'voice_not_interested': The user EXPLICITLY say that he/she is not interested in the course or the university.
-- 'voice_immediate_hangup': The user hangs up without expressing their full intent. This includes cutting off halfway through when the caller is talking, or no substantial discussion after exchanging greetings.
-- 'voice_wrong_number': The user who answered the phone indicated that we are calling the wrong number.
-- 'voice_no_action': The student has already signed up to the course or is in contact with the advisor. Only use this if the student does not need any additional help.
-- 'voice_wants_call_back': The user EXPLICITLY request that he/she wants a call back.
-- 'voice_wants_email_follow_up': The user wished to follow up through email.
-- 'voice_wants_whatsapp_sms_follow_up': The user wished to follow up through instant messaging, such as via Whatsapp or SMS.
-- 'voice_voice_mail': The call goes into an automated reply or a voice mail. Reply does not come from an actual user.
-- 'voice_unknown': Anything that does not fit into the above categories.
 
-<!-- Cache buster: {uuid.uuid4()} -->
-"""
-        
-        user_prompt = f"""
-Transcript:
---- BEGIN TRANSCRIPT ---
-{transcript}
---- END TRANSCRIPT ---
+METHODS = ["baseline", "different_prompt", "few_shot", "chain_of_thought", "ensemble"]
 
-Remember to focus on the User's replies to derive their intent, and not the Agent's!
-Reply in the following JSON format {{'intent': <category>}}
-"""
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
-            )
-            content = response.choices[0].message.content
-            if content is None:
-                return {"intent": "voice_unknown", "method": "baseline", "error": "Empty response"}
-            result = json.loads(content)
-            return {"intent": result.get("intent", "voice_unknown"), "method": "baseline"}
-        except Exception as e:
-            return {"intent": "voice_unknown", "method": "baseline", "error": str(e)}
-    
-    # 2. DIFFERENT PROMPT - More conversational
-    def different_prompt_classify(self, transcript: str, model: str) -> Dict:
-        """More conversational prompt style"""
-        system_prompt = f"""
-You're helping analyze phone calls between education advisors and prospective students.
+# Per-call fields kept with every classification result
+CALL_STATS = ("usage", "queue_wait", "ttfb", "latency", "time_to_intent", "stream_cancelled", "processing",
+              "retries", "retry_errors", "response_cache_hit", "cached_usage", "cached_latency")
 
-Your job: Figure out what the person who answered (the "User") actually wants.
+# What the adaptive ensemble does when its votes disagree
+ESCALATIONS = ["none", "samples", "model"]
 
-- 'voice_interested': The User EXPLICITLY indicated he/she is interested in the course or the university.
-- 'voice_not_interested': The user EXPLICITLY say that he/she is not interested in the course or the university.
-- 'voice_immediate_hangup': The user hangs up without expressing their full intent. This includes cutting off halfway through when the caller is talking, or no substantial discussion after exchanging greetings.
-- 'voice_wrong_number': The user who answered the phone indicated that we are calling the wrong number.
-- 'voice_no_action': The student has already signed up to the course or is in contact with the advisor. Only use this if the student does not need any additional help.
-- 'voice_wants_call_back': The user EXPLICITLY request that he/she wants a call back.
-- 'voice_wants_email_follow_up': The user wished to follow up through email.
-- 'voice_wants_whatsapp_sms_follow_up': The user wished to follow up through instant messaging, such as via Whatsapp or SMS.
-- 'voice_voice_mail': The call goes into an automated reply or a voice mail. Reply does not come from an actual user.
-- 'voice_unknown': Anything that does not fit into the above categories.
 
-<!-- Cache buster: {uuid.uuid4()} -->
-"""
-        
-        user_prompt = f"""Phone conversation:
+class ImprovementTester:
+    def __init__(self, api_key: str, max_concurrency: int = 10, cache: Optional[ResponseCache] = None,
+                 refresh_cache: bool = False, cache_buster: bool = False, max_retries: int = 5,
+                 requeue_rounds: int = 2, base_url: Optional[str] = None, ensemble_votes: int = 3,
+                 adaptive_ensemble: bool = False, escalation: str = "none", max_votes: Optional[int] = None,
+                 cascade_models: Optional[List[str]] = None, cascade_threshold: float = cascade.DEFAULT_THRESHOLD,
+                 cascade_votes: int = 3, local_prefilter: Optional[prefilter.Prefilter] = None,
+                 few_shot_index: Optional[FewShotIndex] = None, few_shot_k: int = 3,
+                 embedding_cache: Optional[EmbeddingCache] = None, pack_tokens: Optional[int] = None,
+                 pack_max_items: int = packing.DEFAULT_PACK_ITEMS, stream: bool = False):
+        # Retries are owned by the scheduler, not the SDK. base_url points the
+        # client at a local stand-in server (see mock_openai_server.py). The
+        # response hook timestamps the first byte of every call.
+        self.client = openai.AsyncOpenAI(
+            api_key=api_key, base_url=base_url, max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(event_hooks={"response": [instrumentation.record_first_byte]}),
+        )
+        # Per-call timings, tokens and errors, exported Prometheus-style
+        self.metrics = instrumentation.Metrics()
+        # Ordered weakest to strongest; the adaptive ensemble escalates up this list
+        self.models = ["gpt-4.1-2025-04-14", "gpt-5-mini-2025-08-07", "gpt-5-2025-08-07"]
+        # One adaptive budget for every in-flight API call in the run, shared
+        # by all methods, models and ensemble instances.
+        self.scheduler = AdaptiveScheduler(max_concurrency=max_concurrency, max_retries=max_retries)
+        # Passes over items whose requests failed even after retries
+        self.requeue_rounds = requeue_rounds
+        # Response cache; refresh_cache skips lookups but still stores new responses
+        self.cache = cache
+        self.refresh_cache = refresh_cache
+        # Appending a random UUID defeats every cache layer, so it is opt-in
+        self.cache_buster = cache_buster
+        # Ensemble votes per transcript. The adaptive ensemble stops drawing as
+        # soon as the majority is settled and, when its votes disagree,
+        # escalates to more samples (up to max_votes) or to the next model up.
+        self.ensemble_votes = ensemble_votes
+        self.adaptive_ensemble = adaptive_ensemble
+        self.escalation = escalation
+        self.max_votes = max_votes if max_votes is not None else 2 * ensemble_votes - 1
+        # Cascade: models tried in order until an answer's confidence reaches
+        # the threshold; models without logprobs get confidence from votes
+        self.cascade_models = cascade_models or cascade.cheapest_first(self.models)
+        self.cascade_threshold = cascade_threshold
+        self.cascade_votes = cascade_votes
+        # Answers voicemail/hang-up transcripts locally, without an API call
+        self.prefilter = local_prefilter
+        # With an index, few-shot prompts carry the k most similar labelled
+        # examples instead of the fixed two; query embeddings share the
+        # client and scheduler with the classification calls
+        self.few_shot_selector = None
+        if few_shot_index is not None:
+            embedder = make_embedder(few_shot_index.embedder, self.client, self.scheduler)
+            self.few_shot_selector = FewShotSelector(few_shot_index, embedder, embedding_cache, k=few_shot_k)
+        # Packed mode: single-call classifications going to the same
+        # (method, model, sample) share requests of up to pack_tokens
+        # transcript tokens and pack_max_items transcripts
+        self.pack_tokens = pack_tokens
+        self.pack_max_items = pack_max_items
+        self._pack_queues: Dict[Tuple[str, str, int], packing.PackQueue] = {}
+        # Stream replies and stop each one as soon as its intent is parsed
+        # (see streaming.py); calls asking for logprobs are never streamed
+        self.stream = stream
+
+    def _cache_buster_comment(self) -> str:
+        return f"<!-- Cache buster: {uuid.uuid4()} -->" if self.cache_buster else ""
 
-{transcript}
+    async def _chat(self, model: str, method: str, messages: List[Dict[str, str]], sample: int = 0,
+                    logprobs: bool = False) -> Dict:
+        """Issue one chat completion through the shared scheduler.
 
-What does the User want? Respond in JSON: {{"intent": "<category>"}}"""
+        Returns {"content", "logprobs", "usage", "queue_wait", "ttfb", "latency",
+        "time_to_intent", "stream_cancelled", "processing", "retries",
+        "retry_errors", "response_cache_hit", "cached_usage", "cached_latency"},
+        served from the response cache when possible, and records the call in
+        self.metrics. A cache hit spends nothing, so its usage is empty;
+        cached_usage and cached_latency are what the call took when it was
+        made (None for live calls and for entries cached without them).
+        `sample` distinguishes repeated draws of the same prompt (ensemble
+        instances) so they are cached independently. With `logprobs`, token
+        logprobs come back as [token, logprob] pairs. Streamed calls report
+        time_to_intent, and their content is just the intent when the stream
+        was cut short. Raises TransportError if the request never succeeded.
+        """
+        if self.stream and not logprobs:
+            return await self._chat_streamed(model, method, messages, sample)
+        params = dict(REQUEST_PARAMS, logprobs=True) if logprobs else REQUEST_PARAMS
+        key = make_cache_key(model, method, messages, dict(params, sample=sample))
+        if self.cache is not None and not self.refresh_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.metrics.observe_call(model, method, outcome="cache_hit")
+                return {"content": cached["content"], "logprobs": cached.get("logprobs"), "usage": empty_usage(),
+                        "queue_wait": 0.0, "ttfb": 0.0, "latency": 0.0, "time_to_intent": None,
+                        "stream_cancelled": None, "processing": None, "retries": 0, "retry_errors": [],
+                        "response_cache_hit": True, "cached_usage": cached.get("usage"),
+                        "cached_latency": cached.get("latency")}
         
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"},
+            raw, timing = await self.scheduler.call(
+                lambda: self.client.chat.completions.with_raw_response.create(  # type: ignore[call-overload]
+                    model=model,
+                    messages=messages,
+                    **params,
+                )
             )
-            content = response.choices[0].message.content
-            if content is None:
-                return {"intent": "voice_unknown", "method": "different_prompt", "error": "Empty response"}
-            result = json.loads(content)
-            return {"intent": result.get("intent", "voice_unknown"), "method": "different_prompt"}
-        except Exception as e:
-            return {"intent": "voice_unknown", "method": "different_prompt", "error": str(e)}
+        except TransportError as e:
+            self.metrics.observe_call(model, method, outcome="transport_error", retry_errors=e.retry_errors)
+            raise
+        response = raw.parse()
+        choice = response.choices[0]
+        content = choice.message.content
+        token_logprobs = None
+        if logprobs and choice.logprobs is not None and choice.logprobs.content:
+            token_logprobs = [[t.token, t.logprob] for t in choice.logprobs.content]
+        usage = extract_usage(response)
+        if self.cache is not None and content is not None:
+            self.cache.put(key, model, method, {"content": content, "logprobs": token_logprobs, "usage": usage,
+                                                "latency": timing["latency"]})
+        self.metrics.observe_call(model, method, timing, usage, retry_errors=timing["retry_errors"])
+        return {"content": content, "logprobs": token_logprobs, "usage": usage, **timing, "time_to_intent": None,
+                "stream_cancelled": None, "response_cache_hit": False, "cached_usage": None, "cached_latency": None}
     
-    # 3. FEW-SHOT LEARNING
-    def few_shot_classify(self, transcript: str, model: str) -> Dict:
-        """Original prompt + few-shot examples"""
-        system_prompt = """
-You are responsible for classifying incoming call transcripts into relevant intent types.
-Focus exclusively on the user's reply (sentences starting with 'User:').
+    async def _chat_streamed(self, model: str, method: str, messages: List[Dict[str, str]], sample: int) -> Dict:
+        """_chat for a streamed request, read only until its intent is known.
 
-Categories:
-- 'voice_interested': The User EXPLICITLY indicated he/she is interested in the course or the university.
-- 'voice_not_interested': The user EXPLICITLY say that he/she is not interested in the course or the university.
-- 'voice_immediate_hangup': The user hangs up without expressing their full intent. This includes cutting off halfway through when the caller is talking, or no substantial discussion after exchanging greetings.
-- 'voice_wrong_number': The user who answered the phone indicated that we are calling the wrong number.
-- 'voice_no_action': The student has already signed up to the course or is in contact with the advisor. Only use this if the student does not need any additional help.
-- 'voice_wants_call_back': The user EXPLICITLY request that he/she wants a call back.
-- 'voice_wants_email_follow_up': The user wished to follow up through email.
-- 'voice_wants_whatsapp_sms_follow_up': The user wished to follow up through instant messaging, such as via Whatsapp or SMS.
-- 'voice_voice_mail': The call goes into an automated reply or a voice mail. Reply does not come from an actual user.
-- 'voice_unknown': Anything that does not fit into the above categories.
-"""
-        
-        messages: List[Dict[str, str]] = [{"role": "system", "content": system_prompt}]
+        Cached apart from unstreamed replies, since a cut-short reply keeps
+        only the intent.
+        """
+        key = make_cache_key(model, method, messages, dict(REQUEST_PARAMS, sample=sample, stream=True))
+        if self.cache is not None and not self.refresh_cache:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.metrics.observe_call(model, method, outcome="cache_hit")
+                return {"content": cached["content"], "logprobs": None, "usage": empty_usage(), "queue_wait": 0.0,
+                        "ttfb": 0.0, "latency": 0.0, "time_to_intent": None, "stream_cancelled": None,
+                        "processing": None, "retries": 0, "retry_errors": [], "response_cache_hit": True,
+                        "cached_usage": cached.get("usage"), "cached_latency": cached.get("latency")}
         
-        # Add 2 correctly classified examples from the original dataset
-        user_prompt = f"""Here are 2 examples of correct classifications:
-
-Example 1:
-Transcript: User: Hello?
-Agent: Hi 
-User: Hello? 
-Agent: Wai Kit, this is James from Kaplan. Do you have a minute to chat?
-User: No. Sorry. Can you call back another day?
-Agent: No problem at all! When would be a good day 
-User: Thank you. 
-Agent: for me to call 
-User: Bye bye.
-User: Thank you. Bye bye.
-
-Correct classification: {{"intent": "voice_wants_call_back"}}
-
-Example 2:
-Transcript: User: Hello?
-Agent: Hi Siti! This is James from Kaplan. Do 
-User: Say 
-Agent: you have a quick minute to chat?
-User: again?
-Agent: Hi Siti, this is James from Kaplan Singapore. Do you have a moment to chat?
-User: Yes.
-Agent: Great! I wanted to check if you are still interested in pursuing the Bachelor of Marketing degree at Global University?
-User: It's Because I still need to check on my ABL that security, may I know when is the next Next, we'll go date to enter.
-Agent: Global University has three intakes each year—in January, May, and September. Would you like me to set up a call with your advisor to discuss this further? They can guide you on the next steps.
-User: Okay. But if were to join, most probably, I will be joining during September.
-Agent: That sounds like a good plan! September gives you plenty of time to prepare. Would you like me to schedule a call with your advisor to discuss your application and any other details?
-Agent: Just checking in—would you like me to arrange a call with your advisor to help you with the September intake and any other questions you might have?
-User: Yes, please.
-
-Correct classification: {{"intent": "voice_interested"}}
-
-Now classify this transcript:
-Transcript: {transcript}
-
-Reply in JSON: {{"intent": "<category>"}}
+        try:
+            reply, timing = await self.scheduler.call(
+                lambda: streaming.read_until_intent(
+                    self.client.chat.completions.with_raw_response.create(  # type: ignore[call-overload]
+                        model=model,
+                        messages=messages,
+                        stream=True,
+                        stream_options={"include_usage": True},
+                        **REQUEST_PARAMS,
+                    ),
+                    INTENTS,
+                )
+            )
+        except TransportError as e:
+            self.metrics.observe_call(model, method, outcome="transport_error", retry_errors=e.retry_errors)
+            raise
+        if reply.final is not None:
+            usage = extract_usage(reply.final)
+        else:
+            usage = streaming.estimate_usage(messages, reply.chunks)
+        if self.cache is not None and reply.content is not None:
+            self.cache.put(key, model, method, {"content": reply.content, "logprobs": None, "usage": usage,
+                                                "latency": timing["latency"]})
+        timing["time_to_intent"] = reply.time_to_intent
+        self.metrics.observe_call(model, method, timing, usage, retry_errors=timing["retry_errors"])
+        return {"content": reply.content, "logprobs": None, "usage": usage, **timing,
+                "stream_cancelled": reply.cancelled, "response_cache_hit": False, "cached_usage": None,
+                "cached_latency": None}
+    
+    async def _classify(self, method: str, transcript: str, model: str, sample: int = 0,
+                        logprobs: bool = False) -> Dict:
+        """Classify one transcript with a single-call method, packed with others when packing is on"""
+        if self.pack_tokens is None or logprobs:
+            return await self._classify_unpacked(method, transcript, model, sample=sample, logprobs=logprobs)
+        key = (method, model, sample)
+        if key not in self._pack_queues:
+            self._pack_queues[key] = packing.PackQueue(
+                lambda items: self._send_pack(method, model, sample, items),
+                token_budget=self.pack_tokens, max_items=self.pack_max_items,
+            )
+        return await self._pack_queues[key].add(transcript)
+    
+    async def _send_pack(self, method: str, model: str, sample: int, items: List[packing.PackItem],
+                         depth: int = 0) -> None:
+        """Classify a pack in one call and resolve each item's future.
 
-<!-- Cache buster: {uuid.uuid4()} -->"""
+        Items the reply leaves out or answers malformed go out again, split
+        in two, up to PACK_RETRY_DEPTH times and then one request each.
+        """
+        ids = [packing.item_id(i) for i in range(len(items))]
+        messages = assemble_packed_messages(method, [(item_id, item.transcript) for item_id, item in zip(ids, items)],
+                                            suffix=self._cache_buster_comment())
+        try:
+            reply = await self._chat(model, f"packed_{method}", messages, sample=sample)
+        except TransportError as e:
+            # Each item becomes a transport failure, which stream_sweep re-queues
+            for item in items:
+                item.future.set_exception(e)
+            return
+        except Exception as e:
+            for item in items:
+                item.future.set_result({"intent": "voice_unknown", "method": f"packed_{method}", "error": str(e)})
+            return
+        answers = packing.parse_pack_reply(reply["content"], ids)
+        stats = {key: reply[key] for key in CALL_STATS}
+        cached_shares = (packing.split_usage(reply["cached_usage"], len(items)) if reply["cached_usage"]
+                         else [None] * len(items))
+        missing = []
+        for item_id, item, share, cached_share in zip(ids, items, packing.split_usage(reply["usage"], len(items)),
+                                                      cached_shares):
+            item.usage = packing.add_usage(item.usage, share)
+            item.call_share += 1 / len(items)
+            item.attempts += 1
+            if item_id in answers:
+                item.future.set_result({
+                    "intent": answers[item_id], "method": f"packed_{method}", **stats, "usage": item.usage,
+                    "cached_usage": cached_share, "call_share": item.call_share, "pack_size": len(items),
+                    "pack_attempts": item.attempts,
+                })
+            else:
+                missing.append(item)
+        if len(missing) > 1 and depth < packing.PACK_RETRY_DEPTH:
+            half = (len(missing) + 1) // 2
+            await asyncio.gather(self._send_pack(method, model, sample, missing[:half], depth + 1),
+                                 self._send_pack(method, model, sample, missing[half:], depth + 1))
+        elif missing:
+            await asyncio.gather(*(self._send_alone(method, model, sample, item) for item in missing))
+    
+    async def _send_alone(self, method: str, model: str, sample: int, item: packing.PackItem) -> None:
+        """Last resort for an item packs kept missing: its own single-transcript request"""
+        try:
+            result = await self._classify_unpacked(method, item.transcript, model, sample=sample)
+        except TransportError as e:
+            item.future.set_exception(e)
+            return
+        if "usage" in result:
+            # The packs that missed it still cost tokens
+            result["usage"] = packing.add_usage(result["usage"], item.usage)
+            result["call_share"] = 1 + item.call_share
+        result["pack_attempts"] = item.attempts + 1
+        item.future.set_result(result)
+    
+    async def _classify_unpacked(self, method: str, transcript: str, model: str, sample: int = 0,
+                                 logprobs: bool = False) -> Dict:
+        """Classify one transcript with a single-call method, in a request of its own.
 
-        messages.append({
-            "role": "user",
-            "content": user_prompt
-        })
-        
+        With `logprobs` the result also carries "confidence", the probability
+        of the intent value's tokens (None if the reply has none). few_shot
+        uses retrieved examples when a few-shot index is configured, and the
+        result lists their transcript indices under "examples".
+        """
         try:
-            response_format: Dict[str, str] = {"type": "json_object"}
-            response = self.client.chat.completions.create(  # type: ignore[call-overload]
-                model=model,
-                messages=messages,
-                response_format=response_format,
-            )
-            content = response.choices[0].message.content
-            if content is None:
-                return {"intent": "voice_unknown", "method": "few_shot", "error": "Empty response"}
-            result = json.loads(content)
-            return {"intent": result.get("intent", "voice_unknown"), "method": "few_shot"}
+            examples = []
+            if method == "few_shot" and self.few_shot_selector is not None:
+                examples = await self.few_shot_selector.select(transcript)
+                method = "dynamic_few_shot"
+            messages = assemble_messages(method, transcript, suffix=self._cache_buster_comment(),
+                                         examples=[(e["transcript"], e["intent"]) for e in examples])
+            reply = await self._chat(model, method, messages, sample=sample, logprobs=logprobs)
+            stats = {key: reply[key] for key in CALL_STATS}
+            if logprobs:
+                stats["confidence"] = cascade.intent_confidence(reply["content"], reply["logprobs"])
+            if examples:
+                stats["examples"] = [e["transcript_index"] for e in examples]
+            return parse_classification(method, reply["content"], stats)
+        except TransportError:
+            # Not a model answer; let stream_sweep re-queue the item
+            raise
         except Exception as e:
-            return {"intent": "voice_unknown", "method": "few_shot", "error": str(e)}
+            return {"intent": "voice_unknown", "method": method, "error": str(e)}
+    
+    # 1. BASELINE - Original simple prompt
+    async def baseline_classify(self, transcript: str, model: str) -> Dict:
+        """Original simple prompt from classify_logs.py"""
+        return await self._classify("baseline", transcript, model)
+    
+    # 2. DIFFERENT PROMPT - More conversational
+    async def different_prompt_classify(self, transcript: str, model: str) -> Dict:
+        """More conversational prompt style"""
+        return await self._classify("different_prompt", transcript, model)
+    
+    # 3. FEW-SHOT LEARNING
+    async def few_shot_classify(self, transcript: str, model: str, sample: int = 0) -> Dict:
+        """Original prompt + few-shot examples"""
+        return await self._classify("few_shot", transcript, model, sample=sample)
     
     # 4. CHAIN-OF-THOUGHT
-    def chain_of_thought_classify(self, transcript: str, model: str) -> Dict:
+    async def chain_of_thought_classify(self, transcript: str, model: str) -> Dict:
         """Original prompt + ask model to think step by step"""
-        system_prompt = """
-You are responsible for classifying call transcripts. Focus only on User statements.
-
-Categories: voice_interested, voice_not_interested, voice_immediate_hangup, voice_wrong_number, 
-voice_no_action, voice_wants_call_back, voice_wants_email_follow_up, 
-voice_wants_whatsapp_sms_follow_up, voice_voice_mail, voice_unknown
-"""
+        return await self._classify("chain_of_thought", transcript, model)
+    
+    # 5. ENSEMBLE (N instances of few-shot voting)
+    async def ensemble_classify(self, transcript: str, model: str) -> Dict:
+        """Run N instances of few-shot method and vote"""
+        if self.adaptive_ensemble:
+            return await self.adaptive_ensemble_classify(transcript, model)
+        return vote(await self._draw_votes(transcript, model, 0, self.ensemble_votes))
+    
+    async def _draw_votes(self, transcript: str, model: str, start: int, count: int,
+                          method: str = "few_shot") -> List[Dict]:
+        """Votes of `method` for samples start..start+count-1, each taking its own slot from the shared budget"""
+        outcomes = await asyncio.gather(
+            *(self._classify(method, transcript, model, sample=i) for i in range(start, start + count)),
+            return_exceptions=True
+        )
         
-        user_prompt = f"""Transcript: {transcript}
-
-Think step by step:
-1. What did the User actually say?
-2. What is their clear intent?
-3. Which category fits best?
+        results = []
+        for outcome in outcomes:
+            if isinstance(outcome, TransportError):
+                raise outcome
+            if isinstance(outcome, BaseException):
+                results.append({"intent": "voice_unknown", "error": str(outcome)})
+            else:
+                results.append(outcome)
+        return results
+    
+    async def _collect_votes(self, transcript: str, model: str, results: List[Dict], budget: int) -> List[Dict]:
+        """Draw votes until the majority is settled or the budget is spent.
 
-Respond in JSON: {{"intent": "<category>", "reasoning": "<brief explanation>"}}"""
-        
-        try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                response_format={"type": "json_object"}
-            )
-            content = response.choices[0].message.content
-            if content is None:
-                return {"intent": "voice_unknown", "method": "chain_of_thought", "error": "Empty response"}
-            result = json.loads(content)
-            return {"intent": result.get("intent", "voice_unknown"), "method": "chain_of_thought"}
-        except Exception as e:
-            return {"intent": "voice_unknown", "method": "chain_of_thought", "error": str(e)}
-    
-    # 5. ENSEMBLE (3 instances of few-shot voting)  
-    def ensemble_classify(self, transcript: str, model: str) -> Dict:
-        """Run 3 instances of few-shot method and vote"""
-        # Get results from 3 instances of the same few-shot method
-        with ThreadPoolExecutor(max_workers=3) as executor:
-            futures = [
-                executor.submit(self.few_shot_classify, transcript, model),
-                executor.submit(self.few_shot_classify, transcript, model),
-                executor.submit(self.few_shot_classify, transcript, model)
-            ]
-            
-            results = []
-            for i, future in enumerate(futures):
-                try:
-                    result = future.result()
-                    result["instance"] = f"few_shot_{i+1}"
-                    results.append(result)
-                except Exception as e:
-                    results.append({"intent": "voice_unknown", "instance": f"few_shot_{i+1}", "error": str(e)})
+        Each round asks for the fewest extra votes that could settle it if they
+        all went to the current leader, so agreeing votes stop the draw early.
+        """
+        results = list(results)
+        while len(results) < budget and not is_settled(results, budget):
+            leader, runner_up = leading_counts(results)
+            remaining = budget - len(results)
+            needed = min(remaining, (runner_up + remaining - leader) // 2 + 1)
+            results += await self._draw_votes(transcript, model, len(results), needed)
+        return results
+    
+    def _stronger_model(self, model: str) -> Optional[str]:
+        position = self.models.index(model) if model in self.models else len(self.models)
+        return self.models[position + 1] if position + 1 < len(self.models) else None
+    
+    # 6. ADAPTIVE ENSEMBLE (early-exit voting, escalating on disagreement)
+    async def adaptive_ensemble_classify(self, transcript: str, model: str) -> Dict:
+        """Few-shot votes until the majority of N is settled; escalate when they disagree"""
+        results = await self._collect_votes(transcript, model, [], self.ensemble_votes)
+        first_round = len(results)
+        escalated = None
+        escalation_result = None
+        if len({r["intent"] for r in results}) > 1:
+            if self.escalation == "samples" and self.max_votes > len(results):
+                escalated = "samples"
+                results = await self._collect_votes(transcript, model, results, self.max_votes)
+            elif self.escalation == "model" and self._stronger_model(model) is not None:
+                escalated = self._stronger_model(model)
+                escalation_result = await self.few_shot_classify(transcript, escalated)
         
-        # Vote on result
-        intents = [r["intent"] for r in results]
-        intent_counts = Counter(intents)
-        most_common = intent_counts.most_common(1)[0][0]
+        result = vote(results)
+        if escalation_result is not None:
+            # The stronger model settles the disagreement
+            escalation_result["instance"] = f"escalation_{escalated}"
+            result["individual_results"].append(escalation_result)
+            result["intent"] = escalation_result["intent"]
+            for key, value in escalation_result.get("usage", {}).items():
+                result["usage"][key] += value
+        # Kept apart so early exits and escalations cannot cancel each other out
+        result.update({
+            "method": "adaptive_ensemble_few_shot",
+            "vote_budget": self.ensemble_votes,
+            "escalated": escalated,
+            "calls_saved": self.ensemble_votes - first_round,
+            "escalation_calls": len(result["individual_results"]) - first_round,
+        })
+        return result
+    
+    # 7. CASCADE (cheapest model first, escalating low-confidence answers)
+    async def _cascade_stage(self, method: str, transcript: str, model: str) -> Tuple[Dict, float, str]:
+        """One model's answer with its confidence and where the confidence came from"""
+        if method == "ensemble":
+            result = await self.ensemble_classify(transcript, model)
+            return result, cascade.vote_confidence([r["intent"] for r in result["individual_results"]]), "votes"
+        if cascade.supports_logprobs(model):
+            result = await self._classify(method, transcript, model, logprobs=True)
+            return result, result.get("confidence") or 0.0, "logprobs"
+        results = await self._draw_votes(transcript, model, 0, self.cascade_votes, method=method)
+        result = vote(results)
+        return result, cascade.vote_confidence([r["intent"] for r in results]), "votes"
+    
+    async def cascade_classify(self, method: str, transcript: str) -> Dict:
+        """Try cascade_models in order, stopping at the first answer confident enough"""
+        stages = []
+        calls = []
+        for model in self.cascade_models:
+            result, confidence, source = await self._cascade_stage(method, transcript, model)
+            if "error" in result:
+                # A reply we could not parse is no evidence at all
+                confidence = 0.0
+            stage_calls = result.get("individual_results") or [result]
+            for i, call in enumerate(stage_calls):
+                call["instance"] = f"{model}_{i + 1}"
+            calls += stage_calls
+            stages.append({
+                "model": model,
+                "intent": result["intent"],
+                "confidence": confidence,
+                "confidence_source": source,
+                "latency": cascade.stage_latency(stage_calls),
+                "cost": cascade.stage_cost(model, stage_calls),
+            })
+            if confidence >= self.cascade_threshold:
+                break
         
+        usage = empty_usage()
+        for call in calls:
+            for key, value in call.get("usage", {}).items():
+                usage[key] += value
+        final = stages[-1]
         return {
-            "intent": most_common,
-            "method": "ensemble_few_shot",
-            "votes": dict(intent_counts),
-            "individual_results": results
+            "intent": final["intent"],
+            "method": f"cascade_{method}",
+            "stopped_at": final["model"],
+            "confidence": final["confidence"],
+            "threshold": self.cascade_threshold,
+            "stages": stages,
+            "usage": usage,
+            "individual_results": calls
         }
     
-    def run_method(self, method_name: str, transcripts: List[str], model: str) -> List[Dict]:
-        """Run a specific method on all transcripts"""
+    def _classifier(self, method_name: str, model: Optional[str] = None):
+        if model == cascade.CASCADE_MODEL:
+            # Cascade cells run the method's prompt through the model cascade
+            return lambda transcript, _: self.cascade_classify(method_name, transcript)
         method_map = {
             "baseline": self.baseline_classify,
             "different_prompt": self.different_prompt_classify,
@@ -283,169 +475,514 @@ Respond in JSON: {{"intent": "<category>", "reasoning": "<brief explanation>"}}"
             "chain_of_thought": self.chain_of_thought_classify,
             "ensemble": self.ensemble_classify
         }
+        return method_map[method_name]
+    
+    def cell_settings(self, method: str, model: str) -> Dict:
+        """Everything besides the transcripts that decides a (method, model) cell's answers.
+
+        Used to fingerprint shards of the sweep manifest: a change to any of
+        these invalidates the cell's recorded results.
+        """
+        # Ensembles vote with the few-shot prompt
+        prompt = "few_shot" if method == "ensemble" else method
+        if prompt == "few_shot" and self.few_shot_selector is not None:
+            prompt = "dynamic_few_shot"
+        settings = {
+            "method": method,
+            "model": model,
+            "system_prompt": SYSTEM_PROMPTS[prompt],
+            "transcript_template": TRANSCRIPT_TEMPLATES[prompt],
+            "request_params": REQUEST_PARAMS,
+            "cache_buster": self.cache_buster,
+            "prefilter": self.prefilter.settings() if self.prefilter is not None else None,
+        }
+        if method == "ensemble":
+            settings["ensemble"] = {"votes": self.ensemble_votes, "adaptive": self.adaptive_ensemble,
+                                    "escalation": self.escalation, "max_votes": self.max_votes}
+            if self.adaptive_ensemble and self.escalation == "model":
+                settings["ensemble"]["models"] = self.models
+        if model == cascade.CASCADE_MODEL:
+            settings["cascade"] = {"models": self.cascade_models, "threshold": self.cascade_threshold,
+                                   "votes": self.cascade_votes}
+        if self.few_shot_selector is not None and prompt == "dynamic_few_shot":
+            settings["few_shot_index"] = {"index": self.few_shot_selector.index.digest(),
+                                          "k": self.few_shot_selector.k}
+        if self.stream:
+            settings["stream"] = True
+        if self.pack_tokens is not None and model != cascade.CASCADE_MODEL:
+            settings["packing"] = {"system_prompt": PACKED_SYSTEM_PROMPTS[prompt],
+                                   "transcript_template": PACKED_TRANSCRIPT_TEMPLATE,
+                                   "tokens": self.pack_tokens, "max_items": self.pack_max_items}
+        return settings
+    
+    async def _classify_one(self, classify_func, transcript: str, transcript_index: int, model: str) -> Dict:
+        decision = self.prefilter.decide(transcript) if self.prefilter is not None else None
+        try:
+            if decision is not None:
+                # No call stats: the row counts as neither an API call nor a cache hit
+                result = {"intent": decision["intent"], "method": "prefilter", "prefilter": decision["source"],
+                          "confidence": decision["confidence"]}
+            else:
+                result = await classify_func(transcript, model)
+        except TransportError as e:
+            # Kept apart from model answers: no intent, excluded from accuracy
+            result = {"intent": None, "transport_error": str(e), "error_class": e.error_class,
+                      "attempts": e.attempts, "retryable": e.retryable}
+        except Exception as e:
+            result = {"intent": "voice_unknown", "error": str(e)}
+        return {
+            "transcript_index": transcript_index,
+            "transcript": transcript,
+            "classification_result": result,
+            "classified_at": datetime.now().isoformat()
+        }
+    
+    async def stream_sweep(self, cells: List[Tuple[str, str]], rows: Iterable[Tuple[int, str]],
+                           logs: Dict[Tuple[str, str], ResultLog], max_in_flight: Optional[int] = None) -> None:
+        """Single-pass pipeline: classify each row for every cell and append results as they complete.
+
+        `rows` is consumed lazily and at most `max_in_flight` (cell, row) items
+        are held at once, so memory does not grow with the dataset. Indices a
+        cell's log already has are skipped; failed items are re-queued up to
+        requeue_rounds times before being written as transport failures, and
+        items the API refused (auth, bad request, ...) are written at once.
+        """
+        if max_in_flight is None:
+            # Enough queued work to keep the scheduler saturated, with full packs
+            max_in_flight = 2 * self.scheduler.max_concurrency
+            if self.pack_tokens is not None:
+                max_in_flight *= self.pack_max_items
+        classifiers = {cell: self._classifier(*cell) for cell in cells}
+        in_flight: Dict[asyncio.Future, Tuple[Tuple[str, str], int]] = {}
         
-        classify_func = method_map[method_name]
-        
-        print(f"Running {method_name} method...")
+        def submit(cell: Tuple[str, str], transcript_index: int, transcript: str, attempt: int) -> None:
+            logs[cell].mark_started()
+            task = asyncio.ensure_future(
+                self._classify_one(classifiers[cell], transcript, transcript_index, cell[1])
+            )
+            in_flight[task] = (cell, attempt)
         
-        # Use parallel processing
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            future_to_index = {
-                executor.submit(classify_func, transcript, model): i 
-                for i, transcript in enumerate(transcripts)
-            }
-            
-            completed_results = {}
-            for future in as_completed(future_to_index):
-                index = future_to_index[future]
-                try:
-                    result = future.result()
-                    completed_results[index] = {
-                        "transcript_index": index + 1,
-                        "transcript": transcripts[index],
-                        "classification_result": result,
-                        "classified_at": datetime.now().isoformat()
-                    }
-                except Exception as e:
-                    completed_results[index] = {
-                        "transcript_index": index + 1,
-                        "transcript": transcripts[index],
-                        "classification_result": {"intent": "voice_unknown", "error": str(e)},
-                        "classified_at": datetime.now().isoformat()
-                    }
+        async def drain(limit: int) -> None:
+            while len(in_flight) > limit:
+                done, _ = await asyncio.wait(list(in_flight), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    cell, attempt = in_flight.pop(task)
+                    row = task.result()
+                    if (is_transport_failure(row) and row["classification_result"]["retryable"]
+                            and attempt < self.requeue_rounds):
+                        submit(cell, row["transcript_index"], row["transcript"], attempt + 1)
+                    else:
+                        logs[cell].append(row)
         
-        return [completed_results[i] for i in range(len(transcripts))]
-
+        with self.metrics.watch_event_loop():
+            for transcript_index, transcript in rows:
+                for cell in cells:
+                    if transcript_index in logs[cell].done:
+                        continue
+                    await drain(max_in_flight - 1)
+                    submit(cell, transcript_index, transcript, 0)
+            await drain(0)
 
-def read_csv_transcripts(file_path: str) -> List[str]:
-    """Read transcripts from CSV"""
-    transcripts = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            transcript = row.get('transcript', '')
-            if transcript:
-                transcripts.append(transcript)
-    return transcripts
 
-
-def evaluate_accuracy(results: List[Dict], ground_truth: Dict[int, str]) -> float:
-    """Calculate accuracy against ground truth"""
-    correct = 0
-    total = len(results)
-    
+def summarize_usage(results: Iterable[Dict]) -> Dict:
+    """Aggregate per-call token usage and latency for one (method, model) cell, in one pass"""
+    summary = {"rows": 0, "transport_failures": 0, "api_calls": 0, "response_cache_hits": 0,
+               "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "retries": 0,
+               "calls_saved": 0, "escalations": 0, "escalation_calls": 0, "streams_cancelled": 0}
+    total_latency = 0.0
     for result in results:
-        idx = result['transcript_index']
-        predicted = result['classification_result']['intent']
-        human = ground_truth[idx]
-        
-        if predicted == human:
-            correct += 1
+        summary["rows"] += 1
+        if is_transport_failure(result):
+            summary["transport_failures"] += 1
+            continue
+        classification = result["classification_result"]
+        # Adaptive ensemble bookkeeping, relative to always drawing every vote
+        summary["calls_saved"] += classification.get("calls_saved", 0)
+        summary["escalations"] += 1 if classification.get("escalated") else 0
+        summary["escalation_calls"] += classification.get("escalation_calls", 0)
+        for call in classification.get("individual_results") or [classification]:
+            summary["retries"] += call.get("retries", 0)
+            summary["streams_cancelled"] += 1 if call.get("stream_cancelled") else 0
+            if call.get("response_cache_hit"):
+                summary["response_cache_hits"] += 1
+            elif "usage" in call:
+                # A packed call is shared by its transcripts; each carries its part
+                share = call.get("call_share", 1)
+                summary["api_calls"] += share
+                for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                    summary[key] += call["usage"][key]
+                total_latency += call["latency"] * share
     
-    return correct / total * 100 if total > 0 else 0
+    summary["api_calls"] = round(summary["api_calls"])
+    prompt_tokens = summary["prompt_tokens"]
+    summary["cached_token_ratio"] = summary["cached_tokens"] / prompt_tokens if prompt_tokens else 0.0
+    summary["mean_latency"] = total_latency / summary["api_calls"] if summary["api_calls"] else 0.0
+    return summary
+
+
+def resumed_durations(summary_file: str, durations: Dict[Tuple[str, str], float],
+                      table: Dict[Tuple[str, str], Dict]) -> Dict[Tuple[str, str], float]:
+    """Each cell's time over every run of a run directory, not just this one.
+
+    This run's time is added to the duration the previous summary recorded.
+    A cell with no previous summary entry that ran nothing this time (an
+    earlier run stopped before writing its summary) falls back to its
+    manifest total, the sum of its shard jobs' times.
+    """
+    previous: Dict = {}
+    if os.path.exists(summary_file):
+        with open(summary_file) as f:
+            previous = json.load(f).get("cells", {})
+    totals = {}
+    for cell, manifest_total in table.items():
+        earlier = previous.get(f"{cell[0]}_{cell[1]}", {}).get("duration")
+        duration = durations.get(cell, 0.0)
+        if earlier is not None:
+            totals[cell] = earlier + duration
+        else:
+            totals[cell] = duration or manifest_total["duration"]
+    return totals
 
 
 def main():
     parser = argparse.ArgumentParser(description="Test each improvement individually")
     parser.add_argument("csv_file", help="Path to CSV file")
     parser.add_argument("--api-key", help="OpenAI API key")
-    parser.add_argument("--method", choices=["baseline", "different_prompt", "few_shot", "chain_of_thought", "ensemble", "all"], 
-                        default="all", help="Which method to test")
+    parser.add_argument("--method", nargs="+", choices=METHODS + ["all"],
+                        default=["all"], help="Which method(s) to test")
+    parser.add_argument("--models", nargs="+",
+                        help="Which model(s) to test (default: the tester's models, plus the cascade with --cascade)")
+    parser.add_argument("--shards", nargs="+",
+                        help="Which shards of the CSV to run, as numbers or inclusive ranges like 0-3 (default: all)")
+    parser.add_argument("--shard-size", type=int,
+                        help=f"CSV rows per shard, fixed for a run directory (default: {sweep.DEFAULT_SHARD_SIZE})")
+    parser.add_argument("--since",
+                        help="Earlier run directory to carry results forward from: only rows whose transcript, "
+                             "prompts, model or parameters changed are classified again")
+    parser.add_argument("--provider-jobs", type=int, default=sweep.DEFAULT_PROVIDER_JOBS,
+                        help="Shard jobs running at once per API provider; requests still share --concurrency")
+    parser.add_argument("--concurrency", type=int, default=10,
+                        help="Maximum in-flight API requests across the whole run (adapts downward on 429s)")
+    parser.add_argument("--max-retries", type=int, default=5, help="Retries per request for transient failures")
+    parser.add_argument("--requeue-rounds", type=int, default=2,
+                        help="Extra passes over items that failed after all retries")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the response cache entirely")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore cached responses but store the fresh ones")
+    parser.add_argument("--cache-path", default=DEFAULT_CACHE_PATH, help="SQLite response cache file")
+    parser.add_argument("--cache-ttl-days", type=float, default=30, help="Expire cached responses after this many days")
+    parser.add_argument("--cache-max-entries", type=int, default=100_000,
+                        help="Evict least recently used responses beyond this count")
+    parser.add_argument("--base-url", help="Alternative API base URL, e.g. a local mock_openai_server.py")
+    parser.add_argument("--batch", action="store_true",
+                        help="Run the sweep through the Batch API instead of live requests")
+    parser.add_argument("--batch-dir", default="batch_run",
+                        help="Batch input/output files and resumable state")
+    parser.add_argument("--poll-interval", type=float, default=30, help="Seconds between batch status polls")
+    parser.add_argument("--run-dir",
+                        help="Directory for the per-cell JSONL results; pass an existing one to resume it "
+                             "(default: runs/<timestamp>)")
+    parser.add_argument("--results-store", default=results_store.DEFAULT_STORE_PATH,
+                        help="Columnar (Arrow) results store the finished cells are added to")
+    parser.add_argument("--max-in-flight", type=int,
+                        help="Maximum items being classified at once (default: 2x --concurrency)")
+    parser.add_argument("--cache-buster", action="store_true",
+                        help="Append a random UUID to prompts so no cache layer can dedupe them")
+    parser.add_argument("--ensemble-votes", type=int, default=3, help="Few-shot votes per ensemble classification")
+    parser.add_argument("--adaptive-ensemble", action="store_true",
+                        help="Stop drawing ensemble votes once the majority can no longer be overturned")
+    parser.add_argument("--escalation", choices=ESCALATIONS, default="none",
+                        help="With --adaptive-ensemble, what to do when votes disagree: draw more samples "
+                             "(up to --max-votes) or ask the next stronger model")
+    parser.add_argument("--max-votes", type=int,
+                        help="Vote budget when escalating to more samples (default: 2x --ensemble-votes - 1)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Also run each method as a cascade: cheapest model first, escalating low-confidence "
+                             "answers to the next model")
+    parser.add_argument("--cascade-models", nargs="+",
+                        help="Cascade order, cheapest first (default: the tester's models by price)")
+    parser.add_argument("--cascade-threshold", type=float, default=cascade.DEFAULT_THRESHOLD,
+                        help="Confidence needed to stop at a model; above 1 runs every stage, which lets the "
+                             "frontier report replay any threshold")
+    parser.add_argument("--cascade-votes", type=int, default=3,
+                        help="Votes used as confidence for models without logprobs")
+    parser.add_argument("--metrics-port", type=int,
+                        help="Serve live Prometheus metrics on http://127.0.0.1:PORT/metrics during the run")
+    parser.add_argument("--prefilter", action="store_true",
+                        help="Answer voicemail greetings and greeting-only hang-ups locally instead of calling the API")
+    parser.add_argument("--prefilter-model",
+                        help="Hashing model (see prefilter.py --train) that may also answer locally; implies "
+                             "--prefilter")
+    parser.add_argument("--few-shot-index",
+                        help="Index directory (see few_shot_index.py build) to pick few-shot examples per "
+                             "transcript from, instead of the fixed two; also used by the ensemble")
+    parser.add_argument("--few-shot-k", type=int, default=3, help="Examples retrieved per transcript")
+    parser.add_argument("--embedding-cache", default=DEFAULT_EMBEDDING_CACHE,
+                        help="SQLite cache of transcript embeddings, keyed by content hash")
+    parser.add_argument("--pack", action="store_true",
+                        help="Classify several transcripts per request, as a JSON list of {id, intent}")
+    parser.add_argument("--pack-tokens", type=int, default=packing.DEFAULT_PACK_TOKENS,
+                        help="Transcript token budget of one packed request")
+    parser.add_argument("--pack-max-items", type=int, default=packing.DEFAULT_PACK_ITEMS,
+                        help="Most transcripts in one packed request")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream replies and stop each one as soon as its intent is parsed, recording "
+                             "time-to-intent")
+    parser.add_argument("--prefilter-threshold", type=float, default=prefilter.DEFAULT_MODEL_THRESHOLD,
+                        help="Probability the prefilter model needs before it may answer")
     
     args = parser.parse_args()
+    if args.batch and args.adaptive_ensemble:
+        parser.error("--adaptive-ensemble decides each vote from the previous ones and cannot run with --batch")
+    if args.batch and args.cascade:
+        parser.error("--cascade decides each stage from the previous one and cannot run with --batch")
+    if args.batch and (args.prefilter or args.prefilter_model):
+        parser.error("--prefilter applies to live requests and cannot run with --batch")
+    if args.batch and args.few_shot_index:
+        parser.error("--few-shot-index embeds each transcript at request time and cannot run with --batch")
+    if args.stream and (args.batch or args.pack):
+        parser.error("--stream applies to single live requests and cannot run with --batch or --pack")
+    if args.pack and (args.batch or args.cascade or args.few_shot_index):
+        parser.error("--pack cannot run with --batch, --cascade (per-transcript logprobs) or --few-shot-index "
+                     "(per-transcript examples)")
     
     api_key = args.api_key or os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("Error: OpenAI API key required")
         return 1
     
-    # Load data
-    transcripts = read_csv_transcripts(args.csv_file)
+    run_dir = args.run_dir or os.path.join("runs", datetime.now().strftime("%Y%m%d_%H%M%S"))
+    
+    cache = None
+    if not args.no_cache:
+        cache = ResponseCache(args.cache_path, ttl_seconds=args.cache_ttl_days * 24 * 3600,
+                              max_entries=args.cache_max_entries)
     
-    # Load ground truth
-    ground_truth = {}
-    with open(args.csv_file, 'r') as f:
-        reader = csv.DictReader(f)
-        for i, row in enumerate(reader, 1):
-            ground_truth[i] = row['human_generated_intent']
+    local_prefilter = None
+    if args.prefilter or args.prefilter_model:
+        hashing_model = prefilter.HashingModel.load(args.prefilter_model) if args.prefilter_model else None
+        local_prefilter = prefilter.Prefilter(model=hashing_model, threshold=args.prefilter_threshold)
     
-    tester = ImprovementTester(api_key)
+    index = None
+    embedding_cache = None
+    if args.few_shot_index:
+        index = FewShotIndex.load(args.few_shot_index)
+        embedding_cache = EmbeddingCache(args.embedding_cache)
+        print(f"Few-shot examples: top {args.few_shot_k} of {len(index.examples)} from {args.few_shot_index} "
+              f"({index.embedder})")
     
-    methods_to_test = ["baseline", "different_prompt", "few_shot", "chain_of_thought", "ensemble"] if args.method == "all" else [args.method]
+    tester = ImprovementTester(api_key, max_concurrency=args.concurrency, cache=cache,
+                               refresh_cache=args.refresh, cache_buster=args.cache_buster,
+                               max_retries=args.max_retries, requeue_rounds=args.requeue_rounds,
+                               base_url=args.base_url, ensemble_votes=args.ensemble_votes,
+                               adaptive_ensemble=args.adaptive_ensemble, escalation=args.escalation,
+                               max_votes=args.max_votes, cascade_models=args.cascade_models,
+                               cascade_threshold=args.cascade_threshold, cascade_votes=args.cascade_votes,
+                               local_prefilter=local_prefilter, few_shot_index=index,
+                               few_shot_k=args.few_shot_k, embedding_cache=embedding_cache,
+                               pack_tokens=args.pack_tokens if args.pack else None,
+                               pack_max_items=args.pack_max_items, stream=args.stream)
+    
+    methods_to_test = METHODS if "all" in args.method else list(dict.fromkeys(args.method))
+    # The cascade runs as one more "model" column next to the real ones
+    report_models = args.models or tester.models + ([cascade.CASCADE_MODEL] if args.cascade else [])
+    
+    try:
+        orchestrator = sweep.SweepOrchestrator(tester, run_dir, args.csv_file, shard_size=args.shard_size,
+                                               provider_jobs=args.provider_jobs)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    ground_truth = orchestrator.ground_truth
     
     results_summary = {}
     
-    for model in tester.models:
+    print(f"\n{'='*80}")
+    print(f"TESTING {len(methods_to_test)} METHOD(S) x {len(report_models)} MODEL(S), concurrency={args.concurrency}")
+    print(f"{'='*80}")
+    
+    cells = [(method, model) for model in report_models for method in methods_to_test]
+    shards = sweep.parse_shards(args.shards) if args.shards else None
+    jobs, plan = orchestrator.plan(cells, shards, since=args.since)
+    logs = orchestrator.logs
+    print(f"Sweep plan ({run_dir}, {len(orchestrator.shards)} shard(s) of {orchestrator.shard_size} rows): "
+          f"{len(jobs)} job(s) to run - {plan['new']} new, {plan['partial']} partial, "
+          f"{plan['invalidated']} invalidated; {plan['done']} already done")
+    if plan["carried"]:
+        print(f"Carried forward {plan['carried']} unchanged result(s)"
+              + (f" from {args.since}" if args.since else ""))
+    if args.metrics_port:
+        instrumentation.start_exporter(tester.metrics, args.metrics_port)
+        print(f"Metrics: http://127.0.0.1:{args.metrics_port}/metrics")
+    
+    if args.batch:
+        from batch_runner import BatchRunner
+        runner = BatchRunner(tester, args.batch_dir, poll_interval=args.poll_interval)
+        # Each cell asks only for the rows of its own pending shards that its log does not have yet
+        pending_shards: Dict[Tuple[str, str], Set[int]] = {}
+        for job in jobs:
+            pending_shards.setdefault(job.cell, set()).add(job.shard)
+        rows_by_cell: Dict[Tuple[str, str], List[Tuple[int, str]]] = {cell: [] for cell in pending_shards}
+        for transcript_index, transcript, _ in iter_csv_rows(args.csv_file):
+            for cell, shards in pending_shards.items():
+                if orchestrator.shard_of(transcript_index) in shards and transcript_index not in logs[cell].done:
+                    rows_by_cell[cell].append((transcript_index, transcript))
+        rows_by_cell = {cell: rows for cell, rows in rows_by_cell.items() if rows}
+        results_by_cell = asyncio.run(runner.run(rows_by_cell)) if rows_by_cell else {}
+        for cell, (results, duration) in results_by_cell.items():
+            logs[cell].mark_started()
+            for row in results:
+                if row["transcript_index"] not in logs[cell].done:
+                    logs[cell].append(orchestrator.stamp(cell, row))
+        durations = {cell: duration for cell, (_, duration) in results_by_cell.items()}
+        orchestrator.record_all(jobs, durations)
+    else:
+        asyncio.run(orchestrator.run(jobs, max_in_flight=args.max_in_flight))
+        durations = {cell: log.duration for cell, log in logs.items()}
+        stats = tester.scheduler.stats
+        print(f"Scheduler: {stats['requests']} requests, {stats['retries']} retries, {stats['throttled']} throttled, "
+              f"{stats['transport_failures']} transport failures, final concurrency {tester.scheduler.concurrency}")
+    summary_file = os.path.join(run_dir, "summary.json")
+    durations = resumed_durations(summary_file, durations, orchestrator.manifest.table())
+    if cache is not None:
+        print(f"Response cache: {cache.hits} hits, {cache.misses} misses ({args.cache_path})")
+        cache.evict()
+        cache.close()
+    if embedding_cache is not None:
+        print(f"Embedding cache: {embedding_cache.hits} hits, {embedding_cache.misses} misses "
+              f"({args.embedding_cache})")
+        embedding_cache.close()
+    orchestrator.close()
+    metrics_file = os.path.join(run_dir, "metrics.prom")
+    tester.metrics.write(metrics_file)
+    loop_lag = tester.metrics.histogram("classifier_event_loop_lag_seconds").summary()
+    print(f"Event loop lag: p50 {loop_lag['p50'] * 1000:.1f}ms, p99 {loop_lag['p99'] * 1000:.1f}ms, "
+          f"max {loop_lag['max'] * 1000:.1f}ms ({metrics_file})")
+    
+    # One pass over each log into a label matrix; all metrics are computed on it at once. Cells
+    # recorded in the manifest by earlier runs are included, for the final comparison.
+    cells = list(dict.fromkeys(cells + orchestrator.manifest.cells()))
+    matrix = evaluation.load_run_matrix(
+        {cell: iter_result_log(sweep.log_path(run_dir, *cell)) for cell in cells}, ground_truth
+    )
+    report = evaluation.evaluate(matrix)
+    correct_counts = matrix.correct.sum(axis=1)
+    
+    # The prefilter is deterministic, so every cell saw the same local answers
+    prefilter_report = None
+    if tester.prefilter is not None:
+        prefilter_report = prefilter.report_from_results(iter_result_log(logs[cells[0]].path), ground_truth)
+        print()
+        print("\n".join(prefilter.format_report(prefilter_report)))
+    
+    for model in report_models:
         print(f"\n{'='*80}")
-        print(f"TESTING MODEL: {model}")
+        print(f"MODEL: {model}")
         print(f"{'='*80}")
         
         for method in methods_to_test:
             print(f"\n{'='*60}")
-            print(f"TESTING: {method.upper()} on {model}")
+            print(f"RESULT: {method.upper()} on {model}")
             print(f"{'='*60}")
             
-            start_time = datetime.now()
-            results = tester.run_method(method, transcripts, model)
-            end_time = datetime.now()
-            
-            accuracy = evaluate_accuracy(results, ground_truth)
-            duration = (end_time - start_time).total_seconds()
+            # Stream the cell's log back rather than holding its results in memory
+            output_file = logs[(method, model)].path
+            duration = durations.get((method, model), 0.0)
+            r = cells.index((method, model))
+            accuracy = float(report["accuracy"][r]) * 100
+            ci = [float(report["ci_low"][r]) * 100, float(report["ci_high"][r]) * 100]
+            usage = summarize_usage(iter_result_log(output_file))
+            calls = instrumentation.summarize_calls(iter_result_log(output_file))
+            failed = usage["transport_failures"]
+            answered = int(report["answered"][r])
+            correct = int(correct_counts[r])
             
             key = f"{method}_{model}"
             results_summary[key] = {
                 "method": method,
                 "model": model,
                 "accuracy": accuracy,
+                "accuracy_ci": ci,
+                "macro_f1": float(report["macro_f1"][r]),
                 "duration": duration,
-                "correct": int(accuracy * len(transcripts) / 100),
-                "total": len(transcripts)
+                "correct": correct,
+                "total": answered,
+                "transport_failures": failed,
+                "usage": usage,
+                "instrumentation": calls
             }
             
-            print(f"Accuracy: {accuracy:.1f}% ({int(accuracy * len(transcripts) / 100)}/{len(transcripts)})")
+            print(f"Accuracy: {accuracy:.1f}% ({correct}/{answered}), 95% CI [{ci[0]:.1f}%, {ci[1]:.1f}%], "
+                  f"macro F1 {report['macro_f1'][r]:.3f}")
+            if failed:
+                print(f"Transport failures (excluded from accuracy): {failed}")
             print(f"Duration: {duration:.1f}s")
-            
-            # Save detailed results with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            output_file = f"test_{method}_{model.replace('-', '_')}_{timestamp}.json"
-            with open(output_file, 'w') as f:
-                json.dump({
-                    "method": method,
-                    "model": model,
-                    "accuracy": accuracy,
-                    "duration": duration,
-                    "results": results,
-                    "generated_at": datetime.now().isoformat()
-                }, f, indent=2)
-            print(f"Saved: {output_file}")
-    
-    # Final comparison
-    if len(methods_to_test) > 1:
+            print(f"Tokens: {usage['prompt_tokens']} prompt ({usage['cached_token_ratio']:.0%} cached), "
+                  f"{usage['completion_tokens']} completion, mean latency {usage['mean_latency']:.2f}s")
+            for line in instrumentation.format_call_summary(calls):
+                print(f"  {line}")
+            if tester.stream:
+                print(f"Streaming: {usage['streams_cancelled']} of {usage['api_calls']} call(s) stopped once the "
+                      f"intent was parsed")
+            if method == "ensemble" and tester.adaptive_ensemble:
+                print(f"Adaptive ensemble: {usage['calls_saved']} call(s) saved vs {tester.ensemble_votes} fixed "
+                      f"votes, {usage['escalations']} escalation(s) costing {usage['escalation_calls']} extra call(s)")
+            if model == cascade.CASCADE_MODEL:
+                frontier = cascade.cascade_frontier(iter_result_log(output_file), ground_truth)
+                results_summary[key]["frontier"] = frontier
+                print(f"Cascade {' > '.join(tester.cascade_models)}, threshold {tester.cascade_threshold:g}:")
+                print(cascade.format_frontier(frontier))
+            print(f"Results: {output_file}")
+    
+    with open(summary_file, 'w') as f:
+        json.dump({
+            "csv_file": args.csv_file,
+            "cells": results_summary,
+            "event_loop_lag": loop_lag,
+            "prefilter": prefilter_report,
+            "generated_at": datetime.now().isoformat()
+        }, f, indent=2)
+    print(f"\nSaved: {summary_file}")
+    
+    # Compact columnar copy: transcripts stored once, runs memory-mappable
+    if results_store.pa is None:
+        print("Skipping columnar results store (pyarrow not installed)")
+    else:
+        store = results_store.ResultsStore(args.results_store)
+        for (method, model), log in logs.items():
+            store.write_run(results_store.run_id_for(log.path), method, model, iter_result_log(log.path),
+                            metadata={"source": log.path})
+        print(f"Stored {len(logs)} run(s) in {args.results_store}")
+    
+    # Final comparison, over every cell the manifest has recorded, this run or earlier
+    table = orchestrator.manifest.table()
+    if len(table) > 1:
         print(f"\n{'='*80}")
         print("FINAL COMPARISON")
         print(f"{'='*80}")
-        print(f"{'Method':<20} {'Model':<25} {'Accuracy':<12} {'Time':<10} {'Notes'}")
-        print("-" * 80)
+        print(f"{'Method':<20} {'Model':<25} {'Accuracy':<12} {'95% CI':<17} {'Shards':<8} {'Time':<10} {'Notes'}")
+        print("-" * 120)
         
-        # Group by method for comparison
-        method_groups = {}
-        for key, stats in results_summary.items():
-            method = stats['method']
-            if method not in method_groups:
-                method_groups[method] = []
-            method_groups[method].append(stats)
-        
-        for method in methods_to_test:
-            if method in method_groups:
-                for stats in method_groups[method]:
-                    model_short = stats['model'].replace('gpt-5-', '').replace('2025-08-07', '')
-                    baseline_key = f"baseline_{stats['model']}"
-                    if baseline_key in results_summary:
-                        baseline_acc = results_summary[baseline_key]['accuracy']
-                        notes = f"{stats['accuracy'] - baseline_acc:+.1f}pp vs baseline"
-                    else:
-                        notes = "baseline"
-                    print(f"{method:<20} {model_short:<25} {stats['accuracy']:>6.1f}%     {stats['duration']:>6.1f}s   {notes}")
+        # Differences against the same model's baseline, with a paired McNemar test on the same transcripts
+        p_values = report["mcnemar"]["p"]
+        model_order = tester.models + [cascade.CASCADE_MODEL]
+        order = sorted(table, key=lambda cell: (METHODS.index(cell[0]), model_order.index(cell[1])
+                                                if cell[1] in model_order else len(model_order), cell[1]))
+        for method, model in order:
+            stats = table[(method, model)]
+            r = cells.index((method, model))
+            low, high = float(report["ci_low"][r]) * 100, float(report["ci_high"][r]) * 100
+            shard_count = f"{stats['complete_shards']}/{len(orchestrator.shards)}"
+            if method == "baseline":
+                notes = "baseline"
+            elif ("baseline", model) in table:
+                baseline_acc = table[("baseline", model)]["accuracy"]
+                p = p_values[r, cells.index(("baseline", model))]
+                notes = f"{stats['accuracy'] - baseline_acc:+.1f}pp vs baseline (McNemar p={p:.3f})"
+            else:
+                notes = ""
+            print(f"{method:<20} {model:<25} {stats['accuracy']:>6.1f}%     [{low:>5.1f}%, {high:>5.1f}%]  "
+                  f"{shard_count:<8} {stats['duration']:>6.1f}s   {notes}")
     
     return 0
 
@@ -0,0 +1,85 @@
+"""Joining batch output files back to each cell's transcripts"""
+
+import json
+import random
+from typing import Dict, List, Optional
+
+from batch_runner import BatchRunner, make_custom_id, parse_custom_id
+from test_improvements import ImprovementTester
+
+
+MODEL = "gpt-4.1-2025-04-14"
+ROWS_BY_CELL = {
+    ("baseline", MODEL): [(3, "User: Yes, tell me more."), (7, "User: Not interested.")],
+    ("ensemble", MODEL): [(3, "User: Yes, tell me more."), (5, "User: Who is this?")],
+}
+
+
+def completion(intent: str, prompt_tokens: int = 100) -> Dict:
+    return {
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": MODEL,
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": json.dumps({"intent": intent})}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 8, "total_tokens": prompt_tokens + 8},
+    }
+
+
+def output(custom_id: str, intent: Optional[str] = None, status: int = 200) -> Dict:
+    body = completion(intent) if status == 200 else {"error": {"message": "Internal server error"}}
+    return {"id": f"batch_req_{custom_id}", "custom_id": custom_id, "error": None,
+            "response": {"status_code": status, "request_id": "req", "body": body}}
+
+
+def write_jsonl(path: str, records: List[Dict]) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return path
+
+
+def test_custom_ids_round_trip():
+    assert parse_custom_id(make_custom_id("ensemble", MODEL, 12, 2)) == ("ensemble", MODEL, 12, 2)
+
+
+def test_outputs_join_back_to_each_cells_transcripts(tmp_path):
+    runner = BatchRunner(ImprovementTester("test-key", ensemble_votes=3), str(tmp_path))
+    requests = runner.build_requests(ROWS_BY_CELL)
+    assert len(requests) == 2 + 2 * 3
+
+    outputs = [
+        output(make_custom_id("baseline", MODEL, 3, 0), "voice_interested"),
+        output(make_custom_id("ensemble", MODEL, 3, 0), "voice_interested"),
+        output(make_custom_id("ensemble", MODEL, 3, 1), "voice_unknown"),
+        output(make_custom_id("ensemble", MODEL, 3, 2), "voice_interested"),
+        output(make_custom_id("ensemble", MODEL, 5, 0), "voice_unknown"),
+        output(make_custom_id("ensemble", MODEL, 5, 2), "voice_unknown"),
+    ]
+    # Output files come back in any order and split over parts; baseline row 7 has no output at all
+    random.Random(0).shuffle(outputs)
+    state = {"parts": [
+        {"output_path": write_jsonl(str(tmp_path / "out_0.jsonl"), outputs[:3]), "error_path": None},
+        {"output_path": write_jsonl(str(tmp_path / "out_1.jsonl"), outputs[3:]),
+         "error_path": write_jsonl(str(tmp_path / "errors_1.jsonl"),
+                                   [output(make_custom_id("ensemble", MODEL, 5, 1), status=500)])},
+    ]}
+
+    results = runner.join_results(state, requests, ROWS_BY_CELL)
+
+    baseline = results[("baseline", MODEL)]
+    assert [(r["transcript_index"], r["transcript"]) for r in baseline] == ROWS_BY_CELL[("baseline", MODEL)]
+    assert baseline[0]["classification_result"]["intent"] == "voice_interested"
+    assert baseline[0]["classification_result"]["usage"]["prompt_tokens"] == 100
+    assert baseline[1]["classification_result"]["intent"] is None
+    assert baseline[1]["classification_result"]["error_class"] == "BatchMissingOutput"
+
+    ensemble = results[("ensemble", MODEL)]
+    assert [r["transcript_index"] for r in ensemble] == [3, 5]
+    voted = ensemble[0]["classification_result"]
+    assert voted["intent"] == "voice_interested"
+    assert [r["intent"] for r in voted["individual_results"]] == ["voice_interested", "voice_unknown",
+                                                                 "voice_interested"]
+    # One failed vote makes the transcript a transport failure rather than a vote of two
+    failed = ensemble[1]["classification_result"]
+    assert failed["intent"] is None
+    assert failed["error_class"] == "BatchRequestError"
+    assert failed["transport_error"] == "Internal server error"
@@ -0,0 +1,72 @@
+"""Cascade stages: the default model order, how a stage votes, and the cost and latency charged to it"""
+
+import asyncio
+from typing import Dict, List, Tuple
+
+import pytest
+
+from cascade import cheapest_first, stage_cost, stage_latency
+from test_improvements import ImprovementTester
+
+
+def call(latency=None, queue_wait=0.0, **fields):
+    return {"latency": latency, "queue_wait": queue_wait, "response_cache_hit": False, **fields}
+
+
+def test_stage_latency_is_the_slowest_parallel_call():
+    assert stage_latency([call(0.05), call(0.12), call(0.08)]) == pytest.approx(0.12)
+
+
+def test_stage_latency_leaves_out_queue_wait():
+    assert stage_latency([call(0.05, queue_wait=1.3), call(0.04, queue_wait=0.69)]) == pytest.approx(0.05)
+
+
+def test_stage_latency_replays_cache_hits():
+    hit = call(0.0, response_cache_hit=True, cached_latency=0.2)
+    assert stage_latency([hit, call(0.1)]) == pytest.approx(0.2)
+
+
+def test_stage_latency_of_calls_without_timing():
+    # Prefilter answers and entries cached before latencies were kept
+    old_hit = call(0.0, response_cache_hit=True, cached_latency=None)
+    assert stage_latency([{"intent": "voice_unknown"}, old_hit]) == 0.0
+    assert stage_latency([]) == 0.0
+
+
+def test_stage_cost_charges_cache_hits_what_they_cost():
+    usage = {"prompt_tokens": 1_000_000, "completion_tokens": 0, "cached_tokens": 0}
+    empty = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    live = call(0.1, usage=usage)
+    hit = call(0.0, usage=empty, response_cache_hit=True, cached_usage=usage)
+    assert stage_cost("gpt-4.1-2025-04-14", [live, hit]) == pytest.approx(4.00)
+    assert stage_cost("unknown-model", [live]) == 0.0
+
+
+def test_cheapest_first_orders_by_price_with_unpriced_models_last():
+    models = ["gpt-4.1-2025-04-14", "local-model", "gpt-5-2025-08-07", "gpt-5-mini-2025-08-07"]
+    assert cheapest_first(models) == ["gpt-5-mini-2025-08-07", "gpt-4.1-2025-04-14", "gpt-5-2025-08-07",
+                                      "local-model"]
+
+
+class RecordingTester(ImprovementTester):
+    """Single calls answer from a script instead of the API and are recorded as (method, model, sample)"""
+
+    def __init__(self, answers: List[str]):
+        super().__init__("test-key", cascade_votes=len(answers))
+        self.answers = answers
+        self.calls: List[Tuple[str, str, int]] = []
+
+    async def _classify(self, method: str, transcript: str, model: str, sample: int = 0,
+                        logprobs: bool = False) -> Dict:
+        self.calls.append((method, model, sample))
+        return {"intent": self.answers[sample]}
+
+
+def test_stage_without_logprobs_votes_with_its_own_method():
+    tester = RecordingTester(["voice_interested", "voice_interested", "voice_unknown"])
+    result, confidence, source = asyncio.run(
+        tester._cascade_stage("different_prompt", "transcript", "gpt-5-mini-2025-08-07"))
+    assert tester.calls == [("different_prompt", "gpt-5-mini-2025-08-07", i) for i in range(3)]
+    assert result["intent"] == "voice_interested"
+    assert confidence == pytest.approx(2 / 3)
+    assert source == "votes"
@@ -0,0 +1,111 @@
+"""Evaluation: loading runs into the label matrix, McNemar tests and bootstrap intervals, checked against known answers"""
+
+import math
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytest
+
+import evaluation
+import results_store
+from evaluation import MISSING, OTHER, RunMatrix, encode_label
+
+
+GROUND_TRUTH = {1: "voice_interested", 2: "voice_not_interested", 3: "voice_unknown", 5: "voice_interested"}
+
+
+def row(index: int, intent: Optional[str], **result) -> Dict:
+    return {"transcript_index": index, "transcript": f"transcript {index}",
+            "classification_result": {"intent": intent, **result}}
+
+
+def matrix_of(*runs: List[Optional[bool]]) -> RunMatrix:
+    """Runs over transcripts whose truth is label 0; True is right, False wrong, None unanswered"""
+    n = len(runs[0])
+    pred = np.array([[MISSING if c is None else (0 if c else 1) for c in run] for run in runs], dtype=np.int8)
+    return RunMatrix([f"run{r}" for r in range(len(runs))], np.arange(1, n + 1), np.zeros(n, dtype=np.int8), pred)
+
+
+ROWS = [
+    row(2, "voice_not_interested"),
+    row(1, "voice_interested"),
+    # A transport failure, an answer outside the categories, and a transcript not in the ground truth
+    row(3, None, transport_error="timed out"),
+    row(5, "voice_maybe"),
+    row(4, "voice_interested"),
+]
+
+
+def test_load_run_matrix_places_rows_by_transcript_index():
+    matrix = evaluation.load_run_matrix({"run": ROWS, "empty": []}, GROUND_TRUTH)
+    assert matrix.transcript_index.tolist() == [1, 2, 3, 5]
+    assert matrix.truth.tolist() == [encode_label(GROUND_TRUTH[i]) for i in (1, 2, 3, 5)]
+    assert matrix.pred[0].tolist() == [encode_label("voice_interested"), encode_label("voice_not_interested"),
+                                       MISSING, OTHER]
+    assert matrix.pred[1].tolist() == [MISSING] * 4
+    assert matrix.valid.sum(axis=1).tolist() == [3, 0]
+    assert matrix.correct.sum(axis=1).tolist() == [2, 0]
+    assert evaluation.accuracy(matrix).tolist() == pytest.approx([2 / 3, 0.0])
+
+
+@pytest.mark.skipif(results_store.pa is None, reason="pyarrow not installed")
+def test_store_and_row_loading_agree(tmp_path):
+    store = results_store.ResultsStore(str(tmp_path / "store"))
+    store.write_run("run", "baseline", "gpt-4.1-2025-04-14", ROWS)
+    from_store = evaluation.load_run_matrix_from_store(store, ["run"], GROUND_TRUTH)
+    from_rows = evaluation.load_run_matrix({"run": ROWS}, GROUND_TRUTH)
+    assert from_store.pred.tolist() == from_rows.pred.tolist()
+
+
+def test_mcnemar_counts_disagreements_on_transcripts_both_answered():
+    matrix = matrix_of([True, True, True, False, None, True],
+                       [False, False, True, True, True, None])
+    result = evaluation.mcnemar(matrix)
+    assert result["b"][0, 1] == 2
+    assert result["b"][1, 0] == 1
+    assert result["c"][0, 1] == 1
+    # Exact binomial: P(X <= 1) for X ~ Bin(3, 1/2), doubled
+    assert result["p"][0, 1] == pytest.approx(1.0)
+    assert result["p"][0, 0] == 1.0
+
+
+@pytest.mark.parametrize("b, c, p", [
+    (0, 0, 1.0),
+    (0, 5, 2 / 32),
+    (1, 9, 2 * 11 / 1024),
+    # Chi-square with continuity correction: (|40 - 20| - 1)^2 / 60 = 6.0167, 1 degree of freedom
+    (40, 20, 0.014171),
+])
+def test_mcnemar_p_values(b, c, p):
+    assert evaluation._mcnemar_p_value(b, c) == pytest.approx(p, abs=1e-6)
+    assert evaluation._mcnemar_p_value(c, b) == pytest.approx(p, abs=1e-6)
+
+
+def test_bootstrap_interval_of_a_perfect_run_is_a_point():
+    samples = evaluation.bootstrap_accuracy(matrix_of([True] * 50), n_resamples=200)
+    low, high = evaluation.confidence_interval(samples)
+    assert samples.shape == (200, 1)
+    assert (low[0], high[0]) == (1.0, 1.0)
+
+
+def test_bootstrap_interval_matches_the_normal_approximation():
+    # 400 transcripts at 50%: the 95% interval is about 0.5 +- 1.96 * sqrt(0.25 / 400) = 0.5 +- 0.049
+    matrix = matrix_of([True, False] * 200)
+    low, high = evaluation.confidence_interval(evaluation.bootstrap_accuracy(matrix, n_resamples=4000))
+    half_width = 1.96 * math.sqrt(0.25 / 400)
+    assert low[0] == pytest.approx(0.5 - half_width, abs=0.01)
+    assert high[0] == pytest.approx(0.5 + half_width, abs=0.01)
+
+
+def test_bootstrap_resamples_are_paired_and_skip_unanswered():
+    rng = np.random.default_rng(1)
+    correct = rng.random((12, 60)) < 0.7
+    runs = [list(run) for run in correct]
+    # A copy of run 0 and run 0 with every wrong answer unanswered instead
+    runs.append(list(correct[0]))
+    runs.append([True if c else None for c in correct[0]])
+    # Enough distinct patterns to take the per-transcript weights path
+    samples = evaluation.bootstrap_accuracy(matrix_of(*runs), n_resamples=500, max_chunk_elements=6000)
+    assert samples[:, 0].tolist() == samples[:, 12].tolist()
+    assert samples[:, 13].tolist() == [1.0] * 500
+    assert samples[:, 0].mean() == pytest.approx(correct[0].mean(), abs=0.02)
@@ -0,0 +1,105 @@
+"""Few-shot neighbour selection: nearest examples first, never the transcript itself, each text embedded once"""
+
+import asyncio
+from typing import Dict, List
+
+import numpy as np
+import pytest
+
+import few_shot_index
+from few_shot_index import EmbeddingCache, FewShotIndex, FewShotSelector, content_hash
+
+
+class TableEmbedder:
+    """Fixed 2-d vectors per text; records every text it is asked to embed"""
+
+    name = "table:2"
+
+    def __init__(self, table: Dict[str, List[float]]):
+        self.table = table
+        self.embedded: List[str] = []
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        self.embedded += texts
+        return np.array([self.table[text.strip()] for text in texts], dtype=np.float32)
+
+
+VECTORS = {
+    "a": [1.0, 0.0],
+    "b": [0.8, 0.6],
+    "c": [0.0, 1.0],
+    "d": [-1.0, 0.0],
+    "query": [1.0, 0.1],
+}
+ROWS = [(1, "a", "voice_interested"), (2, "b", "voice_not_interested"), (3, "c", "voice_unknown"),
+        (4, "d", "voice_interested")]
+
+
+def build(path: str, rows=ROWS, embedder=None) -> FewShotIndex:
+    return asyncio.run(FewShotIndex.build(path, rows, embedder or TableEmbedder(VECTORS)))
+
+
+def select(index: FewShotIndex, transcript: str, k: int, embedder=None) -> List[Dict]:
+    selector = FewShotSelector(index, embedder or TableEmbedder(VECTORS), k=k)
+    return asyncio.run(selector.select(transcript))
+
+
+def test_nearest_examples_come_first(tmp_path):
+    examples = select(build(str(tmp_path / "index")), "query", k=3)
+    assert [e["transcript"] for e in examples] == ["a", "b", "c"]
+    assert [e["transcript_index"] for e in examples] == [1, 2, 3]
+    assert examples[1]["intent"] == "voice_not_interested"
+    norm = np.hypot(1.0, 0.1)
+    assert [e["score"] for e in examples] == pytest.approx([1 / norm, 0.86 / norm, 0.1 / norm], abs=1e-6)
+
+
+def test_a_transcript_never_retrieves_itself_or_its_duplicates(tmp_path):
+    rows = ROWS + [(5, "a\r\n", "voice_unknown")]
+    examples = select(build(str(tmp_path / "index"), rows), "a", k=2)
+    assert [e["transcript"] for e in examples] == ["b", "c"]
+
+
+def test_fewer_eligible_examples_than_k(tmp_path):
+    index = build(str(tmp_path / "index"), ROWS[:2])
+    assert [e["transcript"] for e in select(index, "a", k=3)] == ["b"]
+    rows, _ = index.search(np.array([VECTORS["a"]], dtype=np.float32), 3, exclude=[content_hash("a")])
+    assert rows.tolist() == [[1, -1, -1]]
+
+
+def test_search_in_blocks_matches_one_pass(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    table = {f"t{i}": rng.normal(size=2).tolist() for i in range(11)}
+    index = build(str(tmp_path / "index"), [(i, text, "voice_unknown") for i, text in enumerate(table)],
+                  TableEmbedder(table))
+    queries = few_shot_index.normalize_rows(rng.normal(size=(4, 2)))
+    rows, scores = index.search(queries, 4)
+    monkeypatch.setattr(few_shot_index, "SEARCH_BLOCK", 3)
+    block_rows, block_scores = index.search(queries, 4)
+    assert block_rows.tolist() == rows.tolist()
+    assert block_scores == pytest.approx(scores)
+
+
+def test_each_text_is_embedded_once(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    embedder = TableEmbedder(VECTORS)
+    index = asyncio.run(FewShotIndex.build(str(tmp_path / "index"), ROWS + [(5, "a", "voice_interested")],
+                                           embedder, cache))
+    assert sorted(embedder.embedded) == ["a", "b", "c", "d"]
+
+    selector = FewShotSelector(index, embedder, cache=cache, k=1)
+
+    async def repeated():
+        return await asyncio.gather(*(selector.select("query") for _ in range(3)), selector.select("b"))
+
+    asyncio.run(repeated())
+    # "b" came from the cache the index was built with; "query" was embedded for all three selections
+    assert sorted(embedder.embedded) == ["a", "b", "c", "d", "query"]
+    cache.close()
+
+
+def test_selector_refuses_an_index_from_another_embedder(tmp_path):
+    index = build(str(tmp_path / "index"))
+    other = TableEmbedder(VECTORS)
+    other.name = "table:other"
+    with pytest.raises(ValueError):
+        FewShotSelector(index, other)
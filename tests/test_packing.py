@@ -0,0 +1,61 @@
+"""parse_pack_reply: which answers of a packed reply are trusted"""
+
+import json
+
+from packing import parse_pack_reply
+
+
+IDS = ["t1", "t2", "t3"]
+
+
+def reply(*entries) -> str:
+    return json.dumps({"classifications": [{"id": entry_id, "intent": intent} for entry_id, intent in entries]})
+
+
+def test_maps_each_id_to_its_intent():
+    content = reply(("t1", "voice_interested"), ("t2", "voice_not_interested"), ("t3", "voice_unknown"))
+    assert parse_pack_reply(content, IDS) == {
+        "t1": "voice_interested", "t2": "voice_not_interested", "t3": "voice_unknown",
+    }
+
+
+def test_accepts_a_bare_list():
+    content = json.dumps([{"id": "t2", "intent": "voice_interested"}])
+    assert parse_pack_reply(content, IDS) == {"t2": "voice_interested"}
+
+
+def test_duplicate_id_drops_every_answer_for_it():
+    content = reply(("t1", "voice_interested"), ("t2", "voice_interested"), ("t1", "voice_not_interested"))
+    assert parse_pack_reply(content, IDS) == {"t2": "voice_interested"}
+
+
+def test_duplicate_id_stays_dropped_when_answered_a_third_time():
+    content = reply(("t1", "voice_interested"), ("t1", "voice_interested"), ("t1", "voice_interested"))
+    assert parse_pack_reply(content, IDS) == {}
+
+
+def test_duplicate_id_with_an_invalid_first_answer_is_still_dropped():
+    content = reply(("t1", "not_an_intent"), ("t1", "voice_interested"))
+    assert parse_pack_reply(content, IDS) == {}
+
+
+def test_unknown_ids_are_ignored():
+    content = reply(("t1", "voice_interested"), ("t9", "voice_interested"), ("1", "voice_unknown"))
+    assert parse_pack_reply(content, IDS) == {"t1": "voice_interested"}
+
+
+def test_invalid_intent_counts_as_missing():
+    content = reply(("t1", "voice_interested"), ("t2", "interested"))
+    assert parse_pack_reply(content, IDS) == {"t1": "voice_interested"}
+
+
+def test_non_dict_entries_are_skipped():
+    content = json.dumps({"classifications": ["t1", None, {"id": "t3", "intent": "voice_unknown"}]})
+    assert parse_pack_reply(content, IDS) == {"t3": "voice_unknown"}
+
+
+def test_unparseable_replies_answer_nothing():
+    assert parse_pack_reply(None, IDS) == {}
+    assert parse_pack_reply("not json", IDS) == {}
+    assert parse_pack_reply(json.dumps({"classifications": "t1"}), IDS) == {}
+    assert parse_pack_reply(json.dumps({"intent": "voice_unknown"}), IDS) == {}
@@ -0,0 +1,66 @@
+"""Prefilter rules: which transcripts are answered locally, and how precisely on transcripts they were not written from"""
+
+import os
+
+import pytest
+
+from prefilter import Prefilter, hangup_rule, parse_turns, prefilter_report, voicemail_rule
+from result_stream import iter_csv_rows
+
+
+HOLDOUT_CSV = os.path.join(os.path.dirname(__file__), "data", "prefilter_holdout.csv")
+QUESTION = "Agent: I'm following up on your interest in the online MBA. Are you still interested?"
+
+
+@pytest.mark.parametrize("transcript", [
+    "User: Hello?",
+    "User: Hi\n" + QUESTION,
+    "User: Um\nAgent: Hello?\nUser: Hello? Hello?",
+    "User: (inaudible speech)",
+    "User: Hola?",
+])
+def test_greeting_only_calls_are_hangups(transcript):
+    assert hangup_rule(parse_turns(transcript))
+
+
+@pytest.mark.parametrize("transcript", [
+    "User: Yes.\n" + QUESTION + "\nUser: Yes. Okay. Thank you.",
+    "User: Yes?",
+    "User: Hello?\n" + QUESTION + "\nUser: Yeah.",
+    "User: Okay.",
+    "User: Thanks.",
+    "User: Speaking.",
+    "User: Who?",
+])
+def test_short_answers_go_to_the_model(transcript):
+    assert not hangup_rule(parse_turns(transcript))
+    assert Prefilter().decide(transcript) is None
+
+
+def test_no_user_turns_or_too_many_are_not_hangups():
+    assert not hangup_rule(parse_turns(QUESTION))
+    assert not hangup_rule(parse_turns("\n".join(["User: Hello?"] * 6)))
+
+
+def test_voicemail_greeting_only_in_the_opening_turns():
+    assert voicemail_rule(parse_turns("User: Please leave a message after the tone."))
+    assert voicemail_rule(parse_turns("User: Deje su mensaje después del tono."))
+    late = "User: Hello?\nUser: Hi.\nUser: Just leave a message on my voicemail."
+    assert not voicemail_rule(parse_turns(late))
+
+
+def test_decision_names_its_rule():
+    assert Prefilter().decide("User: Hello?") == {
+        "intent": "voice_immediate_hangup", "source": "rule:filler_only", "confidence": 1.0,
+    }
+    assert Prefilter(rules=False).decide("User: Hello?") is None
+
+
+def test_rules_are_precise_on_held_out_transcripts():
+    prefilter = Prefilter()
+    report = prefilter_report((intent, prefilter.decide(transcript))
+                              for _, transcript, intent in iter_csv_rows(HOLDOUT_CSV))
+    assert report["hits"] > 0
+    assert report["precision"] == 1.0
+    for source in ("rule:filler_only", "rule:voicemail_greeting"):
+        assert report["by_source"][source]["precision"] == 1.0
@@ -0,0 +1,84 @@
+"""ResponseCache: keys that ignore whitespace noise, TTL expiry and the LRU size cap"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import response_cache
+from response_cache import ResponseCache, make_cache_key
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(time=clock.time))
+    return clock
+
+
+def response(content: str):
+    return {"content": content, "logprobs": None}
+
+
+def test_cache_key_ignores_line_endings_and_trailing_whitespace():
+    params = {"temperature": 0.0, "sample": 0}
+    key = make_cache_key("m", "baseline", [{"role": "user", "content": "Hi there\nBye"}], params)
+    assert make_cache_key("m", "baseline", [{"role": "user", "content": "  Hi there  \r\nBye\n"}], params) == key
+    assert make_cache_key("m", "baseline", [{"role": "user", "content": "Hi there\nBye"}],
+                          dict(params, sample=1)) != key
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=60)
+    cache.put("k", "m", "baseline", response("a"))
+    clock.now += 60
+    assert cache.get("k") == response("a")
+    # The hit does not extend the TTL; it runs from when the response was stored
+    clock.now += 1
+    assert cache.get("k") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.evict() == 1
+    cache.close()
+
+
+def test_expired_entries_are_dropped_when_the_cache_is_opened(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = ResponseCache(path, ttl_seconds=60)
+    cache.put("old", "m", "baseline", response("a"))
+    clock.now += 30
+    cache.put("new", "m", "baseline", response("b"))
+    cache.close()
+
+    clock.now += 45
+    reopened = ResponseCache(path, ttl_seconds=None)
+    assert reopened.get("old") is not None
+    reopened.close()
+    reopened = ResponseCache(path, ttl_seconds=60)
+    assert reopened.get("old") is None
+    assert reopened.get("new") == response("b")
+    reopened.close()
+
+
+def test_size_cap_evicts_the_least_recently_used(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite3"), ttl_seconds=None, max_entries=2)
+    for key in ("a", "b"):
+        clock.now += 1
+        cache.put(key, "m", "baseline", response(key))
+    clock.now += 1
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == response("a")
+    clock.now += 1
+    cache.put("c", "m", "baseline", response("c"))
+
+    assert cache.evict() == 1
+    assert cache.get("b") is None
+    assert cache.get("a") == response("a")
+    assert cache.get("c") == response("c")
+    cache.close()
@@ -0,0 +1,80 @@
+"""Seeking into the CSV by byte offset: resuming at any row, and reading one shard from where scan_shards found it"""
+
+import csv
+from typing import List
+
+import pytest
+
+from result_stream import iter_csv_records, iter_csv_rows
+from sweep import scan_shards, shard_rows
+
+
+TRANSCRIPTS = [
+    "User: Hello?",
+    "User: Sí, ¿quién habla?\nAgent: Le llamo de la universidad.",
+    "",
+    'User: She said "call me back", then\r\nhung up.',
+    "User: Ça va, merci — pas intéressé.",
+    "User: 你好",
+    "",
+    "",
+    "User: Yes.\n\nUser: Tell me more.",
+    "User: Okay.",
+]
+
+
+@pytest.fixture(params=["\r\n", "\n"], ids=["crlf", "lf"])
+def csv_file(request, tmp_path) -> str:
+    path = str(tmp_path / "data.csv")
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f, lineterminator=request.param)
+        writer.writerow(["transcript", "human_generated_intent"])
+        for i, transcript in enumerate(TRANSCRIPTS):
+            writer.writerow([transcript, f"intent {i + 1}"])
+            if i == 5:
+                # A blank line is not a row and does not take an index
+                f.write(request.param)
+    return path
+
+
+def test_full_read_counts_empty_transcripts_but_yields_only_real_ones(csv_file):
+    records = list(iter_csv_records(csv_file))
+    assert [index for _, index, _ in records] == list(range(1, len(TRANSCRIPTS) + 1))
+    assert [row["transcript"] for _, _, row in records] == TRANSCRIPTS
+    rows = list(iter_csv_rows(csv_file))
+    assert [(index, transcript) for index, transcript, _ in rows] == [
+        (i + 1, t) for i, t in enumerate(TRANSCRIPTS) if t
+    ]
+    assert rows[-1][2] == f"intent {len(TRANSCRIPTS)}"
+
+
+def test_reading_from_any_rows_offset_gives_the_rest_of_the_file(csv_file):
+    records = list(iter_csv_records(csv_file))
+    for position, (offset, index, _) in enumerate(records):
+        assert list(iter_csv_records(csv_file, offset, index)) == records[position:]
+        assert list(iter_csv_rows(csv_file, offset, index)) == [
+            (i, row["transcript"], row["human_generated_intent"]) for _, i, row in records[position:]
+            if row["transcript"]
+        ]
+
+
+@pytest.mark.parametrize("shard_size", [1, 2, 3, 4, 20])
+def test_shard_rows_from_scanned_offsets_match_a_full_read(csv_file, shard_size):
+    ground_truth, _, shards = scan_shards(csv_file, shard_size)
+    assert sorted(ground_truth) == [i + 1 for i, t in enumerate(TRANSCRIPTS) if t]
+
+    seen: List[int] = []
+    for shard, info in shards.items():
+        from_offset = list(shard_rows(csv_file, shard, shard_size, info["offset"]))
+        assert from_offset == list(shard_rows(csv_file, shard, shard_size))
+        assert len(from_offset) == info["rows"]
+        assert all((index - 1) // shard_size == shard for index, _ in from_offset)
+        seen += [index for index, _ in from_offset]
+    assert seen == sorted(ground_truth)
+
+
+def test_shard_of_only_empty_transcripts_is_not_scanned(csv_file):
+    # Rows 7 and 8 are the only rows of shard 3 at two rows per shard
+    _, _, shards = scan_shards(csv_file, 2)
+    assert 3 not in shards
+    assert sorted(shards) == [0, 1, 2, 4]
@@ -0,0 +1,144 @@
+"""AdaptiveScheduler: halving once per congestion window, honouring Retry-After, and failing refused requests at once"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import httpx
+import openai
+import pytest
+
+from scheduler import AdaptiveScheduler, TransportError, retry_after_seconds
+from test_improvements import ImprovementTester
+
+
+def api_error(error_class, status: int, headers: Optional[Dict[str, str]] = None):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    response = httpx.Response(status, headers=headers or {}, request=request)
+    return error_class(f"Error code: {status}", response=response, body=None)
+
+
+class ScriptedRequest:
+    """Raises the scripted errors in turn, then succeeds; counts the attempts"""
+
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.attempts = 0
+
+    async def __call__(self):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(headers={})
+
+
+def test_throttles_from_one_window_halve_the_limit_once():
+    scheduler = AdaptiveScheduler(max_concurrency=16)
+    sent_before = time.monotonic()
+    scheduler.on_throttle(None, sent_at=sent_before)
+    # The rest of the burst was already in flight when the limit came down
+    scheduler.on_throttle(None, sent_at=sent_before)
+    scheduler.on_throttle(None, sent_at=sent_before)
+    assert scheduler.limit == 8
+    assert scheduler.stats["throttled"] == 3
+
+    scheduler.on_throttle(None, sent_at=time.monotonic())
+    assert scheduler.limit == 4
+
+
+def test_retry_after_headers():
+    assert retry_after_seconds(api_error(openai.RateLimitError, 429, {"retry-after": "2"})) == 2.0
+    assert retry_after_seconds(api_error(openai.RateLimitError, 429, {"retry-after-ms": "250"})) == 0.25
+    assert retry_after_seconds(api_error(openai.RateLimitError, 429)) is None
+
+
+def test_rate_limited_request_waits_at_least_retry_after():
+    scheduler = AdaptiveScheduler(max_concurrency=4, base_delay=0.001)
+    request = ScriptedRequest(api_error(openai.RateLimitError, 429, {"retry-after-ms": "100"}))
+    start = time.monotonic()
+    _, timing = asyncio.run(scheduler.call(request))
+    assert time.monotonic() - start >= 0.1
+    assert request.attempts == 2
+    assert timing["retries"] == 1
+    assert timing["retry_errors"] == ["RateLimitError"]
+    assert scheduler.stats["throttled"] == 1
+    # Halved for the 429, then one success's additive increase
+    assert scheduler.limit == pytest.approx(2.5)
+
+
+@pytest.mark.parametrize("error", [
+    api_error(openai.AuthenticationError, 401),
+    api_error(openai.BadRequestError, 400),
+    api_error(openai.NotFoundError, 404),
+])
+def test_refused_requests_fail_on_the_first_attempt(error):
+    scheduler = AdaptiveScheduler(max_concurrency=4, base_delay=0.001)
+    request = ScriptedRequest(error)
+    with pytest.raises(TransportError) as raised:
+        asyncio.run(scheduler.call(request))
+    assert raised.value.__cause__ is error
+    assert not raised.value.retryable
+    assert raised.value.attempts == 1
+    assert request.attempts == 1
+    assert scheduler.stats["retries"] == 0
+    assert scheduler.in_flight == 0
+
+
+def test_exhausted_retries_stay_retryable():
+    scheduler = AdaptiveScheduler(max_concurrency=4, max_retries=1, base_delay=0.001)
+    request = ScriptedRequest(*[api_error(openai.InternalServerError, 500)] * 2)
+    with pytest.raises(TransportError) as raised:
+        asyncio.run(scheduler.call(request))
+    assert raised.value.retryable
+    assert raised.value.attempts == 2
+    assert raised.value.retry_errors == ["InternalServerError", "InternalServerError"]
+
+
+class ListLog:
+    def __init__(self):
+        self.done: set = set()
+        self.rows: List[Dict] = []
+
+    def mark_started(self) -> None:
+        pass
+
+    def append(self, row: Dict) -> None:
+        self.rows.append(row)
+
+
+class FailingTester(ImprovementTester):
+    """Every baseline call fails with the given TransportError"""
+
+    def __init__(self, error: TransportError):
+        super().__init__("test-key", requeue_rounds=2)
+        self.error = error
+        self.calls = 0
+
+    async def baseline_classify(self, transcript: str, model: str) -> Dict:
+        self.calls += 1
+        raise self.error
+
+
+def sweep(tester: FailingTester) -> Dict:
+    cell = ("baseline", tester.models[0])
+    log = ListLog()
+    asyncio.run(tester.stream_sweep([cell], [(1, "User: Who is this?")], {cell: log}))
+    assert len(log.rows) == 1
+    return log.rows[0]["classification_result"]
+
+
+def test_refused_requests_are_written_without_requeuing():
+    tester = FailingTester(TransportError("Error code: 401", "AuthenticationError", 1, retryable=False))
+    result = sweep(tester)
+    assert tester.calls == 1
+    assert result["intent"] is None
+    assert result["error_class"] == "AuthenticationError"
+    assert not result["retryable"]
+
+
+def test_transport_failures_are_requeued():
+    tester = FailingTester(TransportError("timed out", "APITimeoutError", 6))
+    result = sweep(tester)
+    assert tester.calls == 3
+    assert result["retryable"]
@@ -0,0 +1,154 @@
+"""IntentScanner and read_until_intent: finding the intent early without being fooled by the rest of the JSON"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+from typing import List, Optional
+
+import httpx
+import openai
+import pytest
+
+from scheduler import StreamInterruptedError
+from streaming import IntentScanner, read_until_intent
+
+
+INTENTS = ["voice_interested", "voice_not_interested", "voice_unknown"]
+
+
+def scan(*pieces: str) -> Optional[str]:
+    scanner = IntentScanner(INTENTS)
+    for piece in pieces:
+        if scanner.feed(piece) is not None:
+            break
+    return scanner.intent
+
+
+def test_intent_split_across_pieces():
+    assert scan('{"int', 'ent": "voice_', 'interested"', "}") == "voice_interested"
+
+
+def test_intent_only_once_its_string_is_closed():
+    scanner = IntentScanner(INTENTS)
+    assert scanner.feed('{"intent": "voice_interested') is None
+    assert scanner.feed('"') == "voice_interested"
+
+
+def test_escaped_quote_inside_another_value_does_not_end_it():
+    reply = json.dumps({"reasoning": 'caller said "intent": "voice_interested", then hung up',
+                        "intent": "voice_not_interested"})
+    assert scan(reply) == "voice_not_interested"
+
+
+def test_escaped_backslash_before_a_closing_quote():
+    assert scan(r'{"reasoning": "path C:\\", "intent": "voice_unknown"}') == "voice_unknown"
+
+
+def test_escaped_characters_in_the_intent_value_are_decoded():
+    assert scan(r'{"intent": "voice_\u0069nterested"}') == "voice_interested"
+
+
+def test_nested_intent_keys_are_ignored():
+    reply = json.dumps({"details": {"intent": "voice_interested"}, "candidates": [{"intent": "voice_unknown"}],
+                        "intent": "voice_not_interested"})
+    assert scan(reply) == "voice_not_interested"
+
+
+def test_intent_as_a_value_is_not_a_key():
+    assert scan('{"label": "intent", "other": "voice_interested"}') is None
+
+
+def test_unknown_intent_value_is_not_taken():
+    assert scan('{"intent": "voice_maybe", "reasoning": "voice_interested"}') is None
+
+
+def test_rest_is_what_followed_the_intent():
+    scanner = IntentScanner(INTENTS)
+    scanner.feed('{"intent": "voice_unknown", "reasoning": "')
+    assert scanner.rest == ', "reasoning": "'
+
+
+class FakeStream:
+    def __init__(self, chunks: List, error: Optional[Exception] = None):
+        self.chunks = list(chunks)
+        self.error = error
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.chunks:
+            return self.chunks.pop(0)
+        if self.error is not None:
+            raise self.error
+        raise StopAsyncIteration
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def content(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))], usage=None)
+
+
+def usage_chunk():
+    return SimpleNamespace(choices=[], usage=SimpleNamespace(prompt_tokens=100, completion_tokens=8))
+
+
+def read(stream: FakeStream):
+    raw = SimpleNamespace(headers={}, parse=lambda: stream)
+
+    async def response():
+        return raw
+
+    return asyncio.run(read_until_intent(response(), INTENTS))
+
+
+def test_reply_ending_after_the_intent_is_read_to_the_end():
+    stream = FakeStream([content('{"intent": '), content('"voice_unknown"'), content("}\n"), usage_chunk()])
+    reply = read(stream)
+    assert not reply.cancelled
+    assert reply.final is not None
+    assert reply.content == '{"intent": "voice_unknown"}\n'
+    assert stream.closed
+
+
+def test_reply_continuing_after_the_intent_is_cancelled():
+    stream = FakeStream([content('{"intent": "voice_unknown"'), content(', "reasoning": "'), content("long"),
+                         usage_chunk()])
+    reply = read(stream)
+    assert reply.cancelled
+    assert reply.final is None
+    assert json.loads(reply.content) == {"intent": "voice_unknown"}
+    # The content after the intent was not read past the first piece of it
+    assert len(stream.chunks) == 2
+
+
+def test_content_after_the_intent_in_the_same_piece_cancels():
+    reply = read(FakeStream([content('{"intent": "voice_unknown", "reasoning": "'), usage_chunk()]))
+    assert reply.cancelled
+
+
+def test_reply_without_an_intent_is_read_to_the_end():
+    reply = read(FakeStream([content('{"answer": "voice_unknown"}'), usage_chunk()]))
+    assert not reply.cancelled
+    assert reply.content == '{"answer": "voice_unknown"}'
+
+
+@pytest.mark.parametrize("error", [
+    httpx.ReadError("connection reset"),
+    httpx.RemoteProtocolError("peer closed connection"),
+])
+def test_transport_errors_mid_stream_are_retryable(error):
+    stream = FakeStream([content('{"intent": "voice_')], error=error)
+    with pytest.raises(StreamInterruptedError):
+        read(stream)
+    assert stream.closed
+
+
+def test_sse_error_event_is_retryable():
+    error = openai.APIError("server_error", httpx.Request("POST", "https://api.openai.com/v1/chat/completions"),
+                            body=None)
+    with pytest.raises(StreamInterruptedError):
+        read(FakeStream([], error=error))
@@ -0,0 +1,155 @@
+"""Resuming sweeps: carrying answered rows forward by fingerprint when CSV rows move or change, and the time spent"""
+
+import csv
+import json
+from typing import Dict, List, Optional, Tuple
+
+from result_stream import iter_result_log
+from sweep import SweepOrchestrator, collect_carry, log_path
+from test_improvements import resumed_durations
+
+
+CELL = ("baseline", "gpt-4.1-2025-04-14")
+
+
+class StubTester:
+    cascade_models: List[str] = []
+
+    def cell_settings(self, method: str, model: str) -> Dict:
+        return {"method": method, "model": model}
+
+
+def write_csv(path: str, transcripts: List[str]) -> str:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["transcript", "human_generated_intent"])
+        for transcript in transcripts:
+            writer.writerow([transcript, "voice_interested"])
+    return path
+
+
+def answer_everything(run_dir: str, csv_file: str) -> None:
+    """Plan a fresh sweep and fill its log as if every job had run, answering each transcript with itself"""
+    orchestrator = SweepOrchestrator(StubTester(), run_dir, csv_file, shard_size=2)
+    jobs, _ = orchestrator.plan([CELL])
+    for index, transcript in csv_rows(csv_file):
+        orchestrator.logs[CELL].append(orchestrator.stamp(CELL, {
+            "transcript_index": index,
+            "transcript": transcript,
+            "classification_result": {"intent": f"answer to {transcript}"},
+        }))
+    orchestrator.record_all(jobs, {})
+    orchestrator.close()
+
+
+def csv_rows(csv_file: str) -> List[Tuple[int, str]]:
+    with open(csv_file, encoding="utf-8", newline="") as f:
+        return [(index, row["transcript"]) for index, row in enumerate(csv.DictReader(f), 1)]
+
+
+def replan(run_dir: str, csv_file: str, since: Optional[str] = None):
+    orchestrator = SweepOrchestrator(StubTester(), run_dir, csv_file, shard_size=2)
+    jobs, counts = orchestrator.plan([CELL], since=since)
+    done = set(orchestrator.logs[CELL].done)
+    orchestrator.close()
+    answers = {row["transcript_index"]: row for row in iter_result_log(log_path(run_dir, *CELL))}
+    return jobs, counts, done, answers
+
+
+def test_inserted_row_shifts_answers_to_their_new_indices(tmp_path):
+    run_dir = str(tmp_path / "run")
+    answer_everything(run_dir, write_csv(str(tmp_path / "data.csv"), ["a", "b", "c", "d"]))
+
+    jobs, counts, done, answers = replan(run_dir, write_csv(str(tmp_path / "data.csv"), ["new", "a", "b", "c", "d"]))
+
+    assert counts["carried"] == 4
+    assert done == {2, 3, 4, 5}
+    for index, transcript in [(2, "a"), (3, "b"), (4, "c"), (5, "d")]:
+        assert answers[index]["transcript"] == transcript
+        assert answers[index]["classification_result"]["intent"] == f"answer to {transcript}"
+    assert 1 not in answers
+    # Every shard's content changed, so each is still a job, even if only to record it
+    assert {job.shard for job in jobs} == {0, 1, 2}
+
+
+def test_swapped_rows_are_carried_within_the_shard(tmp_path):
+    run_dir = str(tmp_path / "run")
+    answer_everything(run_dir, write_csv(str(tmp_path / "data.csv"), ["a", "b", "c", "d"]))
+
+    jobs, counts, done, answers = replan(run_dir, write_csv(str(tmp_path / "data.csv"), ["b", "a", "c", "d"]))
+
+    assert counts == {"done": 1, "invalidated": 1, "partial": 0, "new": 0, "carried": 2}
+    assert [job.shard for job in jobs] == [0]
+    assert done == {1, 2, 3, 4}
+    assert answers[1]["classification_result"]["intent"] == "answer to b"
+    assert answers[2]["classification_result"]["intent"] == "answer to a"
+    assert answers[1]["carried_from"] == log_path(run_dir, *CELL)
+    # Rows that did not move stay where they are, uncarried
+    assert "carried_from" not in answers[3]
+
+
+def test_edited_row_is_not_carried(tmp_path):
+    run_dir = str(tmp_path / "run")
+    answer_everything(run_dir, write_csv(str(tmp_path / "data.csv"), ["a", "b", "c", "d"]))
+
+    jobs, counts, done, answers = replan(run_dir, write_csv(str(tmp_path / "data.csv"), ["a", "b edited", "c", "d"]))
+
+    assert counts["carried"] == 0
+    assert [job.shard for job in jobs] == [0]
+    assert done == {1, 3, 4}
+    assert 2 not in answers
+
+
+def test_since_carries_rows_from_an_earlier_run_directory(tmp_path):
+    earlier = str(tmp_path / "earlier")
+    answer_everything(earlier, write_csv(str(tmp_path / "data.csv"), ["a", "b", "c", "d"]))
+
+    run_dir = str(tmp_path / "run")
+    _, counts, done, answers = replan(run_dir, write_csv(str(tmp_path / "data.csv"), ["c", "a", "b", "d"]),
+                                      since=earlier)
+
+    assert counts["carried"] == 4
+    assert done == {1, 2, 3, 4}
+    assert answers[1]["classification_result"]["intent"] == "answer to c"
+    assert answers[1]["carried_from"] == log_path(earlier, *CELL)
+
+
+def row(index: int, fingerprint: str, intent: str = "voice_interested", **fields) -> Dict:
+    return {"transcript_index": index, "fingerprint": fingerprint, "classification_result": {"intent": intent},
+            **fields}
+
+
+def test_collect_carry_keeps_the_first_answer_per_wanted_fingerprint():
+    carry: Dict[str, Dict] = {}
+    collect_carry([row(1, "f1", "voice_unknown"), row(2, "f1"), row(3, "f2"), row(4, "unwanted")],
+                  "run/log.jsonl", {"f1", "f2"}, carry)
+
+    assert set(carry) == {"f1", "f2"}
+    assert carry["f1"]["classification_result"]["intent"] == "voice_unknown"
+    assert carry["f1"]["carried_from"] == "run/log.jsonl"
+
+
+def test_collect_carry_skips_transport_failures_and_keeps_the_original_source():
+    failure = {"transcript_index": 1, "fingerprint": "f1",
+               "classification_result": {"intent": None, "transport_error": "timed out"}}
+    carry: Dict[str, Dict] = {}
+    collect_carry([failure, row(2, "f1", carried_from="first/log.jsonl"), row(3, "f2"), {"transcript_index": 4}],
+                  "second/log.jsonl", {"f1", "f2"}, carry)
+
+    assert carry["f1"]["transcript_index"] == 2
+    assert carry["f1"]["carried_from"] == "first/log.jsonl"
+    assert carry["f2"]["carried_from"] == "second/log.jsonl"
+
+
+def test_resumed_durations_add_to_the_previous_summary(tmp_path):
+    summary_file = str(tmp_path / "summary.json")
+    with open(summary_file, "w") as f:
+        json.dump({"cells": {"baseline_gpt-4.1-2025-04-14": {"duration": 12.5}}}, f)
+    table = {CELL: {"duration": 30.0}, ("few_shot", "gpt-4.1-2025-04-14"): {"duration": 8.0}}
+
+    # Nothing left to run keeps the earlier duration; a resumed cell adds to it
+    assert resumed_durations(summary_file, {}, table)[CELL] == 12.5
+    assert resumed_durations(summary_file, {CELL: 2.0}, table)[CELL] == 14.5
+    # No summary entry for the earlier run: fall back to the manifest's job times
+    assert resumed_durations(summary_file, {}, table)[("few_shot", "gpt-4.1-2025-04-14")] == 8.0
+    assert resumed_durations(str(tmp_path / "missing.json"), {CELL: 2.0}, table)[CELL] == 2.0
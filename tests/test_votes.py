@@ -0,0 +1,116 @@
+"""Adaptive ensemble voting: when a majority is settled, and what early exits and escalations are reported as"""
+
+import asyncio
+from typing import Dict, List, Tuple
+
+import pytest
+
+from classification import is_settled, leading_counts
+from test_improvements import ImprovementTester
+
+
+def votes(*intents: str) -> List[Dict]:
+    return [{"intent": intent} for intent in intents]
+
+
+def test_leading_counts():
+    assert leading_counts([]) == (0, 0)
+    assert leading_counts(votes("a")) == (1, 0)
+    assert leading_counts(votes("a", "b", "a", "c")) == (2, 1)
+
+
+@pytest.mark.parametrize("intents, budget, settled", [
+    ((), 3, False),
+    (("a",), 3, False),
+    (("a", "a"), 3, True),
+    (("a", "b"), 3, False),
+    (("a", "b", "a"), 3, True),
+    # A tie with the budget spent cannot be broken by more votes, but is not a majority either
+    (("a", "b"), 2, False),
+    (("a", "a", "a"), 5, True),
+    (("a", "a", "b"), 5, False),
+    (("a", "b", "c"), 3, False),
+])
+def test_is_settled(intents: Tuple[str, ...], budget: int, settled: bool):
+    assert is_settled(votes(*intents), budget) == settled
+
+
+class ScriptedTester(ImprovementTester):
+    """Votes come from a fixed script instead of the API; draws are recorded as (start, count)"""
+
+    def __init__(self, script: List[str], **kwargs):
+        super().__init__("test-key", adaptive_ensemble=True, **kwargs)
+        self.script = script
+        self.draws: List[Tuple[int, int]] = []
+        self.escalated_to: List[str] = []
+
+    async def _draw_votes(self, transcript: str, model: str, start: int, count: int,
+                          method: str = "few_shot") -> List[Dict]:
+        self.draws.append((start, count))
+        return votes(*self.script[start:start + count])
+
+    async def few_shot_classify(self, transcript: str, model: str, sample: int = 0) -> Dict:
+        self.escalated_to.append(model)
+        return {"intent": "voice_interested"}
+
+
+def collect(tester: ScriptedTester, budget: int) -> List[str]:
+    results = asyncio.run(tester._collect_votes("transcript", tester.models[0], [], budget))
+    return [r["intent"] for r in results]
+
+
+def test_agreeing_votes_stop_after_a_majority():
+    tester = ScriptedTester(["a", "a", "a", "a", "a"])
+    assert collect(tester, 5) == ["a", "a", "a"]
+    assert tester.draws == [(0, 3)]
+
+
+def test_each_round_draws_only_what_could_settle_it():
+    tester = ScriptedTester(["a", "b", "a", "a", "b"])
+    assert collect(tester, 5) == ["a", "b", "a", "a"]
+    # Three agreeing votes would settle a budget of 5; after a, b, a one more a does
+    assert tester.draws == [(0, 3), (3, 1)]
+
+
+def test_disagreement_draws_the_whole_budget():
+    tester = ScriptedTester(["a", "b", "b", "a", "c"])
+    assert collect(tester, 5) == ["a", "b", "b", "a", "c"]
+    assert tester.draws == [(0, 3), (3, 1), (4, 1)]
+
+
+def test_collect_continues_from_earlier_votes():
+    tester = ScriptedTester(["a", "b", "a", "a", "b"])
+    results = asyncio.run(tester._collect_votes("transcript", tester.models[0], votes("a", "b"), 5))
+    assert [r["intent"] for r in results] == ["a", "b", "a", "a"]
+    assert tester.draws == [(2, 2)]
+
+
+def classify(tester: ScriptedTester) -> Dict:
+    return asyncio.run(tester.adaptive_ensemble_classify("transcript", tester.models[0]))
+
+
+def test_early_exit_reports_calls_saved():
+    result = classify(ScriptedTester(["a", "a", "a"], ensemble_votes=3))
+    assert result["intent"] == "a"
+    assert result["calls_saved"] == 1
+    assert result["escalation_calls"] == 0
+    assert result["escalated"] is None
+
+
+def test_escalating_to_more_samples_reports_the_extra_calls_apart():
+    tester = ScriptedTester(["a", "b", "b", "a", "a"], ensemble_votes=3, escalation="samples")
+    result = classify(tester)
+    assert result["escalated"] == "samples"
+    assert result["intent"] == "a"
+    assert result["calls_saved"] == 0
+    assert result["escalation_calls"] == 2
+    assert len(result["individual_results"]) == 5
+
+
+def test_escalating_to_a_stronger_model_counts_its_call():
+    tester = ScriptedTester(["a", "b", "c"], ensemble_votes=3, escalation="model")
+    result = classify(tester)
+    assert tester.escalated_to == [tester.models[1]]
+    assert result["intent"] == "voice_interested"
+    assert result["calls_saved"] == 0
+    assert result["escalation_calls"] == 1